@@ -0,0 +1,97 @@
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from disk_lru import DiskLRU
+from single_flight import SingleFlight
+
+
+class EntryTooLarge(Exception):
+    pass
+
+
+class AudioCache:
+    """按曲目缓存完整音频文件的磁盘 LRU，命中时由 ffmpeg 直接读取本地文件
+
+    同一曲目被请求 admit_after 次后才下载入缓存，只播放一次的曲目不会额外占用带宽；
+    相同 key 的并发下载只进行一次。
+    """
+
+    def __init__(self, disk_dir: str, max_bytes: int, max_entry_bytes: int, admit_after: int = 2, max_tracked: int = 4096):
+        self.max_bytes = max_bytes
+        self.max_entry_bytes = min(max_entry_bytes, max_bytes)
+        self.admit_after = admit_after
+        self.max_tracked = max_tracked
+
+        self._disk = DiskLRU(disk_dir, max_bytes)
+        # 尚未缓存的曲目被请求的次数
+        self._requests: OrderedDict[str, int] = OrderedDict()
+        self._inflight = SingleFlight()
+
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0, "fills": 0, "bytes_saved": 0}
+
+    async def load(self):
+        """启动后在后台读入已有的缓存文件；读完之前它们视为未命中"""
+        await self._disk.load()
+
+    def lookup(self, key: str) -> str | None:
+        """命中时返回本地文件路径"""
+        size = self._disk.get(key)
+        if size is None:
+            self.stats["misses"] += 1
+            return None
+        path = self._disk.path(key)
+        try:
+            os.utime(path)
+        except FileNotFoundError:
+            self._disk.discard(key)
+            self.stats["misses"] += 1
+            return None
+        self.stats["hits"] += 1
+        self.stats["bytes_saved"] += size
+        return path
+
+    def wants(self, key: str) -> bool:
+        """记录一次未命中的请求，返回是否应当下载入缓存；已在下载中时无需再发起"""
+        if key in self._inflight:
+            return False
+        count = self._requests.pop(key, 0) + 1
+        self._requests[key] = count
+        while len(self._requests) > self.max_tracked:
+            self._requests.popitem(last=False)
+        return count >= self.admit_after
+
+    async def fill(self, key: str, download: Callable[[str, int], Awaitable[None]]) -> str | None:
+        """把曲目下载到缓存并返回文件路径；download(临时路径, 大小上限) 负责写入文件，失败时返回 None"""
+        return await self._inflight.run(key, lambda: self._fill(key, download), self._count_coalesced)
+
+    def _count_coalesced(self):
+        self.stats["coalesced"] += 1
+
+    async def _fill(self, key: str, download: Callable[[str, int], Awaitable[None]]) -> str | None:
+        path = self._disk.path(key)
+        tmp_path = self._disk.tmp_path(key)
+        try:
+            await download(tmp_path, self.max_entry_bytes)
+            size = os.path.getsize(tmp_path)
+            # 写完整个文件后再原子替换，播放方不会读到半截文件
+            os.replace(tmp_path, path)
+            self._requests.pop(key, None)
+            self._disk.add(key, size)
+            self.stats["fills"] += 1
+            return path if key in self._disk else None
+        except Exception:
+            return None
+        finally:
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+
+    def summary(self) -> dict:
+        hits = self.stats["hits"]
+        total = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": hits / total if total else 0.0,
+            "disk_bytes": self._disk.size,
+            "entries": len(self._disk),
+        }
@@ -0,0 +1,142 @@
+"""对比 PCM（进程内编码 Opus）和 Opus（ffmpeg 编码/透传）两种播放路径的 CPU 开销
+
+用法：
+    python benchmarks/codec_cpu.py [--input 音频文件] [--streams 1,4,16] [--seconds 30] [--bitrate 64] [--json 输出文件]
+
+不指定 --input 时用 ffmpeg 生成一段粉噪声作为测试音频。结果为每路流每秒音频消耗的 CPU 秒数，
+包括机器人进程本身（含编码线程）和 ffmpeg 子进程。
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+
+import discord
+
+FRAME_SIZE = discord.opus.Encoder.FRAME_SIZE
+FRAMES_PER_SECOND = 50
+
+
+def _cpu_seconds() -> tuple[float, float]:
+    own = resource.getrusage(resource.RUSAGE_SELF)
+    children = resource.getrusage(resource.RUSAGE_CHILDREN)
+    return own.ru_utime + own.ru_stime, children.ru_utime + children.ru_stime
+
+
+def _generate_input(ffmpeg: str, seconds: int) -> str:
+    path = os.path.join(tempfile.gettempdir(), f"ottocord_bench_{seconds}s.flac")
+    if not os.path.exists(path):
+        subprocess.run(
+            [ffmpeg, "-y", "-loglevel", "error", "-f", "lavfi", "-i", f"anoisesrc=color=pink:duration={seconds}",
+             "-ac", "2", "-ar", "48000", path],
+            check=True,
+        )
+    return path
+
+
+def _load_opus():
+    if discord.opus.is_loaded():
+        return True
+    for name in ("libopus.so.0", "opus"):
+        try:
+            discord.opus.load_opus(name)
+            return True
+        except OSError:
+            continue
+    return False
+
+
+def _consume_pcm(path: str, ffmpeg: str, frames: int, bitrate: int):
+    # 与 VoiceClient 发送 PCM 源时相同：ffmpeg 输出 PCM，进程内逐帧编码 Opus
+    source = discord.FFmpegPCMAudio(path, executable=ffmpeg)
+    encoder = discord.opus.Encoder()
+    encoder.set_bitrate(bitrate)
+    try:
+        for _ in range(frames):
+            pcm = source.read()
+            if not pcm:
+                break
+            encoder.encode(pcm, FRAME_SIZE)
+    finally:
+        source.cleanup()
+
+
+def _consume_opus(path: str, ffmpeg: str, frames: int, bitrate: int):
+    source = discord.FFmpegOpusAudio(path, bitrate=bitrate, executable=ffmpeg)
+    try:
+        for _ in range(frames):
+            if not source.read():
+                break
+    finally:
+        source.cleanup()
+
+
+def run(mode: str, path: str, ffmpeg: str, streams: int, seconds: int, bitrate: int) -> dict:
+    consume = _consume_pcm if mode == "pcm" else _consume_opus
+    frames = seconds * FRAMES_PER_SECOND
+
+    own_before, children_before = _cpu_seconds()
+    started = time.perf_counter()
+    threads = [threading.Thread(target=consume, args=(path, ffmpeg, frames, bitrate)) for _ in range(streams)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    wall = time.perf_counter() - started
+    own_after, children_after = _cpu_seconds()
+
+    own = own_after - own_before
+    children = children_after - children_before
+    audio_seconds = seconds * streams
+    return {
+        "mode": mode,
+        "streams": streams,
+        "audio_seconds": audio_seconds,
+        "wall_seconds": round(wall, 3),
+        "bot_cpu_seconds": round(own, 3),
+        "ffmpeg_cpu_seconds": round(children, 3),
+        # 每路流播放 1 秒音频消耗的 CPU 秒数（即实时播放时单路流占用的 CPU 比例）
+        "cpu_per_stream": round((own + children) / audio_seconds, 5),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="PCM / Opus 播放路径 CPU 开销对比")
+    parser.add_argument("--input", help="测试音频文件，默认生成粉噪声")
+    parser.add_argument("--ffmpeg", default="ffmpeg")
+    parser.add_argument("--streams", default="1,4,16", help="并发流数量，逗号分隔")
+    parser.add_argument("--seconds", type=int, default=30, help="每路流解码的音频时长（秒）")
+    parser.add_argument("--bitrate", type=int, default=64, help="Opus 码率（kbps），对应语音频道码率")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    args = parser.parse_args()
+
+    path = args.input or _generate_input(args.ffmpeg, args.seconds)
+    modes = ["opus"]
+    if _load_opus():
+        modes.insert(0, "pcm")
+    else:
+        print("⚠️ 未加载 libopus，跳过 PCM 路径", file=sys.stderr)
+
+    results = []
+    for streams in (int(n) for n in args.streams.split(",")):
+        for mode in modes:
+            result = run(mode, path, args.ffmpeg, streams, args.seconds, args.bitrate)
+            results.append(result)
+            print(
+                f"{mode:>4} | {streams:>3} 路 | 墙钟 {result['wall_seconds']:>7.2f}s | "
+                f"机器人 CPU {result['bot_cpu_seconds']:>7.2f}s | ffmpeg CPU {result['ffmpeg_cpu_seconds']:>7.2f}s | "
+                f"单路占用 {result['cpu_per_stream'] * 100:.2f}%"
+            )
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump({"input": path, "bitrate": args.bitrate, "results": results}, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
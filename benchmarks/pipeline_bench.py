@@ -0,0 +1,401 @@
+"""播放链路延迟基准测试：本地模拟 musix_server / ottoTTS_server / CDN 和语音客户端，不需要连接 Discord
+
+用法：
+    python benchmarks/pipeline_bench.py [--scenarios speak,play_url,stream_url,bilibili,netease] [--runs 5]
+        [--musix-latency 50] [--tts-latency 300] [--cdn-latency 30] [--cdn-rate 0]
+        [--track-seconds 30] [--tts-seconds 3] [--realtime] [--warm] [--json 输出文件] [--baseline 旧结果]
+
+对每个场景调用 TTSPlayerService 对应的入口方法，等待队列播放完毕后，按阶段统计本次运行的耗时：
+元数据获取、TTS 合成、下载、临时文件写入、ffmpeg 启动、加入队列到第一帧。
+各阶段耗时取自 metrics 模块中对应直方图在本次运行前后的差值，与线上导出的指标口径一致。
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from datetime import datetime, timezone
+
+from aiohttp import web
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import metrics  # noqa: E402
+from tts_player_service import TTSPlayerService  # noqa: E402
+
+SCENARIOS = ("speak", "play_url", "stream_url", "bilibili", "netease")
+
+# 阶段名 -> 对应的直方图；加入队列到第一帧按曲目类型分别统计
+STAGES = {
+    "metadata": metrics.MUSIX_SECONDS,
+    "tts": metrics.TTS_SECONDS,
+    "download": metrics.DOWNLOAD_SECONDS,
+    "tempfile_write": metrics.TEMPFILE_WRITE_SECONDS,
+    "ffmpeg_spawn": metrics.FFMPEG_SPAWN_SECONDS,
+}
+FIRST_FRAME_KINDS = ("tts", "url", "stream")
+
+
+def _generate_audio(ffmpeg: str, seconds: float, suffix: str, *args: str) -> bytes:
+    path = os.path.join(tempfile.gettempdir(), f"ottocord_pipeline_{seconds}s{suffix}")
+    if not os.path.exists(path):
+        subprocess.run(
+            [ffmpeg, "-y", "-loglevel", "error", "-f", "lavfi", "-i", f"anoisesrc=color=pink:duration={seconds}", *args, path],
+            check=True,
+        )
+    with open(path, "rb") as f:
+        return f.read()
+
+
+class FakeServers:
+    """在同一个 aiohttp 应用上模拟 musix 接口、TTS 接口和音频 CDN"""
+
+    def __init__(self, args, track: bytes, speech: bytes):
+        self.args = args
+        self.track = track
+        self.speech = speech
+        self.base_url = ""
+        self.runner: web.AppRunner | None = None
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_get("/api/v1/bilibili/videos/{bvid}", self.bilibili)
+        app.router.add_get("/api/v1/netease/songs/{id}", self.netease)
+        app.router.add_post("/speak", self.speak)
+        app.router.add_get("/cdn/{name}", self.cdn)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, "127.0.0.1", 0)
+        await site.start()
+        port = site._server.sockets[0].getsockname()[1]  # type: ignore
+        self.base_url = f"http://127.0.0.1:{port}"
+
+    async def stop(self):
+        if self.runner:
+            await self.runner.cleanup()
+
+    @property
+    def track_url(self) -> str:
+        return f"{self.base_url}/cdn/track.mp3"
+
+    async def bilibili(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.args.musix_latency / 1000)
+        bvid = request.match_info["bvid"]
+        return web.json_response({"data": {
+            "title": f"测试视频 {bvid}",
+            "desc": "",
+            "pic": f"{self.base_url}/cdn/cover.jpg",
+            "pubdate": int(time.time()),
+            "stat": {"view": 0, "like": 0, "coin": 0, "favorite": 0, "danmaku": 0, "share": 0},
+            "owner": {"name": "bench", "face": f"{self.base_url}/cdn/face.jpg"},
+            "audio_url": self.track_url,
+        }})
+
+    async def netease(self, request: web.Request) -> web.Response:
+        await asyncio.sleep(self.args.musix_latency / 1000)
+        song_id = request.match_info["id"]
+        return web.json_response({"data": {
+            "title": f"测试歌曲 {song_id}",
+            "author": "bench",
+            "album_name": "bench",
+            "album_pic": f"{self.base_url}/cdn/cover.jpg",
+            "download_url": self.track_url,
+            "duration": f"{self.args.track_seconds}s",
+        }})
+
+    async def speak(self, request: web.Request) -> web.Response:
+        await request.json()
+        await asyncio.sleep(self.args.tts_latency / 1000)
+        return web.Response(body=self.speech, content_type="audio/wav")
+
+    async def cdn(self, request: web.Request) -> web.StreamResponse:
+        await asyncio.sleep(self.args.cdn_latency / 1000)
+        resp = web.StreamResponse(headers={"Content-Type": "audio/mpeg", "Content-Length": str(len(self.track))})
+        await resp.prepare(request)
+        chunk_size = 64 * 1024
+        for offset in range(0, len(self.track), chunk_size):
+            await resp.write(self.track[offset:offset + chunk_size])
+            if self.args.cdn_rate:
+                # 按 --cdn-rate（KB/s）限速
+                await asyncio.sleep(chunk_size / (self.args.cdn_rate * 1024))
+        await resp.write_eof()
+        return resp
+
+
+class FakeVoiceClient:
+    """在后台线程中逐帧读取音频源，相当于只消费不发送的 VoiceClient"""
+
+    def __init__(self, bot, channel, realtime: bool):
+        self.bot = bot
+        self.channel = channel
+        self.guild = channel.guild
+        self.realtime = realtime
+        self.frames = 0
+        self._connected = True
+        self._playing = False
+        self._stopped = threading.Event()
+
+    def is_connected(self) -> bool:
+        return self._connected
+
+    def is_playing(self) -> bool:
+        return self._playing
+
+    def play(self, source, *, after=None):
+        self._playing = True
+        self._stopped.clear()
+        threading.Thread(target=self._run, args=(source, after), daemon=True).start()
+
+    def _run(self, source, after):
+        error = None
+        try:
+            while not self._stopped.is_set():
+                if not source.read():
+                    break
+                self.frames += 1
+                if self.realtime:
+                    time.sleep(0.02)
+        except Exception as e:
+            error = e
+        finally:
+            # 与 discord.player.AudioPlayer 的顺序一致：先回调，再清理音频源
+            self._playing = False
+            if after:
+                after(error)
+            try:
+                source.cleanup()
+            except Exception:
+                pass
+
+    def stop(self):
+        self._stopped.set()
+
+    async def disconnect(self, force: bool = False):
+        self._stopped.set()
+        self._connected = False
+        if self in self.bot.voice_clients:
+            self.bot.voice_clients.remove(self)
+
+
+class FakeGuild:
+    def __init__(self, guild_id: int):
+        self.id = guild_id
+
+
+class FakeVoiceChannel:
+    def __init__(self, bot, guild_id: int, connect_latency: float, realtime: bool):
+        self.bot = bot
+        self.id = guild_id * 10
+        self.guild = FakeGuild(guild_id)
+        self.bitrate = 64000
+        self.connect_latency = connect_latency
+        self.realtime = realtime
+
+    async def connect(self):
+        await asyncio.sleep(self.connect_latency / 1000)
+        vc = FakeVoiceClient(self.bot, self, self.realtime)
+        self.bot.voice_clients.append(vc)
+        return vc
+
+
+class FakeBot:
+    def __init__(self):
+        self.voice_clients: list[FakeVoiceClient] = []
+        self.loop = asyncio.get_running_loop()
+
+
+class FakeCommand:
+    def __init__(self, name: str):
+        self.name = name
+
+
+class FakeResponse:
+    def __init__(self):
+        self.done = False
+
+    def is_done(self) -> bool:
+        return self.done
+
+
+class FakeInteraction:
+    def __init__(self):
+        self.created_at = datetime.now(timezone.utc)
+
+
+class FakeMessage:
+    """respond 返回的消息，编辑后的内容同样记入回复"""
+
+    def __init__(self, ctx: "FakeContext"):
+        self.ctx = ctx
+
+    async def edit(self, content=None, **kwargs):
+        if content is not None:
+            self.ctx.responses.append(str(content))
+        return self
+
+
+class FakeContext:
+    """只记录回复内容的 ApplicationContext"""
+
+    def __init__(self, command: str):
+        self.command = FakeCommand(command)
+        self.interaction = FakeInteraction()
+        self.response = FakeResponse()
+        self.responses: list[str] = []
+
+    async def respond(self, content=None, **kwargs):
+        self.response.done = True
+        self.responses.append(str(content))
+        return FakeMessage(self)
+
+
+def _snapshot() -> dict[str, tuple[float, int]]:
+    values = {}
+    for stage, histogram in STAGES.items():
+        states = list(histogram.values.values())
+        values[stage] = (sum(state[-2] for state in states), int(sum(state[-1] for state in states)))
+    for kind in FIRST_FRAME_KINDS:
+        state = metrics.FIRST_AUDIO_SECONDS.values.get((kind,))
+        values[f"first_frame_{kind}"] = (state[-2], int(state[-1])) if state else (0.0, 0)
+    return values
+
+
+async def run_scenario(service: TTSPlayerService, servers: FakeServers, args, scenario: str, run: int, guild_id: int) -> dict:
+    bot = service.bot
+    channel = FakeVoiceChannel(bot, guild_id, args.connect_latency, args.realtime)
+    ctx = FakeContext(scenario)
+    # 默认每次运行使用不同的文本和 id，避免命中 TTS / 元数据缓存；--warm 时复用
+    suffix = "" if args.warm else f" {run}"
+    speak_url = f"{servers.base_url}/speak"
+
+    before = _snapshot()
+    started = time.perf_counter()
+    if scenario == "speak":
+        await service.join_and_speak(channel, f"基准测试{suffix}", speak_url, ctx)  # type: ignore
+    elif scenario == "play_url":
+        await service.join_and_play_url(channel, servers.track_url, ctx)  # type: ignore
+    elif scenario == "stream_url":
+        await service.join_and_stream_url(channel, servers.track_url, ctx)  # type: ignore
+    elif scenario == "bilibili":
+        await service.join_and_play_bilibili(channel, f"BVbench{suffix.strip()}", ctx)  # type: ignore
+    elif scenario == "netease":
+        await service.join_and_play_netease(channel, 1000 + (0 if args.warm else run), ctx)  # type: ignore
+
+    # 播放器常驻到空闲超时，这里只等待本次加入的曲目全部播放完毕
+    await service.queues[guild_id].join()
+    wall = time.perf_counter() - started
+    after = _snapshot()
+
+    stages = {}
+    for stage, (total, count) in after.items():
+        delta_count = count - before[stage][1]
+        if delta_count:
+            stages[stage] = round((total - before[stage][0]) * 1000, 2)
+    errors = [response for response in ctx.responses if response.startswith("❌")]
+    return {"wall_ms": round(wall * 1000, 2), "stages_ms": stages, "errors": errors}
+
+
+def _summarize(runs: list[dict]) -> dict:
+    summary = {"wall_ms": _describe([run["wall_ms"] for run in runs]), "stages_ms": {}, "errors": sum(len(run["errors"]) for run in runs)}
+    stage_names = sorted({stage for run in runs for stage in run["stages_ms"]})
+    for stage in stage_names:
+        summary["stages_ms"][stage] = _describe([run["stages_ms"][stage] for run in runs if stage in run["stages_ms"]])
+    return summary
+
+
+def _describe(values: list[float]) -> dict:
+    return {
+        "mean": round(statistics.fmean(values), 2),
+        "p50": round(statistics.median(values), 2),
+        "min": round(min(values), 2),
+        "max": round(max(values), 2),
+    }
+
+
+def _print_summary(scenario: str, summary: dict, baseline: dict | None):
+    print(f"== {scenario}（墙钟 {summary['wall_ms']['mean']:.1f} ms，错误 {summary['errors']}）")
+    for stage, values in summary["stages_ms"].items():
+        line = f"   {stage:<20} mean {values['mean']:>9.2f} ms | p50 {values['p50']:>9.2f} | min {values['min']:>9.2f} | max {values['max']:>9.2f}"
+        old = (baseline or {}).get(scenario, {}).get("stages_ms", {}).get(stage)
+        if old and old["mean"]:
+            line += f" | 对比基线 {(values['mean'] - old['mean']) / old['mean'] * 100:+.1f}%"
+        print(line)
+
+
+async def main_async(args) -> dict:
+    track = _generate_audio(args.ffmpeg, args.track_seconds, ".mp3", "-ac", "2", "-ar", "44100", "-b:a", f"{args.track_kbps}k")
+    speech = _generate_audio(args.ffmpeg, args.tts_seconds, ".wav", "-ac", "1", "-ar", "24000")
+    servers = FakeServers(args, track, speech)
+    await servers.start()
+
+    os.environ["SPEAK_API_URL"] = f"{servers.base_url}/speak"
+    service = TTSPlayerService(FakeBot(), ffmpeg_path=args.ffmpeg)  # type: ignore
+    service.musix.api_url = f"{servers.base_url}/api/v1"
+
+    results = {}
+    guild_id = 1
+    try:
+        for scenario in args.scenarios.split(","):
+            if scenario not in SCENARIOS:
+                raise SystemExit(f"未知场景：{scenario}（可选 {', '.join(SCENARIOS)}）")
+            runs = []
+            for run in range(args.runs):
+                runs.append(await run_scenario(service, servers, args, scenario, run, guild_id))
+                guild_id += 1
+            results[scenario] = {**_summarize(runs), "runs": runs}
+    finally:
+        await service.http_pool.close()
+        await servers.stop()
+
+    return {
+        "created_at": time.strftime("%Y-%m-%dT%H:%M:%S"),
+        "python": platform.python_version(),
+        "platform": platform.platform(),
+        "env": {name: os.getenv(name) for name in ("AUDIO_ENCODER", "AUDIO_PLAYBACK_MODE", "DOWNLOAD_MODE") if os.getenv(name)},
+        "config": {name: value for name, value in vars(args).items() if name not in ("json", "baseline")},
+        "payload_bytes": {"track": len(track), "tts": len(speech)},
+        "results": results,
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="播放链路各阶段延迟基准测试")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="要运行的场景，逗号分隔")
+    parser.add_argument("--runs", type=int, default=5, help="每个场景的运行次数")
+    parser.add_argument("--ffmpeg", default="ffmpeg")
+    parser.add_argument("--musix-latency", type=float, default=50, help="模拟 musix 接口延迟（毫秒）")
+    parser.add_argument("--tts-latency", type=float, default=300, help="模拟 TTS 合成延迟（毫秒）")
+    parser.add_argument("--cdn-latency", type=float, default=30, help="模拟 CDN 首字节延迟（毫秒）")
+    parser.add_argument("--cdn-rate", type=float, default=0, help="CDN 限速（KB/s），0 表示不限速")
+    parser.add_argument("--connect-latency", type=float, default=0, help="模拟连接语音频道耗时（毫秒）")
+    parser.add_argument("--track-seconds", type=float, default=30, help="模拟曲目时长（秒），决定下载大小")
+    parser.add_argument("--track-kbps", type=int, default=128, help="模拟曲目 MP3 码率")
+    parser.add_argument("--tts-seconds", type=float, default=3, help="模拟合成语音时长（秒）")
+    parser.add_argument("--realtime", action="store_true", help="按 20ms/帧的实时速度消费音频，默认尽快读完")
+    parser.add_argument("--warm", action="store_true", help="每次运行使用相同的文本和 id，测试缓存命中时的延迟")
+    parser.add_argument("--json", help="把结果写入 JSON 文件")
+    parser.add_argument("--baseline", help="之前保存的 JSON 结果，输出各阶段均值的变化")
+    args = parser.parse_args()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)["results"]
+
+    report = asyncio.run(main_async(args))
+    for scenario, summary in report["results"].items():
+        _print_summary(scenario, summary, baseline)
+
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
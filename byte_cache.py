@@ -0,0 +1,119 @@
+import asyncio
+import hashlib
+import os
+from collections import OrderedDict
+from typing import Awaitable, Callable
+
+from disk_lru import DiskLRU
+from persist import write_atomic
+from single_flight import SingleFlight
+
+
+def make_key(*parts) -> str:
+    """根据若干字段生成内容寻址的缓存 key"""
+    return hashlib.sha256("\x1f".join(str(part) for part in parts).encode("utf-8")).hexdigest()
+
+
+class ByteCache:
+    """内存 + 磁盘两级 LRU 字节缓存，相同 key 的并发请求只回源一次"""
+
+    def __init__(self, memory_bytes: int, disk_bytes: int = 0, disk_dir: str | None = None):
+        self.memory_bytes = memory_bytes
+        self.disk_bytes = disk_bytes
+
+        self._memory: OrderedDict[str, bytes] = OrderedDict()
+        self._memory_size = 0
+        self._disk = DiskLRU(disk_dir, disk_bytes) if disk_dir and disk_bytes > 0 else None
+        self._inflight = SingleFlight()
+        self._background: set[asyncio.Task] = set()
+
+        self.stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0}
+
+    async def load(self):
+        """启动后在后台读入磁盘层索引；读完之前磁盘上已有的条目视为未命中"""
+        if self._disk is not None:
+            await self._disk.load()
+
+    def _put_memory(self, key: str, data: bytes):
+        if len(data) > self.memory_bytes:
+            return
+        old = self._memory.pop(key, None)
+        if old is not None:
+            self._memory_size -= len(old)
+        self._memory[key] = data
+        self._memory_size += len(data)
+        while self._memory_size > self.memory_bytes:
+            _, evicted = self._memory.popitem(last=False)
+            self._memory_size -= len(evicted)
+
+    @staticmethod
+    def _read_disk(path: str) -> bytes:
+        with open(path, "rb") as f:
+            data = f.read()
+        os.utime(path)
+        return data
+
+    def _spawn(self, coro):
+        task = asyncio.create_task(coro)
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _store_disk(self, key: str, data: bytes):
+        if self._disk is None or len(data) > self.disk_bytes:
+            return
+        try:
+            await asyncio.to_thread(write_atomic, self._disk.path(key), data)
+        except OSError:
+            return
+        self._disk.add(key, len(data))
+
+    async def get(self, key: str) -> bytes | None:
+        data = self._memory.get(key)
+        if data is not None:
+            self._memory.move_to_end(key)
+            self.stats["memory_hits"] += 1
+            return data
+
+        if self._disk is not None and key in self._disk:
+            try:
+                data = await asyncio.to_thread(self._read_disk, self._disk.path(key))
+            except OSError:
+                self._disk.discard(key)
+                return None
+            self._disk.touch(key)
+            self._put_memory(key, data)
+            self.stats["disk_hits"] += 1
+            return data
+
+        return None
+
+    def put(self, key: str, data: bytes):
+        self._put_memory(key, data)
+        self._spawn(self._store_disk(key, data))
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[bytes]]) -> bytes:
+        data = await self.get(key)
+        if data is not None:
+            return data
+
+        async def fetch_and_store():
+            self.stats["misses"] += 1
+            data = await fetch()
+            self.put(key, data)
+            return data
+
+        # 已有相同请求在路上时直接等待其结果
+        return await self._inflight.run(key, fetch_and_store, self._count_coalesced)
+
+    def _count_coalesced(self):
+        self.stats["coalesced"] += 1
+
+    def summary(self) -> dict:
+        hits = self.stats["memory_hits"] + self.stats["disk_hits"] + self.stats["coalesced"]
+        total = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": hits / total if total else 0.0,
+            "memory_bytes": self._memory_size,
+            "disk_bytes": self._disk.size if self._disk is not None else 0,
+        }
@@ -0,0 +1,84 @@
+import asyncio
+import os
+from collections import OrderedDict
+
+
+class DiskLRU:
+    """一个目录内缓存文件的 LRU 索引：只记录文件名和大小，超出容量时删除最久未用的文件
+
+    文件由调用方写入 tmp_path(key) 后原子替换到 path(key)，再用 add() 登记。
+    """
+
+    def __init__(self, directory: str, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self.size = 0
+        self._entries: OrderedDict[str, int] = OrderedDict()
+
+        os.makedirs(self.directory, exist_ok=True)
+
+    def __contains__(self, key: str) -> bool:
+        return key in self._entries
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def path(self, key: str) -> str:
+        return os.path.join(self.directory, key)
+
+    def tmp_path(self, key: str) -> str:
+        return f"{self.path(key)}.{os.getpid()}.tmp"
+
+    def _scan(self) -> list[tuple[float, str, int]]:
+        entries = []
+        own_tmp = f".{os.getpid()}.tmp"
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if name.endswith(".tmp"):
+                # 清理上次崩溃留下的临时文件，本进程正在写入的除外
+                if not name.endswith(own_tmp):
+                    os.remove(path)
+                continue
+            stat = os.stat(path)
+            entries.append((stat.st_mtime, name, stat.st_size))
+        return sorted(entries)
+
+    async def load(self):
+        """启动后在后台读入目录中已有的文件；读完之前它们视为未命中"""
+        entries = await asyncio.to_thread(self._scan)
+        # 按修改时间恢复 LRU 顺序，启动后新写入的条目排在最后
+        loaded = OrderedDict((name, size) for _, name, size in entries if name not in self._entries)
+        loaded.update(self._entries)
+        self._entries = loaded
+        self.size = sum(loaded.values())
+        self._evict()
+
+    def get(self, key: str) -> int | None:
+        """返回已登记文件的大小，并把它移到最近使用的位置"""
+        size = self._entries.get(key)
+        if size is not None:
+            self._entries.move_to_end(key)
+        return size
+
+    def touch(self, key: str):
+        if key in self._entries:
+            self._entries.move_to_end(key)
+
+    def add(self, key: str, size: int):
+        self.discard(key)
+        self._entries[key] = size
+        self.size += size
+        self._evict()
+
+    def discard(self, key: str):
+        """只移出索引，用于文件已不存在或读取失败的条目"""
+        self.size -= self._entries.pop(key, 0)
+
+    def _evict(self):
+        while self.size > self.max_bytes and self._entries:
+            key, size = self._entries.popitem(last=False)
+            self.size -= size
+            try:
+                os.remove(self.path(key))
+            except FileNotFoundError:
+                pass
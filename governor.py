@@ -0,0 +1,134 @@
+import asyncio
+import os
+from collections import OrderedDict, deque
+from contextlib import asynccontextmanager
+
+# 全局并发上限：播放中的 ffmpeg 进程、音频下载、TTS 请求
+GOVERNOR_MAX_FFMPEG = int(os.getenv("GOVERNOR_MAX_FFMPEG", "64"))
+GOVERNOR_MAX_DOWNLOADS = int(os.getenv("GOVERNOR_MAX_DOWNLOADS", "64"))
+GOVERNOR_MAX_TTS = int(os.getenv("GOVERNOR_MAX_TTS", "8"))
+
+
+class FairSemaphore:
+    """全局并发上限的信号量；名额不足时各服务器轮流获得空出的名额，单个服务器无法占满等待队列"""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.active = 0
+        # 服务器 -> 该服务器按先后顺序等待的请求；字典顺序即轮转顺序
+        self._waiters: OrderedDict[int, deque[asyncio.Future]] = OrderedDict()
+
+    @property
+    def waiting(self) -> int:
+        return sum(len(waiters) for waiters in self._waiters.values())
+
+    def busy(self) -> bool:
+        return self.active >= self.limit or bool(self._waiters)
+
+    def position(self, guild_id: int) -> int:
+        """按轮转顺序估算该服务器下一个请求的排队位置（从 1 开始）"""
+        if not self.busy():
+            return 0
+        mine = len(self._waiters.get(guild_id, ()))
+        # 每轮每个服务器取一个：本服务器已有 mine 个在等，其他服务器在此期间最多各被服务 mine + 1 次
+        ahead = mine + sum(min(len(waiters), mine + 1) for other, waiters in self._waiters.items() if other != guild_id)
+        return ahead + 1
+
+    async def acquire(self, guild_id: int):
+        if not self.busy():
+            self.active += 1
+            return
+
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.setdefault(guild_id, deque()).append(future)
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # 名额已经转交给本请求，交还给下一个
+                self.release()
+            else:
+                self._discard(guild_id, future)
+            raise
+
+    def _discard(self, guild_id: int, future: asyncio.Future):
+        waiters = self._waiters.get(guild_id)
+        if waiters is None:
+            return
+        try:
+            waiters.remove(future)
+        except ValueError:
+            pass
+        if not waiters:
+            del self._waiters[guild_id]
+
+    def release(self):
+        # 名额直接交给轮转中的下一个服务器，active 不变
+        while self._waiters:
+            guild_id, waiters = next(iter(self._waiters.items()))
+            future = waiters.popleft()
+            del self._waiters[guild_id]
+            if waiters:
+                # 该服务器还有请求，排到本轮末尾
+                self._waiters[guild_id] = waiters
+            if not future.done():
+                future.set_result(None)
+                return
+        self.active -= 1
+
+
+class Slot:
+    """已取得的一个名额；阻塞在与该资源无关的等待上时可以暂时交还"""
+
+    def __init__(self, semaphore: FairSemaphore, guild_id: int):
+        self.semaphore = semaphore
+        self.guild_id = guild_id
+        self.held = False
+
+    async def acquire(self):
+        await self.semaphore.acquire(self.guild_id)
+        self.held = True
+
+    def release(self):
+        if self.held:
+            self.held = False
+            self.semaphore.release()
+
+    @asynccontextmanager
+    async def paused(self):
+        """期间不占名额，结束后重新排队取得；排队时被取消则不再持有"""
+        self.release()
+        try:
+            yield
+        finally:
+            await self.acquire()
+
+
+class Governor:
+    """TTSPlayerService 的全局资源调度：各类资源的并发上限和服务器间的公平分配"""
+
+    def __init__(self):
+        self.resources = {
+            "ffmpeg": FairSemaphore(GOVERNOR_MAX_FFMPEG),
+            "download": FairSemaphore(GOVERNOR_MAX_DOWNLOADS),
+            "tts": FairSemaphore(GOVERNOR_MAX_TTS),
+        }
+
+    @asynccontextmanager
+    async def slot(self, resource: str, guild_id: int):
+        slot = Slot(self.resources[resource], guild_id)
+        await slot.acquire()
+        try:
+            yield slot
+        finally:
+            slot.release()
+
+    def position(self, resource: str, guild_id: int) -> int:
+        return self.resources[resource].position(guild_id)
+
+    def stats(self) -> dict:
+        return {
+            (resource, state): value
+            for resource, semaphore in self.resources.items()
+            for state, value in (("active", semaphore.active), ("waiting", semaphore.waiting), ("limit", semaphore.limit))
+        }
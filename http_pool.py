@@ -0,0 +1,48 @@
+import os
+
+import aiohttp
+
+
+def _env_int(name: str, default: int) -> int:
+    value = os.getenv(name)
+    return int(value) if value else default
+
+
+# 边下边播等随播放进度读取、占用连接直到曲目结束的请求单独使用 stream 连接池；
+# 其并发已由全局资源调度的下载名额限制，连接池本身默认不限制
+_UNLIMITED_UPSTREAMS = ("stream",)
+
+
+class HTTPPool:
+    """按上游（musix / tts / cdn / stream）划分的长连接 HTTP 客户端池"""
+
+    def __init__(self):
+        self.limit = _env_int("HTTP_POOL_LIMIT", 100)
+        self.limit_per_host = _env_int("HTTP_LIMIT_PER_HOST", 10)
+        self.dns_cache_ttl = _env_int("HTTP_DNS_CACHE_TTL", 300)
+        self.keepalive_timeout = _env_int("HTTP_KEEPALIVE_TIMEOUT", 60)
+        self._sessions: dict[str, aiohttp.ClientSession] = {}
+
+    def session(self, upstream: str) -> aiohttp.ClientSession:
+        # 每个上游独立一个连接池，首次使用时在事件循环内创建
+        session = self._sessions.get(upstream)
+        if session is None or session.closed:
+            unlimited = upstream in _UNLIMITED_UPSTREAMS
+            connector = aiohttp.TCPConnector(
+                limit=0 if unlimited else self.limit,
+                # 单个上游可通过 HTTP_LIMIT_PER_HOST_<UPSTREAM> 覆盖
+                limit_per_host=_env_int(f"HTTP_LIMIT_PER_HOST_{upstream.upper()}", 0 if unlimited else self.limit_per_host),
+                use_dns_cache=True,
+                ttl_dns_cache=self.dns_cache_ttl,
+                keepalive_timeout=self.keepalive_timeout,
+            )
+            session = aiohttp.ClientSession(connector=connector)
+            self._sessions[upstream] = session
+        return session
+
+    async def close(self):
+        sessions = list(self._sessions.values())
+        self._sessions.clear()
+        for session in sessions:
+            if not session.closed:
+                await session.close()
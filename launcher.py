@@ -0,0 +1,102 @@
+"""多进程分片启动器：把分片范围分配给多个 otto.py 工作进程
+
+每个工作进程运行独立的机器人实例和 TTSPlayerService，只负责自己分片上的服务器。
+"""
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import urllib.request
+
+import dotenv
+
+from sharding import STATUS_INTERVAL, read_statuses, split_shards
+
+RESTART_DELAY = 5
+
+
+def log(message: str):
+    now = time.strftime("%H:%M:%S")
+    print(f"[{now}] [LAUNCHER] {message}", flush=True)
+
+
+def recommended_shard_count(token: str) -> int:
+    request = urllib.request.Request(
+        "https://discord.com/api/v10/gateway/bot",
+        headers={"Authorization": f"Bot {token}", "User-Agent": "ottocord-launcher"},
+    )
+    with urllib.request.urlopen(request, timeout=10) as resp:
+        return int(json.load(resp)["shards"])
+
+
+def spawn_worker(index: int, worker_count: int, shard_count: int, shard_ids: list[int]) -> subprocess.Popen:
+    env = {
+        **os.environ,
+        "SHARD_COUNT": str(shard_count),
+        "SHARD_IDS": ",".join(map(str, shard_ids)),
+        "WORKER_INDEX": str(index),
+        "WORKER_COUNT": str(worker_count),
+    }
+    log(f"🚀 启动工作进程 {index}，分片 {shard_ids[0]}-{shard_ids[-1]}")
+    return subprocess.Popen([sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "otto.py")], env=env)
+
+
+def print_status():
+    for status in read_statuses():
+        shards = " ".join(f"#{shard_id}:{'-' if latency is None else f'{latency}ms'}" for shard_id, latency in status["shards"].items())
+        flag = "⚠️ 失联" if status["stale"] else "✅"
+        log(f"{flag} 进程 {status['worker']} (pid {status['pid']}) | 服务器 {status['guilds']} | 语音 {status['voice_clients']} | {shards}")
+
+
+def main():
+    dotenv.load_dotenv()
+    shard_count_env = os.getenv("SHARD_COUNT") or "auto"
+    if shard_count_env == "auto":
+        shard_count = recommended_shard_count(str(os.getenv("TOKEN")))
+        log(f"📐 Discord 推荐分片数：{shard_count}")
+    else:
+        shard_count = int(shard_count_env)
+
+    process_count = int(os.getenv("SHARD_PROCESSES") or os.cpu_count() or 1)
+    ranges = split_shards(shard_count, process_count)
+    workers = {index: spawn_worker(index, len(ranges), shard_count, shard_ids) for index, shard_ids in enumerate(ranges)}
+
+    stopping = False
+
+    def stop(signum, frame):
+        nonlocal stopping
+        stopping = True
+
+    signal.signal(signal.SIGINT, stop)
+    signal.signal(signal.SIGTERM, stop)
+
+    last_status = time.monotonic()
+    while not stopping:
+        time.sleep(1)
+        for index, process in list(workers.items()):
+            code = process.poll()
+            if code is None or stopping:
+                continue
+            log(f"❌ 工作进程 {index} 退出（code {code}），{RESTART_DELAY} 秒后重启")
+            time.sleep(RESTART_DELAY)
+            workers[index] = spawn_worker(index, len(ranges), shard_count, ranges[index])
+
+        if time.monotonic() - last_status >= STATUS_INTERVAL * 4:
+            last_status = time.monotonic()
+            print_status()
+
+    log("🛑 正在停止所有工作进程")
+    for process in workers.values():
+        if process.poll() is None:
+            process.send_signal(signal.SIGINT)
+    for process in workers.values():
+        try:
+            process.wait(timeout=30)
+        except subprocess.TimeoutExpired:
+            process.kill()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""基于队列的异步日志：调用方只把记录放入内存队列，由后台线程负责格式化和写出"""
+import atexit
+import datetime
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import threading
+import time
+
+# 结构化字段会以 key=value（文本）或 JSON 字段的形式输出
+STRUCTURED_FIELDS = ("guild_id", "command", "track", "latency")
+
+
+class RateLimitFilter(logging.Filter):
+    """同一条日志在时间窗口内超过上限后丢弃，窗口结束后附带被省略的条数"""
+
+    def __init__(self, window: float, burst: int):
+        super().__init__()
+        self.window = window
+        self.burst = burst
+        self._lock = threading.Lock()
+        self._counters: dict[tuple, list] = {}
+
+    def filter(self, record: logging.LogRecord) -> bool:
+        if self.burst <= 0:
+            return True
+        key = (record.name, record.levelno, record.msg)
+        now = time.monotonic()
+        with self._lock:
+            state = self._counters.get(key)
+            if state is None or now - state[0] > self.window:
+                suppressed = state[2] if state else 0
+                self._counters[key] = [now, 1, 0]
+                if len(self._counters) > 4096:
+                    self._purge(now)
+                if suppressed:
+                    record.suppressed = suppressed
+                return True
+            state[1] += 1
+            if state[1] > self.burst:
+                state[2] += 1
+                return False
+            return True
+
+    def _purge(self, now: float):
+        for key in [key for key, state in self._counters.items() if now - state[0] > self.window]:
+            del self._counters[key]
+
+
+class TextFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        now = datetime.datetime.fromtimestamp(record.created).strftime("%H:%M:%S")
+        guild_id = getattr(record, "guild_id", None)
+        prefix = f"[{now}] [GUILD {guild_id}] " if guild_id is not None else f"[{now}] "
+        extras = " ".join(
+            f"{name}={getattr(record, name)}" for name in STRUCTURED_FIELDS[1:] if getattr(record, name, None) is not None
+        )
+        message = prefix + record.getMessage()
+        if extras:
+            message += f" | {extras}"
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            message += f"（已省略 {suppressed} 条重复日志）"
+        if record.exc_info:
+            message += "\n" + self.formatException(record.exc_info)
+        return message
+
+
+class JSONFormatter(logging.Formatter):
+    def format(self, record: logging.LogRecord) -> str:
+        data = {
+            "time": datetime.datetime.fromtimestamp(record.created).isoformat(timespec="milliseconds"),
+            "level": record.levelname,
+            "logger": record.name,
+            "message": record.getMessage(),
+        }
+        for name in STRUCTURED_FIELDS:
+            value = getattr(record, name, None)
+            if value is not None:
+                data[name] = value
+        suppressed = getattr(record, "suppressed", 0)
+        if suppressed:
+            data["suppressed"] = suppressed
+        if record.exc_info:
+            data["exception"] = self.formatException(record.exc_info)
+        return json.dumps(data, ensure_ascii=False, default=str)
+
+
+_listener: logging.handlers.QueueListener | None = None
+
+
+def setup_logging() -> logging.Logger:
+    """配置 ottocord 日志器：LOG_LEVEL 控制级别，LOG_FORMAT=json 输出 JSON"""
+    global _listener
+    logger = logging.getLogger("ottocord")
+    if _listener is not None:
+        return logger
+
+    output = logging.StreamHandler(sys.stdout)
+    output.setFormatter(JSONFormatter() if os.getenv("LOG_FORMAT") == "json" else TextFormatter())
+
+    # 无界队列，放入操作永不阻塞；真正的 I/O 在监听线程中完成
+    records: queue.SimpleQueue = queue.SimpleQueue()
+    handler = logging.handlers.QueueHandler(records)
+    handler.addFilter(RateLimitFilter(
+        window=float(os.getenv("LOG_RATE_WINDOW", "10")),
+        burst=int(os.getenv("LOG_RATE_BURST", "20")),
+    ))
+
+    logger.setLevel(os.getenv("LOG_LEVEL", "INFO").upper())
+    logger.addHandler(handler)
+    logger.propagate = False
+
+    _listener = logging.handlers.QueueListener(records, output)
+    _listener.start()
+    atexit.register(_listener.stop)
+    return logger
@@ -0,0 +1,131 @@
+import asyncio
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+
+import metrics
+from persist import WriteBehind
+from sharding import worker_path
+
+# off：不做响度均衡；cached：按缓存的测量结果单次调整增益，未测量过的曲目原样播放并在后台测量
+LOUDNESS_MODE = os.getenv("LOUDNESS_MODE", "off")
+LOUDNESS_TARGET_LUFS = float(os.getenv("LOUDNESS_TARGET_LUFS", "-16"))
+LOUDNESS_TRUE_PEAK = float(os.getenv("LOUDNESS_TRUE_PEAK", "-1.5"))
+LOUDNESS_MAX_GAIN = float(os.getenv("LOUDNESS_MAX_GAIN", "12"))
+# 每个进程单独一份索引，多进程运行时不会互相覆盖
+LOUDNESS_INDEX_PATH = worker_path(os.getenv("LOUDNESS_INDEX_PATH", os.path.join(tempfile.gettempdir(), "ottocord", "loudness.json")))
+LOUDNESS_INDEX_ENTRIES = int(os.getenv("LOUDNESS_INDEX_ENTRIES", "20000"))
+# 同时进行的后台测量数，避免与播放争抢 CPU
+LOUDNESS_ANALYSIS_CONCURRENCY = int(os.getenv("LOUDNESS_ANALYSIS_CONCURRENCY", "1"))
+
+logger = logging.getLogger("ottocord.loudness")
+
+
+def _parse_loudnorm(stderr: str) -> tuple[float, float] | None:
+    # loudnorm 在 stderr 末尾输出一段 JSON
+    start = stderr.rfind("{")
+    end = stderr.rfind("}")
+    if start < 0 or end < start:
+        return None
+    try:
+        result = json.loads(stderr[start:end + 1])
+        integrated = float(result["input_i"])
+        true_peak = float(result["input_tp"])
+    except (ValueError, KeyError):
+        return None
+    # 静音曲目的响度为 -inf，无需调整
+    if integrated == float("-inf"):
+        return None
+    return integrated, true_peak
+
+
+class LoudnessCache:
+    """按曲目记录积分响度和真峰值的持久化索引，测量在后台用 ffmpeg 完成，每首曲目只测一次"""
+
+    def __init__(self, ffmpeg_path: str = "ffmpeg", path: str = LOUDNESS_INDEX_PATH, max_entries: int = LOUDNESS_INDEX_ENTRIES):
+        self.ffmpeg_path = ffmpeg_path
+        self.path = path
+        self.max_entries = max_entries
+        self._entries: OrderedDict[str, tuple[float, float]] = OrderedDict()
+        self._inflight: set[str] = set()
+        self._background: set[asyncio.Task] = set()
+        self._semaphore = asyncio.Semaphore(LOUDNESS_ANALYSIS_CONCURRENCY)
+        self._writer = WriteBehind(path, lambda: dict(self._entries), logger, "响度索引")
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    async def load(self):
+        """启动后在后台读入索引；读完之前的测量结果先留在内存，读完后一并保存"""
+        entries = OrderedDict((key, (integrated, true_peak)) for key, (integrated, true_peak) in (await asyncio.to_thread(self._read)).items())
+        entries.update(self._entries)
+        self._entries = entries
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._writer.mark_ready()
+
+    def gain(self, key: str) -> float | None:
+        """已测量过的曲目返回应调整的增益（dB），否则返回 None"""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        integrated, true_peak = entry
+        # 提升音量时不让真峰值超过上限
+        gain = min(LOUDNESS_TARGET_LUFS - integrated, LOUDNESS_TRUE_PEAK - true_peak)
+        return max(-LOUDNESS_MAX_GAIN, min(gain, LOUDNESS_MAX_GAIN))
+
+    def analyze(self, key: str, source: bytes | str, headers: str | None = None):
+        """在后台测量曲目响度；source 为内存中的音频、本地文件路径或地址"""
+        # 索引读入之前无法判断是否测量过，先不测
+        if not self._writer.ready or key in self._inflight or key in self._entries:
+            return
+        self._inflight.add(key)
+        task = asyncio.create_task(self._analyze(key, source, headers))
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    async def _analyze(self, key: str, source: bytes | str, headers: str | None):
+        try:
+            async with self._semaphore:
+                started = time.monotonic()
+                result = await self._measure(source, headers)
+                metrics.LOUDNESS_ANALYSIS_SECONDS.observe(time.monotonic() - started)
+            if result is None:
+                return
+            self._entries[key] = result
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+            logger.info(f"🔊 响度测量完成：{result[0]:.1f} LUFS，真峰值 {result[1]:.1f} dBTP")
+            self._writer.schedule()
+        except Exception as e:
+            logger.warning(f"⚠️ 响度测量失败：{e}")
+        finally:
+            self._inflight.discard(key)
+
+    async def _measure(self, source: bytes | str, headers: str | None) -> tuple[float, float] | None:
+        args = [self.ffmpeg_path, "-hide_banner", "-nostats"]
+        if headers:
+            args += ["-headers", headers]
+        args += ["-i", "pipe:0" if isinstance(source, bytes) else source, "-vn",
+                 "-af", f"loudnorm=I={LOUDNESS_TARGET_LUFS}:TP={LOUDNESS_TRUE_PEAK}:print_format=json", "-f", "null", "-"]
+        process = await asyncio.create_subprocess_exec(
+            *args,
+            stdin=asyncio.subprocess.PIPE if isinstance(source, bytes) else asyncio.subprocess.DEVNULL,
+            stdout=asyncio.subprocess.DEVNULL,
+            stderr=asyncio.subprocess.PIPE,
+        )
+        try:
+            _, stderr = await process.communicate(source if isinstance(source, bytes) else None)
+        except asyncio.CancelledError:
+            process.kill()
+            raise
+        if process.returncode != 0:
+            raise Exception(f"ffmpeg 退出码 {process.returncode}")
+        return _parse_loudnorm(stderr.decode("utf-8", "replace"))
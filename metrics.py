@@ -0,0 +1,195 @@
+"""播放链路指标：进程内累加，可选通过本地 HTTP 端口以 Prometheus 文本格式导出
+
+记录操作只是字典累加，没有抓取方时也不会产生额外开销。
+"""
+import logging
+import math
+import os
+from datetime import datetime, timezone
+from typing import Callable
+
+from aiohttp import web
+
+from sharding import WORKER_INDEX
+
+logger = logging.getLogger("ottocord.metrics")
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _format_labels(names: tuple[str, ...], values: tuple, extra: str = "") -> str:
+    parts = [f'{name}="{str(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return "{" + ",".join(parts) + "}" if parts else ""
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return "+Inf" if value > 0 else "-Inf"
+    return repr(float(value))
+
+
+class _Metric:
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        REGISTRY.append(self)
+
+    def _key(self, labels: dict) -> tuple:
+        return tuple(labels.get(name, "") for name in self.labels)
+
+    def samples(self) -> list[str]:
+        raise NotImplementedError
+
+    def render(self) -> str:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        lines.extend(self.samples())
+        return "\n".join(lines)
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = ()):
+        super().__init__(name, help, labels)
+        self.values: dict[tuple, float] = {}
+
+    def inc(self, amount: float = 1, **labels):
+        key = self._key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self) -> list[str]:
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in list(self.values.items())]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value: float, **labels):
+        self.values[self._key(labels)] = value
+
+
+class CallbackGauge(_Metric):
+    """抓取时才调用回调计算当前值，热路径上零开销"""
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), callback: Callable[[], dict] | None = None):
+        super().__init__(name, help, labels)
+        self.callback = callback
+
+    def samples(self) -> list[str]:
+        if self.callback is None:
+            return []
+        try:
+            values = self.callback()
+        except Exception:
+            return []
+        return [f"{self.name}{_format_labels(self.labels, key)} {_format_value(value)}" for key, value in values.items()]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labels: tuple[str, ...] = (), buckets: tuple[float, ...] = DEFAULT_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+        # 每组标签：[各桶计数..., 总和, 总数]
+        self.values: dict[tuple, list[float]] = {}
+
+    def observe(self, value: float, **labels):
+        key = self._key(labels)
+        state = self.values.get(key)
+        if state is None:
+            state = self.values[key] = [0] * (len(self.buckets) + 2)
+        for index, bound in enumerate(self.buckets):
+            if value <= bound:
+                state[index] += 1
+                break
+        state[-2] += value
+        state[-1] += 1
+
+    def samples(self) -> list[str]:
+        lines = []
+        for key, state in list(self.values.items()):
+            cumulative = 0
+            for bound, count in zip(self.buckets, state):
+                cumulative += count
+                le = _format_labels(self.labels, key, 'le="%s"' % bound)
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            le = _format_labels(self.labels, key, 'le="+Inf"')
+            lines.append(f"{self.name}_bucket{le} {int(state[-1])}")
+            lines.append(f"{self.name}_sum{_format_labels(self.labels, key)} {_format_value(state[-2])}")
+            lines.append(f"{self.name}_count{_format_labels(self.labels, key)} {int(state[-1])}")
+        return lines
+
+
+REGISTRY: list[_Metric] = []
+
+
+def render() -> str:
+    return "\n".join(metric.render() for metric in REGISTRY) + "\n"
+
+
+QUEUE_DEPTH = CallbackGauge("otto_queue_depth", "各服务器播放队列中等待的曲目数", ("guild",))
+VOICE_CLIENTS = CallbackGauge("otto_voice_clients", "当前活跃的语音连接数")
+FFMPEG_PROCESSES = CallbackGauge("otto_ffmpeg_processes", "当前运行中的 ffmpeg 进程数")
+TTS_CACHE = CallbackGauge("otto_tts_cache_events", "TTS 缓存命中/未命中累计次数", ("result",))
+AUDIO_CACHE = CallbackGauge("otto_audio_cache_events", "曲目音频磁盘缓存命中/未命中/合并/写入累计次数", ("result",))
+AUDIO_CACHE_BYTES_SAVED = CallbackGauge("otto_audio_cache_bytes_saved", "命中曲目音频缓存而省下的上游下载字节数")
+PLAYER_STATES = CallbackGauge("otto_player_states", "各状态（idle/waiting/connecting/buffering/playing）的服务器播放器数量", ("state",))
+GOVERNOR = CallbackGauge("otto_governor", "全局资源调度：各类资源（ffmpeg/download/tts）的占用数、排队数和上限", ("resource", "state"))
+STREAM_BUFFER_FILL = CallbackGauge("otto_stream_buffer_fill", "各服务器正在播放的拉流抖动缓冲区水位（0~1）", ("guild",))
+
+TTS_SECONDS = Histogram("otto_tts_request_seconds", "TTS 合成请求耗时")
+MUSIX_SECONDS = Histogram("otto_musix_request_seconds", "musix 接口请求耗时", ("endpoint",))
+DOWNLOAD_SECONDS = Histogram("otto_download_seconds", "音频下载耗时（边下边播时为预缓冲耗时）", ("mode",))
+TEMPFILE_WRITE_SECONDS = Histogram("otto_tempfile_write_seconds", "写入临时音频文件耗时（仅 tempfile 播放模式）")
+FFMPEG_SPAWN_SECONDS = Histogram("otto_ffmpeg_spawn_seconds", "创建 ffmpeg 音频源（启动子进程）耗时")
+FIRST_AUDIO_SECONDS = Histogram("otto_enqueue_to_first_audio_seconds", "从加入队列到输出第一帧音频的耗时", ("kind",), buckets=DEFAULT_BUCKETS + (60.0, 300.0))
+INTERACTION_ACK_SECONDS = Histogram("otto_interaction_ack_seconds", "从用户发起交互到机器人确认（首次响应或延迟响应）的耗时", ("command",))
+RESOLVE_SECONDS = Histogram("otto_resolve_seconds", "确认交互之后解析曲目元数据的耗时", ("source",))
+LOUDNESS_ANALYSIS_SECONDS = Histogram("otto_loudness_analysis_seconds", "后台测量单首曲目响度的耗时", buckets=DEFAULT_BUCKETS + (60.0, 300.0))
+
+STARTUP_SECONDS = Gauge("otto_startup_seconds", "启动各阶段（import/login/ready/first_command）距进程启动的耗时", ("phase",))
+
+VOICE_CONNECT_ATTEMPTS = Counter("otto_voice_connect_attempts_total", "语音频道连接尝试次数")
+VOICE_CONNECT_FAILURES = Counter("otto_voice_connect_failures_total", "语音频道连接失败次数", ("reason",))
+SKIPS = Counter("otto_skips_total", "手动跳过次数")
+STREAM_STALLS = Counter("otto_stream_stalls_total", "拉流卡顿次数：缓冲区读空（underrun）或连接中断、卡住（disconnect）", ("reason",))
+STREAM_RECONNECTS = Counter("otto_stream_reconnects_total", "拉流重连成功次数：按 Range 续传（range）、从头下载并跳过（skip）、直播流接上（live）", ("mode",))
+TTS_COALESCED = Counter("otto_tts_coalesced_total", "合并到前一条朗读、省去单独合成和播放的 /say 消息数")
+COMMAND_ERRORS = Counter("otto_command_errors_total", "各命令的出错次数", ("command",))
+
+
+def observe_ack(created_at: datetime, command: str):
+    """按交互的创建时间记录确认耗时，Discord 要求 3 秒内确认"""
+    INTERACTION_ACK_SECONDS.observe((datetime.now(timezone.utc) - created_at).total_seconds(), command=command)
+
+
+async def metrics_handler(request: web.Request) -> web.Response:
+    return web.Response(text=render(), content_type="text/plain", charset="utf-8")
+
+
+async def start_metrics_server() -> web.AppRunner | None:
+    """METRICS_PORT 未设置或端口无法监听时不启动；launcher 启动的各进程依次使用 METRICS_PORT + 进程序号"""
+    port = os.getenv("METRICS_PORT")
+    if not port:
+        return None
+    host = os.getenv("METRICS_HOST", "127.0.0.1")
+    port = int(port) + WORKER_INDEX
+    app = web.Application()
+    app.router.add_get("/metrics", metrics_handler)
+    runner = web.AppRunner(app, access_log=None)
+    await runner.setup()
+    try:
+        await web.TCPSite(runner, host, port).start()
+    except OSError as e:
+        await runner.cleanup()
+        logger.warning(f"⚠️ 指标服务无法监听 {host}:{port}：{e}")
+        return None
+    logger.info(f"📈 指标服务已启动：http://{host}:{port}/metrics")
+    return runner
@@ -0,0 +1,152 @@
+import asyncio
+import os
+import time
+
+import metrics
+from http_pool import HTTPPool
+from single_flight import SingleFlight
+from ttl_cache import TTLCache
+
+# 标题、作者、封面等静态字段的缓存时间
+MUSIX_STATIC_TTL = float(os.getenv("MUSIX_STATIC_TTL", "3600"))
+# 带签名的音频地址很快会失效，单独使用较短的缓存时间
+MUSIX_URL_TTL = float(os.getenv("MUSIX_URL_TTL", "600"))
+# 搜索/热门结果页的缓存时间
+MUSIX_SEARCH_TTL = float(os.getenv("MUSIX_SEARCH_TTL", "120"))
+
+# 批量加入歌单/专辑/多P视频时同时进行的元数据请求数
+MUSIX_BATCH_CONCURRENCY = int(os.getenv("MUSIX_BATCH_CONCURRENCY", "4"))
+
+# 各来源中带签名、会过期的音频地址字段
+SIGNED_URL_FIELDS = {"bilibili": "audio_url", "netease": "download_url"}
+
+
+class MusixClient:
+    """musix_server 接口客户端，曲目元数据按 (来源, id, 分P) 缓存"""
+
+    def __init__(self, http_pool: HTTPPool, api_url: str | None = None):
+        self.http_pool = http_pool
+        self.api_url = api_url or os.getenv("MUSIX_API_URL")
+        max_entries = int(os.getenv("MUSIX_CACHE_ENTRIES", "2048"))
+        # 曲目的静态字段（不含签名地址）和歌单信息
+        self.metadata = TTLCache(MUSIX_STATIC_TTL, max_entries=max_entries)
+        # 曲目的签名音频地址，单独计时
+        self.urls = TTLCache(MUSIX_URL_TTL, max_entries=max_entries)
+        self._track_fetches = SingleFlight()
+        self.searches = TTLCache(MUSIX_SEARCH_TTL, max_entries=int(os.getenv("MUSIX_SEARCH_CACHE_ENTRIES", "512")))
+        self._background: set[asyncio.Task] = set()
+
+    async def _get_data(self, path: str, params: dict | None = None, error_prefix: str = "请求失败"):
+        session = self.http_pool.session("musix")
+        started = time.monotonic()
+        async with session.get(f"{self.api_url}{path}", params=params) as resp:
+            if resp.status != 200:
+                raise Exception(f"{error_prefix}: HTTP {resp.status}")
+            result = await resp.json()
+        # 按接口路径前两段归类（如 bilibili/videos），避免 id 进入标签
+        metrics.MUSIX_SECONDS.observe(time.monotonic() - started, endpoint="/".join(path.strip("/").split("/")[:2]))
+
+        # 检查API响应格式
+        if "data" not in result:
+            raise Exception(f"API响应格式错误，缺少data字段: {result}")
+        return result.get("data", {})
+
+    async def _fetch_track(self, source: str, id, page: int):
+        if source == "bilibili":
+            info = await self._get_data(f"/bilibili/videos/{id}", {"page": page}, "获取视频信息失败")
+        else:
+            info = await self._get_data(f"/netease/songs/{id}", error_prefix="获取歌曲信息失败")
+
+        # 静态字段和签名地址分开缓存，各自从这次请求开始计时
+        key = (source, id, page)
+        url_field = SIGNED_URL_FIELDS[source]
+        self.metadata.set(key, {k: v for k, v in info.items() if k != url_field})
+        if info.get(url_field) is not None:
+            self.urls.set(key, info[url_field])
+        return info
+
+    async def track_info(self, source: str, id, page: int = 0, need_url: bool = True) -> dict:
+        """曲目元数据；need_url 为 False 时只需要静态字段，签名地址过期也不必重新请求"""
+        key = (source, id, page)
+        info = self.metadata.get(key)
+        if info is not None:
+            if not need_url:
+                return info
+            url = self.urls.get(key)
+            if url is not None:
+                return {**info, SIGNED_URL_FIELDS[source]: url}
+        # 接口只能整条返回，签名地址过期时一并刷新静态字段
+        return await self._track_fetches.run(key, lambda: self._fetch_track(source, id, page))
+
+    async def collection(self, source: str, kind: str, id) -> dict:
+        """歌单/专辑信息，包含曲目列表 tracks；与曲目元数据共用缓存"""
+        return await self.metadata.get_or_fetch(
+            (source, kind, id), lambda: self._get_data(f"/{source}/{kind}s/{id}", error_prefix="获取歌单信息失败")
+        )
+
+    async def resolve_tracks(self, tracks: list[tuple]):
+        """按原顺序逐个产出 (曲目, 元数据或异常)，同时最多 MUSIX_BATCH_CONCURRENCY 个请求
+
+        前面的曲目解析完就立即产出，不必等整批完成。
+        """
+        semaphore = asyncio.Semaphore(MUSIX_BATCH_CONCURRENCY)
+
+        async def fetch(track):
+            async with semaphore:
+                return await self.track_info(*track)
+
+        tasks = [asyncio.create_task(fetch(track)) for track in tracks]
+        try:
+            for track, task in zip(tracks, tasks):
+                try:
+                    yield track, await task
+                except Exception as e:
+                    yield track, e
+        finally:
+            for task in tasks:
+                task.cancel()
+
+    def url_age(self, source: str, id, page: int = 0) -> float | None:
+        return self.urls.age((source, id, page))
+
+    async def refresh_audio_url(self, source: str, id, page: int = 0) -> str | None:
+        self.urls.invalidate((source, id, page))
+        info = await self.track_info(source, id, page)
+        return info.get(SIGNED_URL_FIELDS[source])
+
+    @staticmethod
+    def _search_key(endpoint: str, params: dict):
+        return endpoint, tuple(sorted(params.items()))
+
+    def _fetch_search(self, endpoint: str, params: dict, error_prefix: str):
+        return lambda: self._get_data(f"/{endpoint}", params, error_prefix)
+
+    async def search_page(self, endpoint: str, params: dict, error_prefix: str = "搜索失败") -> dict:
+        """获取一页搜索结果，同时在后台预取下一页；结果与用户无关，所有服务器共享"""
+        params = {k: v for k, v in params.items() if v is not None}
+        key = self._search_key(endpoint, params)
+        data = await self.searches.get_or_fetch(key, self._fetch_search(endpoint, params, error_prefix))
+        self._prefetch_next_page(endpoint, params, data, error_prefix)
+        return data
+
+    def _prefetch_next_page(self, endpoint: str, params: dict, data: dict, error_prefix: str):
+        page = params.get("page", 1)
+        total_pages = data.get("pagination", {}).get("total_pages", 1)
+        if page >= total_pages:
+            return
+
+        next_params = {**params, "page": page + 1}
+        key = self._search_key(endpoint, next_params)
+        if self.searches.get(key) is not None or self.searches.inflight(key):
+            return
+
+        async def prefetch():
+            try:
+                await self.searches.get_or_fetch(key, self._fetch_search(endpoint, next_params, error_prefix))
+            except Exception:
+                # 预取失败不影响当前页，翻页时再正常请求
+                pass
+
+        task = asyncio.create_task(prefetch())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
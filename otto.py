@@ -1,40 +1,131 @@
+import time
+
+# 启动计时从导入依赖之前开始
+STARTED_AT = time.monotonic()
+
+import asyncio
 import os
 import re
-from typing import Optional
 
 import discord
 import dotenv
-import aiohttp
 from discord import Option
-from discord.ext import commands
+from discord.ext import commands, tasks
 from discord.ui import View, Select, Button
 
+# 本地模块在导入时读取环境变量，需先加载 .env
+dotenv.load_dotenv()
+
+import metrics
+from http_pool import HTTPPool
+from logging_setup import setup_logging
+from queue_store import QueueStore
+from search_sessions import SearchSession, SearchSessionStore
+from startup import FORCE_COMMAND_SYNC, StartupTimer, command_schema_hash, read_command_hash, write_command_hash
+from sharding import SHARDED, SHARD_COUNT, SHARD_IDS, STATUS_INTERVAL, WORKER_INDEX, collect_status, read_statuses, write_status
 from tts_player_service import TTSPlayerService
 
-dotenv.load_dotenv()
+logger = setup_logging()
 token = str(os.getenv("TOKEN"))
 speak_api_url = str(os.getenv("SPEAK_API_URL"))
-musix_api_url = str(os.getenv("MUSIX_API_URL"))
 
-# 尝试加载 Opus 库
-if not discord.opus.is_loaded():
+def load_opus():
+    # 尝试加载 Opus 库；只有进程内编码（AUDIO_ENCODER=pcm）时才用到，就绪后再加载
+    if discord.opus.is_loaded():
+        return
     try:
         discord.opus.load_opus('libopus.so.0')
     except Exception as e:
-        print(f"⚠️  无法加载 Opus 库: {e}")
-        print("💡 请安装 libopus: sudo apt install libopus0  # Ubuntu/Debian")
-        print("💡 或: sudo dnf install opus              # Fedora/RHEL")
-        print("💡 或: sudo pacman -S opus                # Arch Linux")
+        logger.warning(f"⚠️  无法加载 Opus 库: {e}")
+        logger.warning("💡 请安装 libopus: sudo apt install libopus0  # Ubuntu/Debian")
+        logger.warning("💡 或: sudo dnf install opus              # Fedora/RHEL")
+        logger.warning("💡 或: sudo pacman -S opus                # Arch Linux")
 
 intents = discord.Intents.default()
 intents.voice_states = True
 intents.guilds = True
 
-bot = commands.Bot(command_prefix="/", intents=intents)
-tts_service = TTSPlayerService(bot)
 
-# 跟踪每个用户的最后搜索消息 (key: user_id, value: message)
-last_search_messages = {}
+# 设置 SHARD_COUNT 后启用自动分片；由 launcher.py 启动时每个进程只负责 SHARD_IDS 中的分片
+BotBase = commands.AutoShardedBot if SHARDED else commands.Bot
+
+
+class OttoBot(BotBase):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        # 全局共享的 HTTP 连接池，机器人关闭时统一释放
+        self.http_pool = HTTPPool()
+        self.metrics_runner = None
+        # 设置 QUEUE_DB_PATH 后持久化播放队列
+        self.queue_store = QueueStore.from_env()
+        self.startup = StartupTimer(STARTED_AT)
+        self._command_sync: asyncio.Task | None = None
+        self.warm_up_task: asyncio.Task | None = None
+
+    async def on_connect(self):
+        if self.startup.mark("login"):
+            logger.info(f"⏱️ 已连上网关：{self.startup.report()}")
+        # 重连、多个分片各自连接时只检查一次
+        if self._command_sync is None:
+            self._command_sync = asyncio.create_task(self.sync_commands_if_changed())
+
+    async def sync_commands_if_changed(self):
+        """命令定义的哈希与上次同步时相同则跳过同步；未同步时收到的命令按名称匹配，不影响使用"""
+        digest = command_schema_hash(self)
+        if not FORCE_COMMAND_SYNC and digest == await asyncio.to_thread(read_command_hash):
+            logger.info("⚡ 斜杠命令定义未变化，跳过同步")
+            return
+        started = time.monotonic()
+        try:
+            await self.sync_commands()
+            await asyncio.to_thread(write_command_hash, digest)
+        except Exception as e:
+            logger.warning(f"⚠️ 同步斜杠命令失败：{e}")
+            return
+        logger.info(f"🔄 已同步斜杠命令，耗时 {time.monotonic() - started:.2f}s")
+
+    async def on_application_command_completion(self, ctx: discord.ApplicationContext):
+        if self.startup.mark("first_command"):
+            logger.info(f"⏱️ 首个命令已处理（/{ctx.command.name}）：{self.startup.report()}")
+
+    async def close(self):
+        try:
+            # 先保存队列快照，再断开语音连接
+            if self.queue_store is not None:
+                await self.queue_store.close()
+            await super().close()
+        finally:
+            await self.http_pool.close()
+            if self.metrics_runner is not None:
+                await self.metrics_runner.cleanup()
+
+
+shard_options = {"shard_count": SHARD_COUNT, "shard_ids": SHARD_IDS} if SHARDED else {}
+# 命令同步由 OttoBot.sync_commands_if_changed 按需进行
+bot = OttoBot(command_prefix="/", intents=intents, auto_sync_commands=False, **shard_options)
+tts_service = TTSPlayerService(bot, http_pool=bot.http_pool, queue_store=bot.queue_store)
+
+# 搜索会话：custom_id 中只放会话 key，条数和保存时间有上限
+search_sessions = SearchSessionStore.from_env()
+# 在后台解析和入队的命令任务，保留引用以免被回收
+background_tasks: set[asyncio.Task] = set()
+
+def run_in_background(ctx: discord.ApplicationContext, coro):
+    """解析元数据和入队放到后台任务中，交互处理函数立即返回；出错时通过 followup 告知"""
+    async def runner():
+        try:
+            await coro
+        except Exception as e:
+            # 从搜索结果选择时 ctx 由组件交互构造，没有对应的命令
+            metrics.COMMAND_ERRORS.inc(command=ctx.command.name if ctx.command else "search_play")
+            try:
+                await ctx.respond(f"❌ 出现错误：{e}", ephemeral=True)
+            except Exception as respond_error:
+                logger.warning(f"⚠️ 发送错误提示失败：{respond_error}")
+
+    task = asyncio.create_task(runner())
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
 
 def clean_html_tags(text):
     """移除所有HTML标签"""
@@ -42,9 +133,53 @@ def clean_html_tags(text):
         return text
     return re.sub(r'<[^>]+>', '', text)
 
+@tasks.loop(seconds=STATUS_INTERVAL)
+async def report_status():
+    # 写入本进程的分片状态，供 /status 和 launcher 汇总
+    await asyncio.to_thread(write_status, collect_status(bot))
+
+async def start_metrics():
+    if bot.metrics_runner is None:
+        bot.metrics_runner = await metrics.start_metrics_server()
+
+async def warm_up():
+    """就绪后再做的非关键初始化：Opus 库、各磁盘缓存索引、搜索会话、指标服务"""
+    # 某一步失败只记录日志，不影响其余步骤；指标服务最后启动，能抓取到指标即表示初始化已走完
+    steps = (
+        ("Opus 库", lambda: asyncio.to_thread(load_opus)),
+        ("缓存索引", tts_service.warm_up),
+        ("搜索会话", search_sessions.load),
+        ("指标服务", start_metrics),
+    )
+    for name, step in steps:
+        try:
+            await step()
+        except Exception as e:
+            logger.warning(f"⚠️ 初始化{name}失败：{e}")
+
 @bot.event
 async def on_ready():
-    print(f"✅ 登录成功，机器人名字是 {bot.user}")
+    if bot.startup.mark("ready"):
+        logger.info(f"⏱️ 启动耗时：{bot.startup.report()}")
+    logger.info(f"✅ 登录成功，机器人名字是 {bot.user}（进程 {WORKER_INDEX}，分片 {SHARD_IDS or '全部'}）")
+    if not report_status.is_running():
+        report_status.start()
+    if bot.warm_up_task is None:
+        bot.warm_up_task = asyncio.create_task(warm_up())
+    if bot.queue_store is not None:
+        await bot.queue_store.open()
+        # 只恢复语音频道里仍然有人的服务器，其余等有人进入语音频道或发起命令时再恢复
+        for guild_id in list(bot.queue_store.pending):
+            guild = bot.get_guild(guild_id)
+            if guild is not None and tts_service.has_active_listeners(guild):
+                asyncio.create_task(tts_service.restore_queue(guild))
+
+@bot.event
+async def on_voice_state_update(member: discord.Member, before: discord.VoiceState, after: discord.VoiceState):
+    if member.bot or after.channel is None or before.channel == after.channel:
+        return
+    if bot.queue_store is not None and member.guild.id in bot.queue_store.pending and tts_service.has_active_listeners(member.guild):
+        await tts_service.restore_queue(member.guild)
 
 @bot.slash_command(name="say", description="播放语音（通过 TTS）")
 async def say(
@@ -57,6 +192,7 @@ async def say(
             return
 
         await ctx.respond(f"{message}")
+        metrics.observe_ack(ctx.interaction.created_at, ctx.command.name)
         await tts_service.join_and_speak(
             ctx.author.voice.channel,  # type: ignore
             message,
@@ -64,6 +200,7 @@ async def say(
             ctx
         )
     except Exception as e:
+        metrics.COMMAND_ERRORS.inc(command=ctx.command.name)
         await ctx.respond(f"❌ 出现错误：{e}", ephemeral=True)
 
 @bot.slash_command(name="play_url", description="播放在线音频（mp3/wav 等）")
@@ -77,12 +214,14 @@ async def play_url(
             return
 
         await ctx.respond(f"🎧 准备播放音频：{url}")
+        metrics.observe_ack(ctx.interaction.created_at, ctx.command.name)
         await tts_service.join_and_play_url(
             ctx.author.voice.channel,  # type: ignore
             url,
             ctx
         )
     except Exception as e:
+        metrics.COMMAND_ERRORS.inc(command=ctx.command.name)
         await ctx.respond(f"❌ 出现错误：{e}", ephemeral=True)
 
 @bot.slash_command(name="skip", description="跳过当前播放的音频")
@@ -95,8 +234,79 @@ async def skip(ctx: discord.ApplicationContext):
         await tts_service.skip(ctx.guild.id if ctx.guild else 0)  # type: ignore
         await ctx.respond("⏭️ 已尝试跳过当前播放")
     except Exception as e:
+        metrics.COMMAND_ERRORS.inc(command=ctx.command.name)
         await ctx.respond(f"❌ 跳过失败：{e}", ephemeral=True)
 
+@bot.slash_command(name="remove", description="从播放队列中移除一项")
+async def remove(
+        ctx: discord.ApplicationContext,
+        position: Option(int, "队列中的位置（从1开始）", min_value=1)  # type: ignore
+):
+    try:
+        item = await tts_service.remove(ctx.guild.id if ctx.guild else 0, position)  # type: ignore
+        await ctx.respond(f"🗑️ 已移出队列：{item.content}")
+    except Exception as e:
+        metrics.COMMAND_ERRORS.inc(command=ctx.command.name)
+        await ctx.respond(f"❌ 移除失败：{e}", ephemeral=True)
+
+@bot.slash_command(name="prefetch", description="设置本服务器的预取深度和内存预算")
+# 修改全服务器的设置，默认只对有「管理服务器」权限的成员开放
+@discord.default_permissions(manage_guild=True)
+async def prefetch(
+        ctx: discord.ApplicationContext,
+        depth: Option(int, "提前准备的曲目数（0 表示关闭）", min_value=0, max_value=10),  # type: ignore
+        memory_mb: Option(int, "预取内存预算（MB）", min_value=1, max_value=512, default=32) = 32  # type: ignore
+):
+    tts_service.set_prefetch(ctx.guild.id if ctx.guild else 0, depth, memory_mb)  # type: ignore
+    await ctx.respond(f"⚙️ 预取深度 {depth}，内存预算 {memory_mb} MB", ephemeral=True)
+
+@bot.slash_command(name="say_merge", description="设置本服务器合并连续 /say 的等待窗口")
+@discord.default_permissions(manage_guild=True)
+async def say_merge(
+        ctx: discord.ApplicationContext,
+        window_ms: Option(int, "窗口内连续到达的朗读合并为一次（毫秒，0 表示关闭）", min_value=0, max_value=5000)  # type: ignore
+):
+    tts_service.set_tts_coalesce(ctx.guild.id if ctx.guild else 0, window_ms)  # type: ignore
+    await ctx.respond(f"⚙️ 朗读合并窗口 {window_ms} 毫秒" if window_ms else "⚙️ 已关闭朗读合并", ephemeral=True)
+
+@bot.slash_command(name="cache_stats", description="查看语音合成和曲目音频缓存命中情况")
+async def cache_stats(ctx: discord.ApplicationContext):
+    stats = tts_service.tts_cache.summary()
+    audio_cache_line = ""
+    if tts_service.audio_cache is not None:
+        audio = tts_service.audio_cache.summary()
+        audio_cache_line = (
+            f"\n💽 曲目缓存：命中 {audio['hits']} | 未命中 {audio['misses']} | 合并下载 {audio['coalesced']} | "
+            f"命中率 {audio['hit_ratio']:.1%} | 节省下载 {audio['bytes_saved'] / 1024 / 1024:.1f} MB | "
+            f"占用 {audio['disk_bytes'] / 1024 / 1024:.1f} MB"
+        )
+    await ctx.respond(
+        f"💾 TTS 缓存：内存命中 {stats['memory_hits']} | 磁盘命中 {stats['disk_hits']} | "
+        f"合并请求 {stats['coalesced']} | 未命中 {stats['misses']} | 命中率 {stats['hit_ratio']:.1%}"
+        + audio_cache_line,
+        ephemeral=True
+    )
+
+@bot.slash_command(name="status", description="查看各进程的分片延迟")
+async def status(ctx: discord.ApplicationContext):
+    statuses = {status["worker"]: status for status in await asyncio.to_thread(read_statuses)}
+    # 本进程使用实时数据
+    statuses[WORKER_INDEX] = {**collect_status(bot), "stale": False}
+
+    embed = discord.Embed(title="📊 运行状态")
+    for worker, status in sorted(statuses.items()):
+        shards = "\n".join(
+            f"分片 #{shard_id}：{'-' if latency is None else f'{latency} ms'}"
+            for shard_id, latency in status["shards"].items()
+        )
+        flag = "⚠️ 失联" if status["stale"] else "✅"
+        embed.add_field(
+            name=f"{flag} 进程 {worker}（pid {status['pid']}）",
+            value=f"服务器 {status['guilds']} | 语音连接 {status['voice_clients']}\n{shards}",
+            inline=False
+        )
+    await ctx.respond(embed=embed, ephemeral=True)
+
 @bot.slash_command(name="stream_url", description="播放流式音频（直播/广播）")
 async def stream_url(
         ctx: discord.ApplicationContext,
@@ -108,32 +318,44 @@ async def stream_url(
             return
 
         await ctx.respond(f"📡 正在流式播放：{url}")
+        metrics.observe_ack(ctx.interaction.created_at, ctx.command.name)
         await tts_service.join_and_stream_url(
             ctx.author.voice.channel,  # type: ignore
             url,
             ctx
         )
     except Exception as e:
+        metrics.COMMAND_ERRORS.inc(command=ctx.command.name)
         await ctx.respond(f"❌ 出现错误：{e}", ephemeral=True)
 
 @bot.slash_command(name="play_bilibili", description="解析播放bilibili视频的音频")
 async def play_bilibili(
         ctx: discord.ApplicationContext,
         bvid: Option(str, description="BV号"),  # type: ignore
-        page: Option(int, description="分P号") = 0  # type: ignore
+        page: Option(int, description="分P号") = 0,  # type: ignore
+        all_pages: Option(bool, description="按顺序播放全部分P", default=False) = False  # type: ignore
 ):
     try:
         if not ctx.author.voice or not ctx.author.voice.channel:  # type: ignore
             await ctx.respond("❗ 请先加入一个语音频道。", ephemeral=True)
             return
 
-        await tts_service.join_and_play_bilibili(
+        if all_pages:
+            run_in_background(ctx, tts_service.join_and_play_bilibili_pages(
+                ctx.author.voice.channel,  # type: ignore
+                bvid,
+                ctx
+            ))
+            return
+
+        run_in_background(ctx, tts_service.join_and_play_bilibili(
             ctx.author.voice.channel,  # type: ignore
             bvid,
             ctx,
             page
-        )
+        ))
     except Exception as e:
+        metrics.COMMAND_ERRORS.inc(command=ctx.command.name)
         await ctx.respond(f"❌ 出现错误：{e}", ephemeral=True)
 
 @bot.slash_command(name="play_netease", description="解析播放网易云音乐")
@@ -146,150 +368,240 @@ async def play_netease(
             await ctx.respond("❗ 请先加入一个语音频道。", ephemeral=True)
             return
 
-        await tts_service.join_and_play_netease(
+        run_in_background(ctx, tts_service.join_and_play_netease(
             ctx.author.voice.channel,  # type: ignore
             id,
             ctx
-        )
+        ))
     except Exception as e:
+        metrics.COMMAND_ERRORS.inc(command=ctx.command.name)
         await ctx.respond(f"❌ 出现错误：{e}", ephemeral=True)
 
-@bot.slash_command(name="search_bilibili", description="搜索bilibili视频")
-async def search_bilibili(
+@bot.slash_command(name="play_netease_playlist", description="播放网易云音乐歌单或专辑")
+async def play_netease_playlist(
         ctx: discord.ApplicationContext,
-        keywords: str,
-        page: Option(int, "页码", min_value=1, default=1) = 1,  # type: ignore
-        original_message: Optional[discord.Message] = None  # type: ignore
+        id: Option(int, description="歌单或专辑ID"),  # type: ignore
+        type: Option(str, description="类型", choices=["playlist", "album"], default="playlist") = "playlist"  # type: ignore
 ):
     try:
         if not ctx.author.voice or not ctx.author.voice.channel:  # type: ignore
             await ctx.respond("❗ 请先加入一个语音频道。", ephemeral=True)
             return
 
-        # 删除用户的上一次搜索消息
-        user_id = ctx.author.id
-        if user_id in last_search_messages:
-            try:
-                await last_search_messages[user_id].delete()
-            except:
-                pass
-            del last_search_messages[user_id]
-
-        if original_message:
-            try:
-                await original_message.delete()
-            except:
-                pass
-
-        # 使用musix API搜索
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{musix_api_url}/bilibili/search", params={"keywords": keywords, "page": page}) as resp:
-                if resp.status != 200:
-                    await ctx.respond(f"❌ 搜索失败: HTTP {resp.status}", ephemeral=True)
-                    return
-                result = await resp.json()
-                
-                # 检查API响应格式
-                if "data" not in result:
-                    await ctx.respond(f"❌ API响应格式错误: {result}", ephemeral=True)
-                    return
-                
-                response_data = result.get("data", {})
-                video_results = response_data.get("items", [])
-                pagination = response_data.get("pagination", {})
-                total_pages = pagination.get("total_pages", 1)
-
-        if not video_results:
-            await ctx.respond("🔍 没有找到相关视频", ephemeral=True)
-            return
-
-        select = Select(
-            placeholder="选择要播放的视频",
-            options=[
-                discord.SelectOption(
-                    label=clean_html_tags(video['title'])[:50],
-                    description=f"UP: {video['author']} | 时长: {video['duration']}",
-                    value=str(idx),
-                    emoji="🎬"
-                ) for idx, video in enumerate(video_results)
-            ]
-        )
-
-        view = View(timeout=60)
-        view.add_item(select)
-
-        if page > 1:
-            bilibili_previous_page_button = Button(
-                label="上一页",
-                style=discord.ButtonStyle.primary,
-                custom_id=f"bilibili_previous_page_{page}"
-            )
-
-            async def bilibili_previous_page_callback(interaction):
-                if interaction.user != ctx.author:
-                    await interaction.response.send_message("❌ 只有发起搜索的人可以翻页！", ephemeral=True)
-                    return
-
-                current_message = interaction.message
-                await interaction.response.defer()
-
-                await search_bilibili(ctx, keywords, page - 1, original_message=current_message)
-
-            bilibili_previous_page_button.callback = bilibili_previous_page_callback
-            view.add_item(bilibili_previous_page_button)
-
-        if page < total_pages:
-            bilibili_next_page_button = Button(
-                label="下一页",
-                style=discord.ButtonStyle.primary,
-                custom_id=f"bilibili_next_page_{page}"
-            )
-
-            async def bilibili_next_page_callback(interaction):
-                if interaction.user != ctx.author:
-                    await interaction.response.send_message("❌ 只有发起搜索的人可以翻页！", ephemeral=True)
-                    return
-
-                current_message = interaction.message
-                await interaction.response.defer()
-
-                await search_bilibili(ctx, keywords, page + 1, original_message=current_message)
-
-            bilibili_next_page_button.callback = bilibili_next_page_callback
-            view.add_item(bilibili_next_page_button)
-
-        # 选择视频的回调
-        async def bilibili_select_callback(interaction):
-            if interaction.user != ctx.author:
-                await interaction.response.send_message("❌ 这不是你的搜索请求!", ephemeral=True)
-                return
+        run_in_background(ctx, tts_service.join_and_play_netease_collection(
+            ctx.author.voice.channel,  # type: ignore
+            type,
+            id,
+            ctx
+        ))
+    except Exception as e:
+        metrics.COMMAND_ERRORS.inc(command=ctx.command.name)
+        await ctx.respond(f"❌ 出现错误：{e}", ephemeral=True)
 
-            selected_idx = int(select.values[0])
-            selected_video = video_results[selected_idx]
-            bvid = selected_video['bvid']
+# 搜索结果的下拉框和翻页按钮不保存回调，统一由 on_search_interaction 按 custom_id 处理，重启后仍然有效：
+# search:play:<会话 key>（选项值为 "序号:id"）、search:page:<会话 key>:<页码>
+SEARCH_ENDPOINTS = {
+    "bilibili": ("bilibili/search", "搜索失败"),
+    "netease": ("netease/search", "搜索失败"),
+    "popular": ("bilibili/popular", "获取热门视频失败"),
+}
+NETEASE_PAGE_LIMIT = 25
+
+async def fetch_search_page(session: SearchSession, page: int) -> dict:
+    endpoint, error_prefix = SEARCH_ENDPOINTS[session.kind]
+    # 使用musix API搜索（结果页带缓存，并预取下一页；热门视频所有用户和服务器共享同一份缓存）
+    return await tts_service.musix.search_page(endpoint, {**session.params, "page": page}, error_prefix)
+
+def popular_title(tag: str | None, days: int | None) -> str:
+    title_parts = ["🔥 热门视频"]
+    if tag:
+        title_parts.append(f"「{tag}」")
+    if days == 1:
+        title_parts.append("| 当天")
+    elif days == 7:
+        title_parts.append("| 本周")
+    elif days == 30:
+        title_parts.append("| 本月")
+    return " ".join(title_parts)
+
+def search_options(session: SearchSession, results: list[dict]) -> list[discord.SelectOption]:
+    if session.kind == "netease":
+        # 构建选项列表，安全地处理数据格式
+        options = []
+        for idx, music in enumerate(results):
+            artists = music.get('artists', [])
+            author = artists[0].get('name', '未知') if artists else '未知'
+            options.append(discord.SelectOption(
+                label=music.get('name', '未知歌曲')[:50],
+                description=f"作者: {author}",
+                value=f"{idx}:{music['id']}",
+                emoji="🎵"
+            ))
+        return options
+
+    if session.kind == "popular":
+        return [
+            discord.SelectOption(
+                label=clean_html_tags(video['title'])[:50],
+                description=f"UP: {video['author']} | 播放: {video['play']} | 时长: {video['duration']}",
+                value=f"{idx}:{video['bvid']}",
+                emoji="🔥"
+            ) for idx, video in enumerate(results)
+        ]
+
+    return [
+        discord.SelectOption(
+            label=clean_html_tags(video['title'])[:50],
+            description=f"UP: {video['author']} | 时长: {video['duration']}",
+            value=f"{idx}:{video['bvid']}",
+            emoji="🎬"
+        ) for idx, video in enumerate(results)
+    ]
+
+def render_search_page(key: str, session: SearchSession, page: int, data: dict) -> tuple[str, View] | None:
+    """按一页搜索结果生成消息内容和组件；没有结果时返回 None"""
+    results = data.get("items", [])
+    if not results:
+        return None
+    total_pages = data.get("pagination", {}).get("total_pages", 1)
+
+    # 不保存到 ViewStore，组件交互全部由 on_search_interaction 处理
+    view = View(timeout=None, store=False)
+    view.add_item(Select(
+        placeholder="选择要播放的歌曲" if session.kind == "netease" else "选择要播放的视频",
+        options=search_options(session, results),
+        custom_id=f"search:play:{key}"
+    ))
+    if page > 1:
+        view.add_item(Button(label="上一页", style=discord.ButtonStyle.primary, custom_id=f"search:page:{key}:{page - 1}"))
+    if page < total_pages:
+        view.add_item(Button(label="下一页", style=discord.ButtonStyle.primary, custom_id=f"search:page:{key}:{page + 1}"))
+
+    if session.kind == "popular":
+        prefix = f"{popular_title(session.params.get('tag'), session.params.get('days'))} |"
+    else:
+        prefix = "🔍"
+    return f"{prefix} 第 {page} 页 | 找到 {len(results)} 个结果，请选择:", view
+
+async def respond_privately_after_defer(ctx: discord.ApplicationContext, content: str):
+    # 公开 defer 后的第一条 followup 会替换「正在思考」的占位并同样公开显示，先删掉占位再发仅自己可见的提示
+    try:
+        await ctx.interaction.delete_original_response()
+    except discord.HTTPException:
+        pass
+    await ctx.followup.send(content, ephemeral=True)
 
-            await interaction.response.edit_message(
-                content=f"✅ {interaction.user.mention} 选择了: {clean_html_tags(selected_video['title'])}",
-                view=None,
-            )
+async def start_search(ctx: discord.ApplicationContext, session: SearchSession, page: int, empty_message: str):
+    if not ctx.author.voice or not ctx.author.voice.channel:  # type: ignore
+        await ctx.respond("❗ 请先加入一个语音频道。", ephemeral=True)
+        return
 
-            await play_bilibili(ctx, bvid)
+    # 先确认交互再请求 musix
+    await ctx.defer()
+    metrics.observe_ack(ctx.interaction.created_at, ctx.command.name)
 
-        select.callback = bilibili_select_callback
+    try:
+        key = search_sessions.put(session)
+        rendered = render_search_page(key, session, page, await fetch_search_page(session, page))
+    except Exception as e:
+        metrics.COMMAND_ERRORS.inc(command=ctx.command.name)
+        await respond_privately_after_defer(ctx, f"❌ {e}")
+        return
+
+    if rendered is None:
+        await respond_privately_after_defer(ctx, empty_message)
+        return
+    content, view = rendered
+    message = await ctx.respond(content, view=view)
+    if isinstance(message, discord.Interaction):
+        message = await message.original_response()
+
+    # 删除用户的上一次搜索消息
+    previous = search_sessions.swap_last_message(ctx.author.id, message.channel.id, message.id)
+    if previous is not None:
+        try:
+            await bot.get_partial_messageable(previous[0]).get_partial_message(previous[1]).delete()
+        except discord.HTTPException:
+            pass
+
+@bot.listen("on_interaction")
+async def on_search_interaction(interaction: discord.Interaction):
+    if interaction.type != discord.InteractionType.component:
+        return
+    custom_id = (interaction.data or {}).get("custom_id", "")
+    if not custom_id.startswith("search:"):
+        return
+
+    _, action, key, *rest = custom_id.split(":")
+    session = await search_sessions.get(key)
+    if session is None:
+        await interaction.response.send_message("⌛ 搜索已过期，请重新搜索", ephemeral=True)
+        return
+    if interaction.user.id != session.user_id:
+        await interaction.response.send_message("❌ 这不是你的搜索请求!" if action == "play" else "❌ 只有发起搜索的人可以翻页！", ephemeral=True)
+        return
 
-        response_msg = await ctx.respond(
-            f"🔍 第 {page} 页 | 找到 {len(video_results)} 个结果，请选择:",
-            view=view,
-            ephemeral=False
-        )
-        
-        # 保存这次搜索的消息
-        if hasattr(response_msg, 'message'):
-            last_search_messages[user_id] = response_msg.message
-        elif isinstance(response_msg, discord.Message):
-            last_search_messages[user_id] = response_msg
+    try:
+        if action == "page":
+            await turn_search_page(interaction, key, session, int(rest[0]))
+        elif action == "play":
+            await play_search_result(interaction, session)
+    except Exception as e:
+        metrics.COMMAND_ERRORS.inc(command=f"search_{action}")
+        await interaction.followup.send(f"❌ 出现错误：{e}", ephemeral=True)
+
+async def turn_search_page(interaction: discord.Interaction, key: str, session: SearchSession, page: int):
+    # 在原消息上翻页
+    await interaction.response.defer()
+    metrics.observe_ack(interaction.created_at, "search_page")
+
+    rendered = render_search_page(key, session, page, await fetch_search_page(session, page))
+    if rendered is None:
+        await interaction.followup.send("🔍 这一页没有结果", ephemeral=True)
+        return
+    content, view = rendered
+    await interaction.edit_original_response(content=content, view=view)
+
+def selected_label(interaction: discord.Interaction, value: str) -> str:
+    # 选中项的标题取自消息中的下拉框，无需保存搜索结果
+    for row in interaction.message.components if interaction.message else []:
+        for component in getattr(row, "children", []):
+            for option in getattr(component, "options", None) or []:
+                if option.value == value:
+                    return option.label
+    return value.split(":", 1)[1]
+
+async def play_search_result(interaction: discord.Interaction, session: SearchSession):
+    value = interaction.data["values"][0]  # type: ignore
+    item_id = value.split(":", 1)[1]
+
+    await interaction.response.edit_message(
+        content=f"✅ {interaction.user.mention} 选择了: {selected_label(interaction, value)}",
+        view=None,
+    )
+    metrics.observe_ack(interaction.created_at, "select")
+
+    voice = getattr(interaction.user, "voice", None)
+    if not voice or not voice.channel:
+        await interaction.followup.send("❗ 请先加入一个语音频道。", ephemeral=True)
+        return
+
+    ctx = await bot.get_application_context(interaction)
+    if session.kind == "netease":
+        run_in_background(ctx, tts_service.join_and_play_netease(voice.channel, int(item_id), ctx))
+    else:
+        run_in_background(ctx, tts_service.join_and_play_bilibili(voice.channel, item_id, ctx))
 
+@bot.slash_command(name="search_bilibili", description="搜索bilibili视频")
+async def search_bilibili(
+        ctx: discord.ApplicationContext,
+        keywords: str,
+        page: Option(int, "页码", min_value=1, default=1) = 1,  # type: ignore
+):
+    try:
+        await start_search(ctx, SearchSession("bilibili", ctx.author.id, {"keywords": keywords}), page, "🔍 没有找到相关视频")
     except Exception as e:
+        metrics.COMMAND_ERRORS.inc(command=ctx.command.name)
         await ctx.respond(f"❌ 出现错误：{str(e)}", ephemeral=True)
 
 @bot.slash_command(name="search_netease", description="搜索网易云音乐")
@@ -297,150 +609,12 @@ async def search_netease(
         ctx: discord.ApplicationContext,
         keywords: str,
         page: Option(int, "页数", min_value=1, default=1) = 1,  # type: ignore
-        original_message: Optional[discord.Message] = None  # type: ignore
 ):
-    page_limit = 25
     try:
-        if not ctx.author.voice or not ctx.author.voice.channel:  # type: ignore
-            await ctx.respond("❗ 请先加入一个语音频道。", ephemeral=True)
-            return
-
-        # 删除用户的上一次搜索消息
-        user_id = ctx.author.id
-        if user_id in last_search_messages:
-            try:
-                await last_search_messages[user_id].delete()
-            except:
-                pass
-            del last_search_messages[user_id]
-
-        if original_message:
-            try:
-              await original_message.delete()
-            except:
-                pass
-
-        # 使用musix API搜索
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{musix_api_url}/netease/search", params={"keywords": keywords, "page": page, "limit": page_limit}) as resp:
-                if resp.status != 200:
-                    await ctx.respond(f"❌ 搜索失败: HTTP {resp.status}", ephemeral=True)
-                    return
-                result = await resp.json()
-                
-                # 检查API响应格式
-                if "data" not in result:
-                    await ctx.respond(f"❌ API响应格式错误: {result}", ephemeral=True)
-                    return
-                
-                response_data = result.get("data", {})
-                music_results = response_data.get("items", [])
-                pagination = response_data.get("pagination", {})
-                total_count = pagination.get("total_count", 0)
-                total_pages = pagination.get("total_pages", 1)
-
-        if not music_results:
-            await ctx.respond("🔍 没有找到相关歌曲", ephemeral=True)
-            return
-
-        # 构建选项列表，安全地处理数据格式
-        options = []
-        for idx, music in enumerate(music_results):
-            name = music.get('name', '未知歌曲')[:50]
-            
-            # 安全地获取艺术家名称
-            artists = music.get('artists', [])
-            if artists and len(artists) > 0:
-                author = artists[0].get('name', '未知')
-            else:
-                author = '未知'
-            
-            options.append(discord.SelectOption(
-                label=name,
-                description=f"作者: {author}",
-                value=str(idx),
-                emoji="🎵"
-            ))
-
-        select = Select(
-            placeholder="选择要播放的歌曲",
-            options=options
-        )
-
-        view = View(timeout=60)
-        view.add_item(select)
-
-        if page > 1:
-            netease_previous_page_button = Button(
-                label="上一页",
-                style=discord.ButtonStyle.primary,
-                custom_id=f"netease_previous_page_{page}"
-            )
-
-            async def netease_previous_page_callback(interaction):
-                if interaction.user != ctx.author:
-                    await interaction.response.send_message("❌ 只有发起搜索的人可以翻页！", ephemeral=True)
-                    return
-
-                current_message = interaction.message
-                await interaction.response.defer()
-
-                await search_netease(ctx, keywords, page - 1, original_message=current_message)
-
-            netease_previous_page_button.callback = netease_previous_page_callback
-            view.add_item(netease_previous_page_button)
-
-        if page < total_pages:
-            netease_next_page_button = Button(
-                label="下一页",
-                style=discord.ButtonStyle.primary,
-                custom_id=f"netease_next_page_{page}"
-            )
-
-            async def netease_next_page_callback(interaction):
-                if interaction.user != ctx.author:
-                    await interaction.response.send_message("❌ 只有发起搜索的人可以翻页！", ephemeral=True)
-                    return
-
-                current_message = interaction.message
-                await interaction.response.defer()
-
-                await search_netease(ctx, keywords, page + 1, original_message=current_message)
-
-            netease_next_page_button.callback = netease_next_page_callback
-            view.add_item(netease_next_page_button)
-
-        async def netease_select_callback(interaction):
-            if interaction.user != ctx.author:
-                await interaction.response.send_message("❌ 这不是你的搜索请求!", ephemeral=True)
-                return
-
-            selected_idx = int(select.values[0])
-            selected_music = music_results[selected_idx]
-            id = selected_music['id']
-
-            await interaction.response.edit_message(
-                content=f"✅ {interaction.user.mention} 选择了: {selected_music['name']}",
-                view=None,
-            )
-
-            await play_netease(ctx, id)
-
-        select.callback = netease_select_callback
-
-        response_msg = await ctx.respond(
-            f"🔍 第 {page} 页 | 找到 {len(music_results)} 个结果，请选择:",
-            view=view,
-            ephemeral=False
-        )
-        
-        # 保存这次搜索的消息
-        if hasattr(response_msg, 'message'):
-            last_search_messages[user_id] = response_msg.message
-        elif isinstance(response_msg, discord.Message):
-            last_search_messages[user_id] = response_msg
-
+        session = SearchSession("netease", ctx.author.id, {"keywords": keywords, "limit": NETEASE_PAGE_LIMIT})
+        await start_search(ctx, session, page, "🔍 没有找到相关歌曲")
     except Exception as e:
+        metrics.COMMAND_ERRORS.inc(command=ctx.command.name)
         await ctx.respond(f"❌ 出现错误：{str(e)}", ephemeral=True)
 
 @bot.slash_command(name="get_bilibili_popular", description="获取bilibili热门视频")
@@ -450,160 +624,13 @@ async def get_bilibili_popular(
         page: Option(int, "页码", min_value=1, default=1) = 1,  # type: ignore
         page_size: Option(int, "每页数量（最大50）", min_value=1, max_value=50, default=20) = 20,  # type: ignore
         days: Option(int, "时间范围（天数）：1=当天，7=本周，30=本月", choices=[1, 7, 30], required=False) = None,  # type: ignore
-        original_message: Optional[discord.Message] = None  # type: ignore
 ):
     try:
-        if not ctx.author.voice or not ctx.author.voice.channel:  # type: ignore
-            await ctx.respond("❗ 请先加入一个语音频道。", ephemeral=True)
-            return
-
-        # 删除用户的上一次搜索消息
-        user_id = ctx.author.id
-        if user_id in last_search_messages:
-            try:
-                await last_search_messages[user_id].delete()
-            except:
-                pass
-            del last_search_messages[user_id]
-
-        if original_message:
-            try:
-                await original_message.delete()
-            except:
-                pass
-
-        # 构建请求参数
-        params = {
-            "page": page,
-            "page_size": page_size
-        }
-        if tag:
-            params["tag"] = tag
-        if days:
-            params["days"] = days
-
-        # 使用musix API获取热门视频
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{musix_api_url}/bilibili/popular", params=params) as resp:
-                if resp.status != 200:
-                    await ctx.respond(f"❌ 获取热门视频失败: HTTP {resp.status}", ephemeral=True)
-                    return
-                result = await resp.json()
-                
-                # 检查API响应格式
-                if "data" not in result:
-                    await ctx.respond(f"❌ API响应格式错误: {result}", ephemeral=True)
-                    return
-                
-                response_data = result.get("data", {})
-                video_results = response_data.get("items", [])
-                pagination = response_data.get("pagination", {})
-                total_pages = pagination.get("total_pages", 1)
-
-        if not video_results:
-            await ctx.respond("🔍 没有找到热门视频", ephemeral=True)
-            return
-
-        # 构建标题信息
-        title_parts = ["🔥 热门视频"]
-        if tag:
-            title_parts.append(f"「{tag}」")
-        if days == 1:
-            title_parts.append("| 当天")
-        elif days == 7:
-            title_parts.append("| 本周")
-        elif days == 30:
-            title_parts.append("| 本月")
-        title = " ".join(title_parts)
-
-        select = Select(
-            placeholder="选择要播放的视频",
-            options=[
-                discord.SelectOption(
-                    label=clean_html_tags(video['title'])[:50],
-                    description=f"UP: {video['author']} | 播放: {video['play']} | 时长: {video['duration']}",
-                    value=str(idx),
-                    emoji="🔥"
-                ) for idx, video in enumerate(video_results)
-            ]
-        )
-
-        view = View(timeout=60)
-        view.add_item(select)
-
-        # 添加翻页按钮
-        if page > 1:
-            popular_previous_page_button = Button(
-                label="上一页",
-                style=discord.ButtonStyle.primary,
-                custom_id=f"popular_previous_page_{page}"
-            )
-
-            async def popular_previous_page_callback(interaction):
-                if interaction.user != ctx.author:
-                    await interaction.response.send_message("❌ 只有发起搜索的人可以翻页！", ephemeral=True)
-                    return
-
-                current_message = interaction.message
-                await interaction.response.defer()
-
-                await get_bilibili_popular(ctx, tag, page - 1, page_size, days, original_message=current_message)
-
-            popular_previous_page_button.callback = popular_previous_page_callback
-            view.add_item(popular_previous_page_button)
-
-        if page < total_pages:
-            popular_next_page_button = Button(
-                label="下一页",
-                style=discord.ButtonStyle.primary,
-                custom_id=f"popular_next_page_{page}"
-            )
-
-            async def popular_next_page_callback(interaction):
-                if interaction.user != ctx.author:
-                    await interaction.response.send_message("❌ 只有发起搜索的人可以翻页！", ephemeral=True)
-                    return
-
-                current_message = interaction.message
-                await interaction.response.defer()
-
-                await get_bilibili_popular(ctx, tag, page + 1, page_size, days, original_message=current_message)
-
-            popular_next_page_button.callback = popular_next_page_callback
-            view.add_item(popular_next_page_button)
-
-        # 选择视频的回调
-        async def popular_select_callback(interaction):
-            if interaction.user != ctx.author:
-                await interaction.response.send_message("❌ 这不是你的搜索请求!", ephemeral=True)
-                return
-
-            selected_idx = int(select.values[0])
-            selected_video = video_results[selected_idx]
-            bvid = selected_video['bvid']
-
-            await interaction.response.edit_message(
-                content=f"✅ {interaction.user.mention} 选择了: {clean_html_tags(selected_video['title'])}",
-                view=None,
-            )
-
-            await play_bilibili(ctx, bvid)
-
-        select.callback = popular_select_callback
-
-        response_msg = await ctx.respond(
-            f"{title} | 第 {page} 页 | 找到 {len(video_results)} 个结果，请选择:",
-            view=view,
-            ephemeral=False
-        )
-        
-        # 保存这次搜索的消息
-        if hasattr(response_msg, 'message'):
-            last_search_messages[user_id] = response_msg.message
-        elif isinstance(response_msg, discord.Message):
-            last_search_messages[user_id] = response_msg
-
+        session = SearchSession("popular", ctx.author.id, {"page_size": page_size, "tag": tag, "days": days})
+        await start_search(ctx, session, page, "🔍 没有找到热门视频")
     except Exception as e:
+        metrics.COMMAND_ERRORS.inc(command=ctx.command.name)
         await ctx.respond(f"❌ 出现错误：{str(e)}", ephemeral=True)
 
+bot.startup.mark("import")
 bot.run(token)
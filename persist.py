@@ -0,0 +1,66 @@
+import asyncio
+import json
+import logging
+import os
+from typing import Any, Callable
+
+
+def write_atomic(path: str, data: str | bytes):
+    """先写同目录下本进程的临时文件再原子替换，崩溃或并发读取时不会看到半截文件"""
+    if isinstance(data, str):
+        data = data.encode("utf-8")
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    try:
+        with open(tmp_path, "wb") as f:
+            f.write(data)
+        os.replace(tmp_path, path)
+    except BaseException:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+        raise
+
+
+class WriteBehind:
+    """在后台把内存中的数据写成 JSON 文件：保存期间的新改动合并到下一次写入，同一时刻只有一个写线程
+
+    读入旧文件之前不写，以免覆盖已有记录；调用 mark_ready() 后补写之前积攒的改动。
+    """
+
+    def __init__(self, path: str, snapshot: Callable[[], Any], logger: logging.Logger, description: str):
+        self.path = path
+        # 在事件循环线程中调用，返回可在写线程中序列化的副本
+        self.snapshot = snapshot
+        self.logger = logger
+        self.description = description
+        self.ready = False
+        self._saving = False
+        self._dirty = False
+        self._background: set[asyncio.Task] = set()
+
+    def mark_ready(self):
+        self.ready = True
+        if self._dirty:
+            self.schedule()
+
+    def schedule(self):
+        self._dirty = True
+        if self._saving or not self.ready:
+            return
+        self._saving = True
+        task = asyncio.create_task(self._save())
+        self._background.add(task)
+        task.add_done_callback(self._background.discard)
+
+    def _write(self, data):
+        write_atomic(self.path, json.dumps(data, ensure_ascii=False))
+
+    async def _save(self):
+        try:
+            while self._dirty:
+                self._dirty = False
+                await asyncio.to_thread(self._write, self.snapshot())
+        except (OSError, TypeError, ValueError) as e:
+            self.logger.warning(f"⚠️ 保存{self.description}失败：{e}")
+        finally:
+            self._saving = False
@@ -0,0 +1,145 @@
+import asyncio
+import json
+import os
+import sqlite3
+from typing import Callable, Iterable
+
+# 未设置时不持久化队列
+QUEUE_DB_PATH = os.getenv("QUEUE_DB_PATH")
+QUEUE_FLUSH_INTERVAL = float(os.getenv("QUEUE_FLUSH_INTERVAL", "5"))
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS queue_items (
+    guild_id INTEGER NOT NULL,
+    position INTEGER NOT NULL,
+    channel_id INTEGER NOT NULL,
+    content TEXT NOT NULL,
+    speak_api_url TEXT,
+    track TEXT,
+    offset_seconds REAL NOT NULL DEFAULT 0,
+    PRIMARY KEY (guild_id, position)
+)
+"""
+
+
+class QueueStore:
+    """SQLite 中的播放队列快照：改动只标记服务器，后台按间隔合并成一次事务落盘
+
+    position 0 为重启前正在播放的曲目，offset_seconds 为其播放到的位置。
+    """
+
+    def __init__(self, path: str, flush_interval: float = QUEUE_FLUSH_INTERVAL):
+        self.path = path
+        self.flush_interval = flush_interval
+        # 有待恢复队列的服务器 -> 队列涉及的语音频道
+        self.pending: dict[int, set[int]] = {}
+        # 由 TTSPlayerService 设置：生成某个服务器当前的队列快照、列出正在播放的服务器
+        self.snapshot: Callable[[int], list[dict]] | None = None
+        self.active: Callable[[], Iterable[int]] | None = None
+
+        self._conn: sqlite3.Connection | None = None
+        self._dirty: set[int] = set()
+        self._flusher: asyncio.Task | None = None
+        self._writing: asyncio.Future | None = None
+        self._closed = False
+
+    @classmethod
+    def from_env(cls) -> "QueueStore | None":
+        return cls(QUEUE_DB_PATH) if QUEUE_DB_PATH else None
+
+    def _open(self):
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        conn = sqlite3.connect(self.path, check_same_thread=False)
+        conn.execute("PRAGMA journal_mode=WAL")
+        conn.execute(_SCHEMA)
+        conn.commit()
+        # 启动时只读出服务器和频道，具体曲目等该服务器有人进入语音频道时再读
+        pending: dict[int, set[int]] = {}
+        for guild_id, channel_id in conn.execute("SELECT DISTINCT guild_id, channel_id FROM queue_items"):
+            pending.setdefault(guild_id, set()).add(channel_id)
+        return conn, pending
+
+    async def open(self):
+        if self._conn is not None:
+            return
+        self._conn, self.pending = await asyncio.to_thread(self._open)
+        self._flusher = asyncio.create_task(self._flush_loop())
+
+    def mark_dirty(self, guild_id: int):
+        if not self._closed:
+            self._dirty.add(guild_id)
+
+    def _load(self, guild_id: int) -> list[dict]:
+        rows = self._conn.execute(  # type: ignore
+            "SELECT channel_id, content, speak_api_url, track, offset_seconds FROM queue_items WHERE guild_id = ? ORDER BY position",
+            (guild_id,),
+        ).fetchall()
+        return [
+            {
+                "channel_id": channel_id,
+                "content": content,
+                "speak_api_url": speak_api_url,
+                "track": tuple(json.loads(track)) if track else None,
+                "offset": offset,
+            }
+            for channel_id, content, speak_api_url, track, offset in rows
+        ]
+
+    async def load(self, guild_id: int) -> list[dict]:
+        if self._conn is None:
+            return []
+        return await asyncio.to_thread(self._load, guild_id)
+
+    def _write(self, snapshots: dict[int, list[dict]]):
+        with self._conn:  # type: ignore
+            for guild_id, items in snapshots.items():
+                self._conn.execute("DELETE FROM queue_items WHERE guild_id = ?", (guild_id,))  # type: ignore
+                self._conn.executemany(  # type: ignore
+                    "INSERT INTO queue_items (guild_id, position, channel_id, content, speak_api_url, track, offset_seconds) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                    [
+                        (guild_id, position, item["channel_id"], item["content"], item["speak_api_url"],
+                         json.dumps(item["track"]) if item["track"] else None, item["offset"])
+                        for position, item in enumerate(items)
+                    ],
+                )
+
+    async def flush(self):
+        if self._conn is None or self.snapshot is None:
+            return
+        # 正在播放的服务器每次都重写，以便记录最新的播放进度
+        guilds = self._dirty | set(self.active() if self.active else ())
+        self._dirty = set()
+        # 尚未恢复的服务器保留原有记录
+        snapshots = {guild_id: self.snapshot(guild_id) for guild_id in guilds if guild_id not in self.pending}
+        if not snapshots:
+            return
+        # 写线程不随任务取消而中断，关闭时需等它结束后再写最后一次
+        self._writing = asyncio.ensure_future(asyncio.to_thread(self._write, snapshots))
+        try:
+            await asyncio.shield(self._writing)
+        except Exception:
+            self._dirty |= snapshots.keys()
+            raise
+
+    async def _flush_loop(self):
+        while True:
+            await asyncio.sleep(self.flush_interval)
+            try:
+                await self.flush()
+            except Exception:
+                # 写入失败时下个周期重试
+                pass
+
+    async def close(self):
+        """写出最后一次快照后停止记录，之后断开语音导致的队列变化不再落盘"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+        if self._writing is not None:
+            await asyncio.wait([self._writing])
+        await self.flush()
+        self._closed = True
+        if self._conn is not None:
+            self._conn.close()
+            self._conn = None
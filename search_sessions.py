@@ -0,0 +1,122 @@
+import asyncio
+import hashlib
+import json
+import logging
+import os
+import tempfile
+import time
+from collections import OrderedDict
+from dataclasses import asdict, dataclass, field
+
+from persist import WriteBehind
+from sharding import WORKER_INDEX
+
+# 搜索会话（搜索类型、发起人和参数）保存的时间和条数上限，超出后最早的会话失效
+SEARCH_SESSION_TTL = float(os.getenv("SEARCH_SESSION_TTL", str(24 * 3600)))
+SEARCH_SESSION_MAX_ENTRIES = int(os.getenv("SEARCH_SESSION_MAX_ENTRIES", "5000"))
+# 每个进程单独一个文件，重启后翻页按钮仍可使用
+SEARCH_SESSION_DIR = os.getenv("SEARCH_SESSION_DIR", os.path.join(tempfile.gettempdir(), "ottocord", "search_sessions"))
+
+logger = logging.getLogger("ottocord.search")
+
+
+@dataclass
+class SearchSession:
+    kind: str  # bilibili / netease / popular
+    user_id: int
+    params: dict = field(default_factory=dict)  # 不含页码的搜索参数
+
+    @property
+    def key(self) -> str:
+        # 同一用户的相同搜索复用同一个 key，custom_id 中只放这个短 key
+        payload = json.dumps([self.kind, self.user_id, self.params], sort_keys=True, ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:16]
+
+
+class SearchSessionStore:
+    """按 key 保存搜索会话的有界存储：带过期时间和条数上限，写入合并后在后台落盘
+
+    搜索结果本身不保存，翻页时按会话参数重新向 musix 取（有结果页缓存）。
+    """
+
+    def __init__(self, path: str, ttl: float = SEARCH_SESSION_TTL, max_entries: int = SEARCH_SESSION_MAX_ENTRIES):
+        self.path = path
+        self.ttl = ttl
+        self.max_entries = max_entries
+        # key -> (创建时间（墙上时间，重启后仍可比较）, 会话)
+        self._sessions: OrderedDict[str, tuple[float, SearchSession]] = OrderedDict()
+        # 用户 -> 上一条搜索消息的 (频道, 消息)，发起新搜索时删除
+        self._last_messages: OrderedDict[int, tuple[int, int]] = OrderedDict()
+        self._loading: asyncio.Task | None = None
+        self._writer = WriteBehind(path, self._snapshot, logger, "搜索会话")
+
+    @classmethod
+    def from_env(cls) -> "SearchSessionStore":
+        return cls(os.path.join(SEARCH_SESSION_DIR, f"worker-{WORKER_INDEX}.json"))
+
+    def _read(self) -> dict:
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    async def load(self):
+        """读入上次保存的会话，只读一次；在读完之前新建的会话排在后面"""
+        if self._loading is None:
+            self._loading = asyncio.create_task(self._load())
+        await self._loading
+
+    async def _load(self):
+        loaded = OrderedDict()
+        for key, (created_at, session) in (await asyncio.to_thread(self._read)).items():
+            try:
+                loaded[key] = (created_at, SearchSession(**session))
+            except TypeError:
+                continue
+        loaded.update(self._sessions)
+        self._sessions = loaded
+        self._expire()
+        # 读入旧会话之前不写，以免覆盖
+        self._writer.mark_ready()
+
+    def _expire(self):
+        deadline = time.time() - self.ttl
+        while self._sessions:
+            key, (created_at, _) = next(iter(self._sessions.items()))
+            if created_at >= deadline and len(self._sessions) <= self.max_entries:
+                break
+            del self._sessions[key]
+
+    def put(self, session: SearchSession) -> str:
+        key = session.key
+        self._sessions.pop(key, None)
+        self._sessions[key] = (time.time(), session)
+        self._expire()
+        self._writer.schedule()
+        # 旧会话读完后才会写出
+        if self._loading is None:
+            self._loading = asyncio.create_task(self._load())
+        return key
+
+    async def get(self, key: str) -> SearchSession | None:
+        await self.load()
+        entry = self._sessions.get(key)
+        if entry is None:
+            return None
+        created_at, session = entry
+        if time.time() - created_at > self.ttl:
+            del self._sessions[key]
+            return None
+        return session
+
+    def swap_last_message(self, user_id: int, channel_id: int, message_id: int) -> tuple[int, int] | None:
+        """记录用户最新的搜索消息，返回上一条（需删除）"""
+        previous = self._last_messages.pop(user_id, None)
+        self._last_messages[user_id] = (channel_id, message_id)
+        while len(self._last_messages) > self.max_entries:
+            self._last_messages.popitem(last=False)
+        return previous
+
+    def _snapshot(self) -> dict:
+        return {key: (created_at, asdict(session)) for key, (created_at, session) in self._sessions.items()}
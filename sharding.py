@@ -0,0 +1,93 @@
+import json
+import math
+import os
+import tempfile
+import time
+
+from persist import write_atomic
+
+
+def parse_shard_ids(value: str | None) -> list[int] | None:
+    """解析 "0,1,2" 或 "0-3" 形式的分片列表"""
+    if not value:
+        return None
+    shard_ids = []
+    for part in value.split(","):
+        part = part.strip()
+        if "-" in part:
+            start, end = part.split("-", 1)
+            shard_ids.extend(range(int(start), int(end) + 1))
+        elif part:
+            shard_ids.append(int(part))
+    return shard_ids
+
+
+def split_shards(shard_count: int, process_count: int) -> list[list[int]]:
+    """把 0..shard_count-1 尽量均匀地切成连续的若干段"""
+    process_count = max(1, min(process_count, shard_count))
+    base, extra = divmod(shard_count, process_count)
+    ranges = []
+    start = 0
+    for index in range(process_count):
+        size = base + (1 if index < extra else 0)
+        ranges.append(list(range(start, start + size)))
+        start += size
+    return ranges
+
+
+# 未设置时为单进程单分片；"auto" 表示由 Discord 推荐分片数
+_shard_count = os.getenv("SHARD_COUNT")
+SHARDED = bool(_shard_count)
+SHARD_COUNT = int(_shard_count) if _shard_count and _shard_count != "auto" else None
+SHARD_IDS = parse_shard_ids(os.getenv("SHARD_IDS"))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+# launcher.py 启动的工作进程总数，单独运行时为 1
+WORKER_COUNT = max(1, int(os.getenv("WORKER_COUNT", "1")))
+STATUS_DIR = os.getenv("STATUS_DIR", os.path.join(tempfile.gettempdir(), "ottocord", "status"))
+STATUS_INTERVAL = float(os.getenv("STATUS_INTERVAL", "15"))
+
+
+def worker_path(path: str) -> str:
+    """本进程独占的缓存路径：在最后一级前插入 worker-N 目录，各进程不会清理或覆盖彼此的文件"""
+    parent, name = os.path.split(path)
+    return os.path.join(parent, f"worker-{WORKER_INDEX}", name)
+
+
+def worker_share(total: int) -> int:
+    # 多个进程共用的磁盘配额按进程数平分
+    return total // WORKER_COUNT
+
+
+def collect_status(bot) -> dict:
+    latencies = getattr(bot, "latencies", None) or [(bot.shard_id or 0, bot.latency)]
+    return {
+        "worker": WORKER_INDEX,
+        "pid": os.getpid(),
+        "updated_at": time.time(),
+        # 心跳尚未完成时延迟为 inf/nan
+        "shards": {str(shard_id): round(latency * 1000, 1) if math.isfinite(latency) else None for shard_id, latency in latencies},
+        "guilds": len(bot.guilds),
+        "voice_clients": len(bot.voice_clients),
+    }
+
+
+def write_status(status: dict):
+    write_atomic(os.path.join(STATUS_DIR, f"worker-{status['worker']}.json"), json.dumps(status))
+
+
+def read_statuses() -> list[dict]:
+    if not os.path.isdir(STATUS_DIR):
+        return []
+    statuses = []
+    for name in sorted(os.listdir(STATUS_DIR)):
+        if not (name.startswith("worker-") and name.endswith(".json")):
+            continue
+        try:
+            with open(os.path.join(STATUS_DIR, name), encoding="utf-8") as f:
+                status = json.load(f)
+        except (OSError, ValueError):
+            continue
+        # 超过 4 个上报周期未更新视为失联
+        status["stale"] = time.time() - status.get("updated_at", 0) > STATUS_INTERVAL * 4
+        statuses.append(status)
+    return statuses
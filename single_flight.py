@@ -0,0 +1,49 @@
+import asyncio
+from typing import Any, Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """相同 key 的并发请求只执行一次，其余调用方等待同一个结果
+
+    发起请求的一方被取消（如丢弃预取）时不牵连等待方：等待方视为未命中，由其中一个重新发起。
+    """
+
+    def __init__(self):
+        self._futures: dict[Hashable, asyncio.Future] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._futures
+
+    async def run(self, key: Hashable, fetch: Callable[[], Awaitable[Any]], on_coalesced: Callable[[], None] | None = None):
+        while True:
+            future = self._futures.get(key)
+            if future is None:
+                break
+            if on_coalesced is not None:
+                on_coalesced()
+            try:
+                return await asyncio.shield(future)
+            except asyncio.CancelledError:
+                # 只有发起方被取消时重试；自己被取消则照常抛出
+                task = asyncio.current_task()
+                if not future.cancelled() or (task is not None and task.cancelling()):
+                    raise
+
+        future = asyncio.get_running_loop().create_future()
+        self._futures[key] = future
+        try:
+            value = await fetch()
+        except asyncio.CancelledError:
+            future.cancel()
+            raise
+        except BaseException as e:
+            future.set_exception(e)
+            # 没有其他等待者时避免 "exception was never retrieved" 警告
+            future.exception()
+            raise
+        else:
+            future.set_result(value)
+            return value
+        finally:
+            if self._futures.get(key) is future:
+                del self._futures[key]
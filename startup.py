@@ -0,0 +1,62 @@
+import hashlib
+import json
+import os
+import time
+
+import metrics
+from persist import write_atomic
+
+# 持久数据目录：与队列数据库放在一起，未设置 QUEUE_DB_PATH 时为程序目录下的 data/
+_DATA_DIR = (
+    os.path.dirname(os.path.abspath(os.environ["QUEUE_DB_PATH"])) if os.getenv("QUEUE_DB_PATH")
+    else os.path.join(os.path.dirname(os.path.abspath(__file__)), "data")
+)
+# 上次同步到 Discord 的斜杠命令定义的哈希；定义未变时启动不再重新注册。
+# 不放在系统临时目录：临时目录在重启或重建容器后会被清空，每次都得重新同步
+COMMAND_HASH_PATH = os.getenv("COMMAND_HASH_PATH", os.path.join(_DATA_DIR, "commands.sha256"))
+# 设为 1 时忽略记录的哈希，每次启动都同步
+FORCE_COMMAND_SYNC = os.getenv("FORCE_COMMAND_SYNC", "0") == "1"
+
+_PHASE_NAMES = {"import": "导入", "login": "登录", "ready": "就绪", "first_command": "首个命令"}
+
+
+class StartupTimer:
+    """记录启动各阶段距进程启动的耗时：导入完成、登录（连上网关）、就绪、第一个命令处理完"""
+
+    def __init__(self, started: float):
+        self.started = started
+        self.marks: dict[str, float] = {}
+
+    def mark(self, phase: str) -> bool:
+        """只记录每个阶段第一次到达的时间，重连不覆盖；首次记录时返回 True"""
+        if phase in self.marks:
+            return False
+        elapsed = time.monotonic() - self.started
+        self.marks[phase] = elapsed
+        metrics.STARTUP_SECONDS.set(elapsed, phase=phase)
+        return True
+
+    def report(self) -> str:
+        return " | ".join(f"{name} {self.marks[phase]:.2f}s" for phase, name in _PHASE_NAMES.items() if phase in self.marks)
+
+
+def command_schema_hash(bot) -> str:
+    commands = sorted(
+        ({**command.to_dict(), "guild_ids": command.guild_ids} for command in bot.pending_application_commands),
+        key=lambda command: command["name"],
+    )
+    # 换了机器人账号时即使定义相同也要同步；连上网关时 application_id 尚未下发，机器人账号 id 与其相同
+    payload = json.dumps({"user_id": bot.user.id if bot.user else None, "commands": commands}, sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def read_command_hash() -> str | None:
+    try:
+        with open(COMMAND_HASH_PATH, encoding="utf-8") as f:
+            return f.read().strip()
+    except OSError:
+        return None
+
+
+def write_command_hash(value: str):
+    write_atomic(COMMAND_HASH_PATH, value)
@@ -0,0 +1,137 @@
+import asyncio
+import threading
+from collections import deque
+from typing import Callable
+
+
+class StreamBuffer:
+    """有界的字节缓冲区：事件循环内的下载任务写入，ffmpeg 的 stdin 写线程读取"""
+
+    def __init__(self, capacity: int, refill: int = 0):
+        self.capacity = capacity
+        # 播放中途读空（卡顿）后，等缓冲回到该数据量再继续读，避免断断续续；0 表示有数据就读
+        self.refill = min(refill, capacity)
+        self.feeder: asyncio.Task | None = None
+        self.bytes_in = 0
+        self.bytes_out = 0
+        self.stalls = 0
+        # 卡顿时在读取线程中回调
+        self.on_stall: Callable[[], None] | None = None
+
+        self._loop = asyncio.get_running_loop()
+        self._chunks: deque[bytes] = deque()
+        self._size = 0
+        self._eof = False
+        self._closed = False
+        self._rebuffering = False
+        self._cond = threading.Condition()
+        self._space = asyncio.Event()
+        self._data = asyncio.Event()
+
+    @property
+    def level(self) -> int:
+        return self._size
+
+    @property
+    def full(self) -> bool:
+        return self._size >= self.capacity
+
+    @property
+    def closed(self) -> bool:
+        return self._closed
+
+    @property
+    def eof(self) -> bool:
+        return self._eof
+
+    def peek(self, n: int) -> bytes:
+        with self._cond:
+            return b"".join(self._chunks)[:n] if self._chunks else b""
+
+    def read(self, n: int = -1) -> bytes:
+        # 运行在 ffmpeg 的写线程中，可以阻塞
+        with self._cond:
+            if not self._chunks and not self._eof and not self._closed and self.bytes_out:
+                self.stalls += 1
+                self._rebuffering = self.refill > 0
+                if self.on_stall is not None:
+                    self.on_stall()
+            while not self._eof and not self._closed and (not self._chunks or (self._rebuffering and self._size < self.refill)):
+                self._cond.wait()
+            self._rebuffering = False
+            if self._closed or not self._chunks:
+                return b""
+
+            if n < 0:
+                n = self._size
+            parts = []
+            taken = 0
+            while self._chunks and taken < n:
+                chunk = self._chunks.popleft()
+                if taken + len(chunk) > n:
+                    self._chunks.appendleft(chunk[n - taken:])
+                    chunk = chunk[:n - taken]
+                parts.append(chunk)
+                taken += len(chunk)
+            self._size -= taken
+            self.bytes_out += taken
+
+        self._loop.call_soon_threadsafe(self._space.set)
+        return b"".join(parts)
+
+    async def wait_space(self):
+        """缓冲区满时在事件循环上等待读取方腾出空间，不阻塞线程"""
+        while not self._closed:
+            self._space.clear()
+            if self._size < self.capacity:
+                return
+            await self._space.wait()
+
+    async def write(self, data: bytes):
+        await self.wait_space()
+        if self._closed:
+            return
+
+        with self._cond:
+            self._chunks.append(data)
+            self._size += len(data)
+            self.bytes_in += len(data)
+            self._cond.notify_all()
+        self._data.set()
+
+    def finish(self):
+        with self._cond:
+            self._eof = True
+            self._cond.notify_all()
+        self._data.set()
+
+    def close(self):
+        with self._cond:
+            self._closed = True
+            self._chunks.clear()
+            self._size = 0
+            self._cond.notify_all()
+        self._space.set()
+        self._data.set()
+        if self.feeder is not None:
+            if not self.feeder.done():
+                self.feeder.cancel()
+            elif not self.feeder.cancelled():
+                self.feeder.exception()
+
+    async def wait_ready(self, prebuffer: int):
+        """等待预缓冲填满或数据写完；写入任务提前失败时抛出其异常"""
+        while self._size < prebuffer and not self._eof and not self._closed:
+            if self.feeder is not None and self.feeder.done():
+                break
+            self._data.clear()
+            waiters = [asyncio.ensure_future(self._data.wait())]
+            if self.feeder is not None:
+                waiters.append(self.feeder)  # type: ignore
+            await asyncio.wait(waiters, return_when=asyncio.FIRST_COMPLETED)
+            waiters[0].cancel()
+
+        if self.feeder is not None and self.feeder.done() and not self.feeder.cancelled():
+            error = self.feeder.exception()
+            if error is not None and self.bytes_in == 0:
+                raise error
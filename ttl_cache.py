@@ -0,0 +1,62 @@
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Hashable
+
+from single_flight import SingleFlight
+
+
+class TTLCache:
+    """带过期时间和条目上限的内存缓存，相同 key 的并发请求共享一次回源"""
+
+    def __init__(self, ttl: float, max_entries: int = 1024):
+        self.ttl = ttl
+        self.max_entries = max_entries
+        self._entries: OrderedDict[Hashable, tuple[float, Any]] = OrderedDict()
+        self._inflight = SingleFlight()
+        self.stats = {"hits": 0, "misses": 0, "coalesced": 0}
+
+    def age(self, key: Hashable) -> float | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return time.monotonic() - entry[0]
+
+    def get(self, key: Hashable):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if time.monotonic() - stored_at > self.ttl:
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def set(self, key: Hashable, value):
+        self._entries.pop(key, None)
+        self._entries[key] = (time.monotonic(), value)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, key: Hashable):
+        self._entries.pop(key, None)
+
+    def inflight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    async def get_or_fetch(self, key: Hashable, fetch: Callable[[], Awaitable[Any]]):
+        value = self.get(key)
+        if value is not None:
+            self.stats["hits"] += 1
+            return value
+
+        async def fetch_and_store():
+            self.stats["misses"] += 1
+            value = await fetch()
+            self.set(key, value)
+            return value
+
+        return await self._inflight.run(key, fetch_and_store, self._count_coalesced)
+
+    def _count_coalesced(self):
+        self.stats["coalesced"] += 1
@@ -4,85 +4,698 @@ import discord
 import aiohttp
 import asyncio
 import tempfile
+import io
 import os
-import datetime
+import logging
+import queue
+import random
+import re
+import shlex
 import traceback
+import weakref
 from collections import defaultdict
+from dataclasses import dataclass, field
+from enum import Enum
+from urllib.parse import urlsplit
 
 from discord.ui import View, Button
 
+import metrics
+from audio_cache import AudioCache, EntryTooLarge
+from byte_cache import ByteCache, make_key
+from governor import Governor
+from http_pool import HTTPPool
+from loudness import LOUDNESS_MODE, LoudnessCache
+from musix_client import SIGNED_URL_FIELDS, MusixClient
+from queue_store import QueueStore
+from sharding import worker_path, worker_share
+from stream_buffer import StreamBuffer
+
+
+PREFETCH_DEPTH = int(os.getenv("PREFETCH_DEPTH", "2"))
+PREFETCH_MEMORY_MB = int(os.getenv("PREFETCH_MEMORY_MB", "32"))
+# 合并连续 /say 的等待窗口（毫秒）：窗口内先后到达且在队列中相邻的朗读合成一次、播放一次；0 表示不合并
+TTS_COALESCE_MS = int(os.getenv("TTS_COALESCE_MS", "0"))
+# 合并后单次朗读的最大字数
+TTS_COALESCE_MAX_CHARS = int(os.getenv("TTS_COALESCE_MAX_CHARS", "300"))
+# 超过该字数的朗读按句切分、分段合成，第一段合成好即开始播放；0 表示不切分
+TTS_CHUNK_CHARS = int(os.getenv("TTS_CHUNK_CHARS", "80"))
+# 同一条朗读同时合成的段数
+TTS_CHUNK_CONCURRENCY = int(os.getenv("TTS_CHUNK_CONCURRENCY", "2"))
+# memory：内存音频经管道直接交给 ffmpeg；tempfile：先写临时文件（兼容回退）
+AUDIO_PLAYBACK_MODE = os.getenv("AUDIO_PLAYBACK_MODE", "memory")
+# stream：边下边播，内存占用以缓冲区大小为上限；full：下载完整文件后再播放
+DOWNLOAD_MODE = os.getenv("DOWNLOAD_MODE", "stream")
+STREAM_BUFFER_BYTES = int(os.getenv("STREAM_BUFFER_KB", "2048")) * 1024
+STREAM_PREBUFFER_BYTES = int(os.getenv("STREAM_PREBUFFER_KB", "256")) * 1024
+DOWNLOAD_STALL_TIMEOUT = float(os.getenv("DOWNLOAD_STALL_TIMEOUT", "10"))
+# 边下边播和拉流建立连接（含等待连接池空闲连接）的超时
+STREAM_CONNECT_TIMEOUT = float(os.getenv("STREAM_CONNECT_TIMEOUT", "15"))
+# pcm：ffmpeg 输出 PCM，由机器人进程编码 Opus；opus：ffmpeg 直接输出 Opus（源已是 Opus 时直接透传）
+AUDIO_ENCODER = os.getenv("AUDIO_ENCODER", "opus")
+# opus 模式下是否用 ffprobe 探测 /stream_url 的编码，以便透传 Opus 直播流
+OPUS_PROBE_STREAMS = os.getenv("OPUS_PROBE_STREAMS", "1") == "1"
+# 缓存的签名地址超过该时间（秒）后，播放前先探测一次是否已失效
+MUSIX_URL_PROBE_AFTER = float(os.getenv("MUSIX_URL_PROBE_AFTER", "60"))
+# direct：ffmpeg 直接读取流地址；buffered：由机器人拉流写入抖动缓冲区再交给 ffmpeg，断线或卡住时自动重连（源支持 Range 时从断点续传）
+STREAM_INGEST_MODE = os.getenv("STREAM_INGEST_MODE", "buffered")
+# 抖动缓冲区：最多预读的数据量，以及开始播放和卡顿后恢复播放前需要缓冲的数据量
+STREAM_JITTER_BUFFER_BYTES = int(os.getenv("STREAM_JITTER_BUFFER_KB", "1024")) * 1024
+STREAM_JITTER_PREBUFFER_BYTES = int(os.getenv("STREAM_JITTER_PREBUFFER_KB", "64")) * 1024
+# 超过该时间（秒）收不到数据视为断流并重连
+STREAM_STALL_TIMEOUT = float(os.getenv("STREAM_STALL_TIMEOUT", "5"))
+# 连续重连失败（期间没有收到任何数据）的最大次数；间隔同样指数增长并带抖动
+STREAM_RECONNECT_ATTEMPTS = int(os.getenv("STREAM_RECONNECT_ATTEMPTS", "5"))
+STREAM_RECONNECT_BACKOFF = float(os.getenv("STREAM_RECONNECT_BACKOFF", "0.5"))
+STREAM_RECONNECT_BACKOFF_MAX = float(os.getenv("STREAM_RECONNECT_BACKOFF_MAX", "10"))
+BILIBILI_HEADERS = {
+    "Referer": "https://www.bilibili.com",
+    "User-Agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36",
+}
+# 拉流时附带的请求头，按曲目来源或流地址的域名选择；都不匹配时使用 default
+STREAM_HEADER_PROFILES = {
+    "bilibili": BILIBILI_HEADERS,
+    "default": {"User-Agent": BILIBILI_HEADERS["User-Agent"]},
+}
+# 一次批量加入的最大曲目数
+PLAYLIST_MAX_TRACKS = int(os.getenv("PLAYLIST_MAX_TRACKS", "100"))
+# 单个服务器队列中最多等待的项数，0 表示不限制
+MAX_QUEUE_PER_GUILD = int(os.getenv("MAX_QUEUE_PER_GUILD", "200"))
+# 队列播放完后语音连接保留的秒数，期间有新曲目加入可直接复用；0 表示立即断开
+VOICE_IDLE_LINGER = float(os.getenv("VOICE_IDLE_LINGER", "60"))
+VOICE_CONNECT_RETRIES = int(os.getenv("VOICE_CONNECT_RETRIES", "3"))
+# 连接失败后的重试间隔：以 VOICE_CONNECT_BACKOFF 秒为基数指数增长，不超过 VOICE_CONNECT_BACKOFF_MAX，并加入随机抖动
+VOICE_CONNECT_BACKOFF = float(os.getenv("VOICE_CONNECT_BACKOFF", "1"))
+VOICE_CONNECT_BACKOFF_MAX = float(os.getenv("VOICE_CONNECT_BACKOFF_MAX", "15"))
+# 合并朗读时视为已有停顿的句末字符
+_SENTENCE_ENDINGS = ("。", "！", "？", "…", "，", ".", "!", "?", ",", "~")
+# 切分长朗读：句末标点（含中文全角标点和换行）之后，或英文句号加空格之后
+_SENTENCE_SPLIT = re.compile(r"(?<=[。！？；…!?;\n])|(?<=\.\s)")
+# 单句仍过长时在逗号等停顿处切分
+_CLAUSE_SPLIT = re.compile(r"(?<=[，、：,:])")
+# 每次从音频源读取的是 20ms 的一帧，用于换算播放进度
+FRAME_SECONDS = 0.02
+
+
+def _parse_header_hosts(value: str | None) -> dict[str, str]:
+    """解析 "example.com=bilibili,radio.example=default" 形式的域名后缀到请求头配置的映射"""
+    hosts = {}
+    for part in (value or "").split(","):
+        host, _, profile = part.strip().partition("=")
+        if host and profile.strip() in STREAM_HEADER_PROFILES:
+            hosts[host.strip().lower()] = profile.strip()
+    return hosts
+
+
+# 域名后缀 -> 请求头配置，可用 STREAM_HEADER_HOSTS 补充或覆盖
+STREAM_HEADER_HOSTS = {
+    "bilivideo.com": "bilibili",
+    "bilivideo.cn": "bilibili",
+    "hdslb.com": "bilibili",
+    "bilibili.com": "bilibili",
+    **_parse_header_hosts(os.getenv("STREAM_HEADER_HOSTS")),
+}
+
+logger = logging.getLogger("ottocord.player")
+
+
+def _log_level(message: str) -> int:
+    # 沿用日志前缀的表情判断级别
+    if message.startswith("❌"):
+        return logging.ERROR
+    if message.startswith(("⚠️", "⏰")):
+        return logging.WARNING
+    return logging.INFO
+
+
+async def _send_error_to_voice_channel(error_message: str, ctx: discord.ApplicationContext | None):
+    command = getattr(ctx, "command", None)
+    metrics.COMMAND_ERRORS.inc(command=command.name if command else "unknown")
+    # 重启后恢复的曲目没有可回复的交互
+    if ctx is None:
+        return
+    try:
+        await ctx.respond(error_message, ephemeral=True)
+    except (discord.HTTPException, aiohttp.ClientError) as e:
+        # 交互令牌 15 分钟后失效，排在长队列后面的曲目出错时已无法回复；提示失败不应再向上抛出
+        logger.warning(f"⚠️ 无法发送错误提示（{error_message}）：{e}")
+
+
+async def _acknowledge(ctx: discord.ApplicationContext, content: str, **kwargs):
+    """先回复一条占位消息确认交互，返回之后用于原地编辑的响应"""
+    first = not ctx.response.is_done()
+    response = await ctx.respond(content, **kwargs)
+    if first:
+        metrics.observe_ack(ctx.interaction.created_at, ctx.command.name if ctx.command else "unknown")
+    return response
+
+
+async def _edit_response(response, **kwargs):
+    # 首次响应返回 Interaction，之后的 followup 返回消息
+    if isinstance(response, discord.Interaction):
+        return await response.edit_original_response(**kwargs)
+    return await response.edit(**kwargs)
+
+
+def _is_ogg_opus(head: bytes) -> bool:
+    # Ogg 首页中紧跟 OpusHead 标识即为 Ogg Opus
+    return head.startswith(b"OggS") and b"OpusHead" in head[:64]
+
+
+def _backoff_delay(attempt: int, base: float = VOICE_CONNECT_BACKOFF, cap: float = VOICE_CONNECT_BACKOFF_MAX) -> float:
+    # 指数退避 + 抖动，避免多个服务器同时重连时扎堆
+    delay = min(base * 2 ** (attempt - 1), cap)
+    return delay * random.uniform(0.5, 1.5)
+
+
+def _stream_headers(audio_url: str, track: tuple | None = None) -> dict:
+    if track and track[0] in STREAM_HEADER_PROFILES:
+        return STREAM_HEADER_PROFILES[track[0]]
+    host = (urlsplit(audio_url).hostname or "").lower()
+    for suffix, profile in STREAM_HEADER_HOSTS.items():
+        if host == suffix or host.endswith(f".{suffix}"):
+            return STREAM_HEADER_PROFILES[profile]
+    return STREAM_HEADER_PROFILES["default"]
+
+
+def _header_lines(headers: dict) -> str:
+    # ffmpeg -headers 的格式，每行以 CRLF 结尾
+    return "".join(f"{k}: {v}\r\n" for k, v in headers.items())
+
+
+def _content_total(content_range: str | None) -> int | None:
+    # "bytes 100-199/1000" 中的总长度，未知时为 "*"
+    _, _, total = (content_range or "").rpartition("/")
+    return int(total) if total.isdigit() else None
+
+
+def _loudness_key(item: "QueueItem") -> str | None:
+    if item.speak_api_url:
+        # 同一个 TTS 接口的音色和音量一致，测一次即可
+        return make_key("tts", item.speak_api_url)
+    if item.track:
+        return make_key(*item.track)
+    if item.is_stream:
+        # 直播流没有终点，无法测量
+        return None
+    return make_key("url", item.content)
+
+
+def _split_tts_text(text: str, max_chars: int = TTS_CHUNK_CHARS) -> list[str]:
+    """把长朗读按句切成不超过 max_chars 字的若干段；第一段只取第一句，尽快开始播放"""
+    if max_chars <= 0 or len(text) <= max_chars:
+        return [text]
+
+    pieces = []
+    for sentence in _SENTENCE_SPLIT.split(text):
+        if len(sentence) <= max_chars:
+            pieces.append(sentence)
+            continue
+        for clause in _CLAUSE_SPLIT.split(sentence):
+            # 没有停顿可切时按字数硬切
+            pieces.extend(clause[i:i + max_chars] for i in range(0, len(clause), max_chars))
+
+    chunks = []
+    current = ""
+    for piece in pieces:
+        if not piece.strip():
+            current += piece
+            continue
+        if current.strip() and (len(chunks) == 0 or len(current) + len(piece) > max_chars):
+            chunks.append(current.strip())
+            current = ""
+        current += piece
+    if current.strip():
+        chunks.append(current.strip())
+    return chunks or [text]
+
+
+def _channel_bitrate(voice_channel) -> int:
+    # 语音频道码率单位为 bps，ffmpeg 使用 kbps；Discord 上限为 384kbps
+    bitrate = getattr(voice_channel, "bitrate", None) or 64000
+    return max(16, min(bitrate // 1000, 384))
+
+
+class DownloadError(Exception):
+    def __init__(self, status: int):
+        super().__init__(f"HTTP {status}")
+        self.status = status
+
+
+class QueueFullError(Exception):
+    pass
+
+
+@dataclass
+class QueueItem:
+    voice_channel: discord.VoiceChannel
+    content: str
+    speak_api_url: str | None = None  # 非空表示 TTS 播放
+    track: tuple | None = None  # (来源, id, 分P)，用于签名地址失效后重新获取
+    ctx: discord.ApplicationContext | None = field(default=None, repr=False)  # 出错时回复发起命令的交互
+    # 预取结果：TTS/下载为音频字节（边下边播时为 StreamBuffer），流式播放为已打开的音频源
+    prefetch: asyncio.Task | None = field(default=None, repr=False)
+    prefetch_size: int = 0
+    enqueued_at: float = field(default_factory=time.monotonic)
+    offset: float = 0.0  # 从该位置（秒）开始播放，用于重启后续播
+
+    @property
+    def seekable(self) -> bool:
+        # TTS 从头播放；直播流无法定位，解析出的视频音频流可以
+        return not self.speak_api_url and (not self.is_stream or self.track is not None)
+
+    @property
+    def kind(self) -> str:
+        if self.speak_api_url:
+            return "tts"
+        return "stream" if self.is_stream else "url"
+
+    @property
+    def is_stream(self) -> bool:
+        return not self.speak_api_url and self.content.startswith("stream:")
+
+    def discard_prefetch(self):
+        task, self.prefetch, self.prefetch_size = self.prefetch, None, 0
+        if task is None:
+            return
+        if not task.done():
+            task.cancel()
+        elif not task.cancelled() and task.exception() is None:
+            result = task.result()
+            if isinstance(result, discord.AudioSource):
+                result.cleanup()
+            elif isinstance(result, StreamBuffer):
+                result.close()
+
+
+@dataclass
+class GuildSettings:
+    prefetch_depth: int = PREFETCH_DEPTH
+    prefetch_memory_bytes: int = PREFETCH_MEMORY_MB * 1024 * 1024
+    tts_coalesce_window: float = TTS_COALESCE_MS / 1000
+
+
+class PlayQueue(asyncio.Queue):
+    """支持查看和移除排队项的播放队列"""
+
+    def peek(self, n: int) -> list[QueueItem]:
+        return list(self._queue)[:n]  # type: ignore
+
+    def remove(self, index: int) -> QueueItem:
+        item = self._queue[index]  # type: ignore
+        del self._queue[index]  # type: ignore
+        # 被移除的项不会再被取出，需同步减少未完成计数，否则 join() 永远等不到
+        self.task_done()
+        return item
+
+    def put_front(self, items: list[QueueItem]):
+        """把若干项按原顺序插到队首"""
+        for item in reversed(items):
+            self._queue.appendleft(item)  # type: ignore
+        self._unfinished_tasks += len(items)  # type: ignore
+        self._finished.clear()  # type: ignore
+        self._wakeup_next(self._getters)  # type: ignore
+
+
+class PlayerState(Enum):
+    IDLE = "idle"
+    # 等待全局播放名额
+    WAITING = "waiting"
+    CONNECTING = "connecting"
+    BUFFERING = "buffering"
+    PLAYING = "playing"
+
+
+@dataclass
+class GuildPlayer:
+    """单个服务器的常驻播放器：由一个 worker 任务按顺序消费播放队列"""
+    guild_id: int
+    state: PlayerState = PlayerState.IDLE
+    worker: asyncio.Task | None = field(default=None, repr=False)
+    current: QueueItem | None = None
+    voice_client: discord.VoiceClient | None = field(default=None, repr=False)
+    source: "_MeteredSource | None" = field(default=None, repr=False)
+
+    @property
+    def position(self) -> float:
+        """当前曲目已播放到的秒数（含续播的起始位置）"""
+        if self.current is None:
+            return 0.0
+        played = self.source.frames * FRAME_SECONDS if self.source is not None else 0.0
+        return self.current.offset + played
+
+    async def play(self, vc: discord.VoiceClient, source: discord.AudioSource) -> Exception | None:
+        """开始播放并等待结束（播放完毕或被跳过），返回播放线程报告的错误"""
+        loop = asyncio.get_running_loop()
+        finished = loop.create_future()
+
+        def resolve(error):
+            if not finished.done():
+                finished.set_result(error)
+
+        def after_play(error):
+            # 在播放线程中调用，结束事件交回事件循环
+            loop.call_soon_threadsafe(resolve, error)
+
+        self.voice_client = vc
+        self.state = PlayerState.PLAYING
+        if isinstance(source, _MeteredSource):
+            self.source = source
+        vc.play(source, after=after_play)
+        try:
+            return await finished
+        except asyncio.CancelledError:
+            vc.stop()
+            raise
+
+
+class _MeteredSource(discord.AudioSource):
+    """包装音频源，在输出第一帧时回调一次"""
+
+    def __init__(self, original: discord.AudioSource, on_first_frame):
+        self.original = original
+        self.frames = 0
+        self._on_first_frame = on_first_frame
+
+    def read(self) -> bytes:
+        data = self.original.read()
+        if data:
+            self.frames += 1
+        if self._on_first_frame is not None:
+            callback, self._on_first_frame = self._on_first_frame, None
+            callback()
+        return data
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def cleanup(self):
+        # pipe 模式下写线程已关闭 stdin，若 kill 后进程尚未退出，库内的 communicate() 会报错；先等待进程结束
+        process = getattr(self.original, "_process", None)
+        if process:
+            process.kill()
+            process.wait()
+        self.original.cleanup()
+
+
+class _IngestSource(discord.AudioSource):
+    """从抖动缓冲区读取的 ffmpeg 音频源；停止播放时一并停止拉流"""
+
+    def __init__(self, original: discord.AudioSource, buffer: StreamBuffer):
+        self.original = original
+        self.buffer = buffer
+
+    def read(self) -> bytes:
+        return self.original.read()
+
+    def is_opus(self) -> bool:
+        return self.original.is_opus()
+
+    def cleanup(self):
+        # 先关闭缓冲区，唤醒阻塞在读取上的 stdin 写线程
+        self.buffer.close()
+        process = getattr(self.original, "_process", None)
+        if process:
+            process.kill()
+            process.wait()
+        self.original.cleanup()
+
+
+class _ChainedSource(discord.AudioSource):
+    """依次播放后续陆续加入的音频源，中间无需重新开始播放；下一段未就绪时输出静音帧占位"""
+
+    def __init__(self, first: discord.AudioSource):
+        self._opus = first.is_opus()
+        self._current: discord.AudioSource | None = first
+        # 事件循环放入，播放线程取出；None 表示不会再有后续
+        self._pending: queue.SimpleQueue = queue.SimpleQueue()
+        self._finished = False
+        self._closed = False
+        self._silence = discord.opus.OPUS_SILENCE if self._opus else b"\0" * discord.opus.Encoder.FRAME_SIZE
+
+    def append(self, source: discord.AudioSource):
+        self._pending.put(source)
+        if self._closed:
+            # 播放已结束（被跳过或出错），后到的音频源直接释放
+            self._drain()
+
+    def finish(self):
+        self._pending.put(None)
+
+    def read(self) -> bytes:
+        while True:
+            if self._current is not None:
+                data = self._current.read()
+                if data:
+                    return data
+                self._current.cleanup()
+                self._current = None
+            if self._finished:
+                return b""
+            try:
+                source = self._pending.get_nowait()
+            except queue.Empty:
+                # 下一段还在合成，不阻塞播放线程，否则之后会一次性补发积压的帧
+                return self._silence
+            if source is None:
+                self._finished = True
+            else:
+                self._current = source
+
+    def is_opus(self) -> bool:
+        return self._opus
+
+    def cleanup(self):
+        self._finished = self._closed = True
+        if self._current is not None:
+            self._current.cleanup()
+            self._current = None
+        self._drain()
+
+    def _drain(self):
+        while True:
+            try:
+                source = self._pending.get_nowait()
+            except queue.Empty:
+                return
+            if source is not None:
+                source.cleanup()
 
-async def _send_error_to_voice_channel(error_message: str, ctx: discord.ApplicationContext):
-    await ctx.respond(error_message, ephemeral=True)
 
 class TTSPlayerService:
-    def __init__(self, bot: discord.Bot, ffmpeg_path="ffmpeg"):
+    def __init__(self, bot: discord.Bot, ffmpeg_path="ffmpeg", http_pool: HTTPPool | None = None, queue_store: QueueStore | None = None):
         self.bot = bot
         self.ffmpeg_path = ffmpeg_path
-        self.queues: dict[int, asyncio.Queue] = defaultdict(asyncio.Queue)
-        self.playing_tasks: dict[int, asyncio.Task] = {}
-        self.current_voice_clients: dict[int, discord.VoiceClient] = {}
-        self.musix_api_url = os.getenv("MUSIX_API_URL")
+        self.http_pool = http_pool or HTTPPool()
+        # 可选的队列持久化，重启后按服务器续播
+        self.queue_store = queue_store
+        if queue_store is not None:
+            queue_store.snapshot = self._queue_snapshot
+            queue_store.active = lambda: [guild_id for guild_id, player in list(self.players.items()) if player.state == PlayerState.PLAYING]
+        self.queues: dict[int, PlayQueue] = defaultdict(PlayQueue)
+        self.guild_settings: dict[int, GuildSettings] = defaultdict(GuildSettings)
+        # 每首曲目的磁盘写入量和事件循环阻塞时间（累计）
+        self.playback_stats = {"tracks": 0, "disk_bytes_written": 0, "loop_stall_seconds": 0.0}
+
+        # 抓取指标时才计算的瞬时值
+        metrics.QUEUE_DEPTH.callback = lambda: {(str(guild_id),): queue.qsize() for guild_id, queue in self.queues.items()}
+        metrics.VOICE_CLIENTS.callback = lambda: {(): len(self.bot.voice_clients)}
+        metrics.FFMPEG_PROCESSES.callback = lambda: {(): sum(1 for source in list(self._ffmpeg_sources) if source._process)}
+        metrics.TTS_CACHE.callback = lambda: {(result,): count for result, count in self.tts_cache.stats.items()}
+        metrics.AUDIO_CACHE.callback = lambda: {(result,): count for result, count in self.audio_cache.stats.items() if result != "bytes_saved"} if self.audio_cache else {}
+        metrics.AUDIO_CACHE_BYTES_SAVED.callback = lambda: {(): self.audio_cache.stats["bytes_saved"]} if self.audio_cache else {}
+        metrics.PLAYER_STATES.callback = self._player_state_counts
+        # 全局的 ffmpeg / 下载 / TTS 并发上限，名额不足时各服务器轮流获得
+        self.governor = Governor()
+        metrics.GOVERNOR.callback = self.governor.stats
+        # 正在播放的拉流缓冲区，用于上报缓冲水位
+        self.stream_buffers: dict[int, StreamBuffer] = {}
+        metrics.STREAM_BUFFER_FILL.callback = lambda: {(str(guild_id),): buffer.level / buffer.capacity for guild_id, buffer in list(self.stream_buffers.items())}
+        # 每个活跃的服务器一个常驻播放器，空闲超过 VOICE_IDLE_LINGER 秒后退出
+        self.players: dict[int, GuildPlayer] = {}
+        # 同一服务器的并发命令串行地建立语音连接
+        self.connect_locks: dict[int, asyncio.Lock] = defaultdict(asyncio.Lock)
+        self._ffmpeg_sources = weakref.WeakSet()
+        self.musix = MusixClient(self.http_pool, os.getenv("MUSIX_API_URL"))
+        # TTS 音频缓存：内存热层 + 磁盘层，各自独立的容量上限
+        # 磁盘缓存目录按进程区分，上限为所有进程合计，按进程数平分
+        self.tts_cache = ByteCache(
+            memory_bytes=int(os.getenv("TTS_CACHE_MEMORY_MB", "64")) * 1024 * 1024,
+            disk_bytes=worker_share(int(os.getenv("TTS_CACHE_DISK_MB", "512")) * 1024 * 1024),
+            disk_dir=worker_path(os.getenv("TTS_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ottocord", "tts_cache"))),
+        )
+        # bilibili / 网易云曲目的完整音频文件缓存，AUDIO_CACHE_DISK_MB 为 0 时关闭
+        audio_cache_bytes = worker_share(int(os.getenv("AUDIO_CACHE_DISK_MB", "2048")) * 1024 * 1024)
+        # 后台写入曲目缓存的下载任务
+        self._cache_fills: set[asyncio.Task] = set()
+        self.audio_cache = AudioCache(
+            disk_dir=worker_path(os.getenv("AUDIO_CACHE_DIR", os.path.join(tempfile.gettempdir(), "ottocord", "audio_cache"))),
+            max_bytes=audio_cache_bytes,
+            max_entry_bytes=int(os.getenv("AUDIO_CACHE_MAX_ENTRY_MB", "64")) * 1024 * 1024,
+            admit_after=int(os.getenv("AUDIO_CACHE_ADMIT_AFTER", "2")),
+        ) if audio_cache_bytes > 0 else None
+        # 响度均衡：每首曲目只在后台测量一次，之后播放时按测量结果单次调整增益
+        self.loudness = LoudnessCache(ffmpeg_path) if LOUDNESS_MODE == "cached" else None
+
+    async def warm_up(self):
+        """就绪后在后台读入各磁盘缓存的索引，不拖慢启动"""
+        started = time.monotonic()
+        loads = [self.tts_cache.load()]
+        if self.audio_cache is not None:
+            loads.append(self.audio_cache.load())
+        if self.loudness is not None:
+            loads.append(self.loudness.load())
+        for result in await asyncio.gather(*loads, return_exceptions=True):
+            if isinstance(result, Exception):
+                self.log(0, f"⚠️ 读入缓存索引失败：{result}")
+        self.log(0, "🔥 缓存索引已读入", latency=round(time.monotonic() - started, 3))
 
     @staticmethod
-    def log(guild_id: int, message: str):
-        now = datetime.datetime.now().strftime("%H:%M:%S")
-        print(f"[{now}] [GUILD {guild_id}] {message}")
-
-    async def _add_queue(self, guild_id, message, ctx):
+    def log(guild_id: int, message: str, level: int | None = None, **fields):
+        # 只放入日志队列，由后台线程写出，不会阻塞事件循环或播放线程
+        if level is None:
+            level = _log_level(message)
+        if logger.isEnabledFor(level):
+            logger.log(level, message, extra={"guild_id": guild_id, **fields})
+
+    def _player_state_counts(self) -> dict:
+        counts = {(state.value,): 0 for state in PlayerState}
+        for player in list(self.players.values()):
+            counts[(player.state.value,)] += 1
+        return counts
+
+    async def _add_queue(self, guild_id, message, ctx: discord.ApplicationContext | None = None):
         self.log(guild_id, f"✅ 加入播放队列：{message}")
+        self._persist(guild_id)
+        if self._ensure_player(guild_id) and ctx is not None and self.governor.resources["ffmpeg"].busy():
+            position = self.governor.position("ffmpeg", guild_id)
+            await ctx.respond(f"⏳ 当前播放繁忙，已排在第 {position} 位，轮到后自动开始播放", ephemeral=True)
+
+    def _ensure_player(self, guild_id: int) -> bool:
+        """确保服务器有播放器在运行，新建时返回 True"""
+        player = self.players.get(guild_id)
+        if player is None:
+            player = self.players[guild_id] = GuildPlayer(guild_id)
+            player.worker = asyncio.create_task(self._player_worker(player))
+            return True
+        self._schedule_prefetch(guild_id)
+        return False
+
+    def _check_queue_limit(self, guild_id: int):
+        if MAX_QUEUE_PER_GUILD > 0 and self.queues[guild_id].qsize() >= MAX_QUEUE_PER_GUILD:
+            raise QueueFullError(f"播放队列已满（最多 {MAX_QUEUE_PER_GUILD} 项），请稍后再试")
+
+    def _persist(self, guild_id: int):
+        if self.queue_store is not None:
+            self.queue_store.mark_dirty(guild_id)
+
+    def _queue_snapshot(self, guild_id: int) -> list[dict]:
+        player = self.players.get(guild_id)
+        items = []
+        if player is not None and player.current is not None:
+            items.append((player.current, player.position if player.current.seekable else 0.0))
+        items.extend((item, item.offset) for item in self.queues[guild_id].peek(self.queues[guild_id].qsize()))
+        return [
+            {
+                "channel_id": item.voice_channel.id,
+                "content": item.content,
+                "speak_api_url": item.speak_api_url,
+                "track": item.track,
+                "offset": round(offset, 2),
+            }
+            for item, offset in items
+        ]
+
+    def has_active_listeners(self, guild: discord.Guild) -> bool:
+        """重启前的队列所在语音频道中是否有人"""
+        channel_ids = self.queue_store.pending.get(guild.id, ()) if self.queue_store else ()
+        for channel_id in channel_ids:
+            channel = guild.get_channel(channel_id)
+            if isinstance(channel, discord.VoiceChannel) and any(not member.bot for member in channel.members):
+                return True
+        return False
+
+    async def restore_queue(self, guild: discord.Guild):
+        """恢复重启前保存的队列，排在重启后新加入的曲目之前；没有待恢复队列时直接返回"""
+        store = self.queue_store
+        if store is None or store.pending.pop(guild.id, None) is None:
+            return
+
+        items = []
+        for row in await store.load(guild.id):
+            channel = guild.get_channel(row["channel_id"])
+            if not isinstance(channel, discord.VoiceChannel):
+                continue
+            items.append(QueueItem(channel, row["content"], row["speak_api_url"], track=row["track"], offset=row["offset"]))
 
-        if guild_id not in self.playing_tasks or self.playing_tasks[guild_id].done():
-            task = asyncio.create_task(self._player_loop(guild_id, ctx))
-            self.playing_tasks[guild_id] = task
+        self._persist(guild.id)
+        if not items:
+            return
+        self.queues[guild.id].put_front(items)
+        resume = f"（从 {items[0].offset:.0f} 秒处续播）" if items[0].offset else ""
+        self.log(guild.id, f"♻️ 已恢复重启前的队列：{len(items)} 项{resume}")
+        self._ensure_player(guild.id)
 
     async def join_and_speak(self, voice_channel: discord.VoiceChannel, message: str, speak_api_url: str, ctx: discord.ApplicationContext):
         guild_id = voice_channel.guild.id
         queue = self.queues[guild_id]
+        await self.restore_queue(voice_channel.guild)
+        self._check_queue_limit(guild_id)
 
-        await queue.put((voice_channel, message, speak_api_url))
+        await queue.put(QueueItem(voice_channel, message, speak_api_url, ctx=ctx))
         try:
             await self._add_queue(guild_id, message, ctx)
         except Exception as e:
             await _send_error_to_voice_channel(f"❌ 播放语音时发生错误: {str(e)}", ctx)
 
-    async def join_and_play_url(self, voice_channel: discord.VoiceChannel, audio_url: str, ctx: discord.ApplicationContext):
+    async def join_and_play_url(self, voice_channel: discord.VoiceChannel, audio_url: str, ctx: discord.ApplicationContext, track: tuple | None = None):
         guild_id = voice_channel.guild.id
         queue = self.queues[guild_id]
+        await self.restore_queue(voice_channel.guild)
+        self._check_queue_limit(guild_id)
 
-        await queue.put((voice_channel, audio_url, None))  # None 表示是 URL 播放
+        await queue.put(QueueItem(voice_channel, audio_url, track=track, ctx=ctx))  # 无 speak_api_url 表示是 URL 播放
         try:
             await self._add_queue(guild_id, audio_url, ctx)
         except Exception as e:
             await _send_error_to_voice_channel(f"❌ 播放 URL 时发生错误: {str(e)}", ctx)
 
-    async def join_and_stream_url(self, voice_channel: discord.VoiceChannel, stream_url: str, ctx: discord.ApplicationContext):
+    async def join_and_stream_url(self, voice_channel: discord.VoiceChannel, stream_url: str, ctx: discord.ApplicationContext, track: tuple | None = None):
         guild_id = voice_channel.guild.id
         queue = self.queues[guild_id]
+        await self.restore_queue(voice_channel.guild)
+        self._check_queue_limit(guild_id)
 
-        await queue.put((voice_channel, f"stream:{stream_url}", None))  # 使用特殊前缀标记为流式播放
+        await queue.put(QueueItem(voice_channel, f"stream:{stream_url}", track=track, ctx=ctx))  # 使用特殊前缀标记为流式播放
         try:
             await self._add_queue(guild_id, f"[流式播放] {stream_url}", ctx)
         except Exception as e:
             await _send_error_to_voice_channel(f"❌ 流式播放时发生错误: {str(e)}", ctx)
 
-    async def join_and_play_bilibili(self, voice_channel: discord.VoiceChannel, bvid: str, ctx: discord.ApplicationContext, page:int = 0):
-        # 使用musix API获取视频信息
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{self.musix_api_url}/bilibili/videos/{bvid}", params={"page": page}) as resp:
-                if resp.status != 200:
-                    raise Exception(f"获取视频信息失败: HTTP {resp.status}")
-                result = await resp.json()
-                
-                # 调试：打印完整响应
-                self.log(voice_channel.guild.id, f"📋 API响应: {result}")
-                
-                # 检查API响应格式
-                if "data" not in result:
-                    raise Exception(f"API响应格式错误，缺少data字段: {result}")
-                
-                info = result.get("data", {})
-        
+    async def _resolve(self, response, source: str, resolve):
+        """交互已确认后解析元数据，失败时把占位消息改为失败提示"""
+        started = time.monotonic()
+        try:
+            info = await resolve
+        except Exception:
+            try:
+                await _edit_response(response, content="❌ 解析失败")
+            except Exception:
+                pass
+            raise
+        metrics.RESOLVE_SECONDS.observe(time.monotonic() - started, source=source)
+        return info
+
+    async def join_and_play_bilibili(self, voice_channel: discord.VoiceChannel, bvid: str, ctx: discord.ApplicationContext, page:int = 0, response=None):
+        if response is None:
+            response = await _acknowledge(ctx, f"🔎 正在解析 bilibili 视频：{bvid}")
+        # 使用musix API获取视频信息（带缓存）
+        info = await self._resolve(response, "bilibili", self.musix.track_info("bilibili", bvid, page))
+
+        # 调试：完整响应只在 DEBUG 级别输出
+        if logger.isEnabledFor(logging.DEBUG):
+            self.log(voice_channel.guild.id, f"📋 API响应: {info}", level=logging.DEBUG, track=bvid)
+
         audio_url = info.get("audio_url")
         
         embed = discord.Embed(title=info["title"], description=info.get("desc", ""))
@@ -111,27 +724,18 @@ class TTSPlayerService:
         view = View()
         view.add_item(button)
 
-        await ctx.respond(otto_respond, embed=embed, view=view)
+        await _edit_response(response, content=otto_respond, embed=embed, view=view)
 
         if audio_url is None:
             raise Exception("无法解析该视频的音频流")
         await self.join_and_speak(voice_channel, otto_respond, str(os.getenv("SPEAK_API_URL")), ctx)
-        await self.join_and_stream_url(voice_channel, audio_url, ctx)
+        await self.join_and_stream_url(voice_channel, audio_url, ctx, track=("bilibili", bvid, page))
 
     async def join_and_play_netease(self, voice_channel: discord.VoiceChannel, id: int, ctx: discord.ApplicationContext):
-        # 使用musix API获取歌曲信息
-        async with aiohttp.ClientSession() as session:
-            async with session.get(f"{self.musix_api_url}/netease/songs/{id}") as resp:
-                if resp.status != 200:
-                    raise Exception(f"获取歌曲信息失败: HTTP {resp.status}")
-                result = await resp.json()
-                
-                # 检查API响应格式
-                if "data" not in result:
-                    raise Exception(f"API响应格式错误: {result}")
-                
-                info = result.get("data", {})
-        
+        response = await _acknowledge(ctx, f"🔎 正在解析网易云歌曲：{id}")
+        # 使用musix API获取歌曲信息（带缓存）
+        info = await self._resolve(response, "netease", self.musix.track_info("netease", id))
+
         title = info["title"]
         author = info["author"]
         al_name = info["album_name"]
@@ -147,114 +751,794 @@ class TTSPlayerService:
         embed.set_footer(text=f"歌曲id：{id}")
         otto_respond = "接下来播放：" + title
 
-        await ctx.respond(otto_respond, embed=embed)
+        await _edit_response(response, content=otto_respond, embed=embed)
 
         if download_url is None:
             raise Exception("无法解析该音频")
         await self.join_and_speak(voice_channel, otto_respond, str(os.getenv("SPEAK_API_URL")), ctx)
-        await self.join_and_play_url(voice_channel, download_url, ctx)
+        await self.join_and_play_url(voice_channel, download_url, ctx, track=("netease", id, 0))
+
+    async def join_and_play_netease_collection(self, voice_channel: discord.VoiceChannel, kind: str, id: int, ctx: discord.ApplicationContext):
+        # kind 为 playlist（歌单）或 album（专辑）
+        response = await _acknowledge(ctx, f"🔎 正在解析网易云{'歌单' if kind == 'playlist' else '专辑'}：{id}")
+        data = await self._resolve(response, "netease", self.musix.collection("netease", kind, id))
+        tracks = [("netease", song["id"], 0) for song in data.get("tracks", []) if song.get("id") is not None]
+        if not tracks:
+            await _edit_response(response, content="❌ 没有可播放的歌曲")
+            raise Exception("没有可播放的歌曲")
+        title = data.get("title") or data.get("name") or f"{kind} {id}"
+        await self.join_and_play_tracks(voice_channel, tracks, title, ctx, data.get("cover") or data.get("pic"), response)
+
+    async def join_and_play_bilibili_pages(self, voice_channel: discord.VoiceChannel, bvid: str, ctx: discord.ApplicationContext):
+        response = await _acknowledge(ctx, f"🔎 正在解析 bilibili 视频：{bvid}")
+        # 这里只需要分P列表和标题，每个分P的播放地址在加入队列时再取
+        info = await self._resolve(response, "bilibili", self.musix.track_info("bilibili", bvid, 0, need_url=False))
+        pages = [part["page"] for part in info.get("pages", []) if "page" in part]
+        if len(pages) <= 1:
+            await self.join_and_play_bilibili(voice_channel, bvid, ctx, response=response)
+            return
+        tracks = [("bilibili", bvid, page) for page in pages]
+        await self.join_and_play_tracks(voice_channel, tracks, info["title"], ctx, info.get("pic"), response)
 
-    async def _player_loop(self, guild_id: int, ctx: discord.ApplicationContext):
-        queue = self.queues[guild_id]
+    async def join_and_play_tracks(self, voice_channel: discord.VoiceChannel, tracks: list[tuple], title: str, ctx: discord.ApplicationContext, thumbnail: str | None = None, response=None):
+        """批量加入曲目：只发一条汇总消息，元数据并发受限地解析，每首解析完就按顺序加入队列
 
-        while not queue.empty():
-            voice_channel, content, speak_api_url = await queue.get()
+        response 为已确认交互时发出的占位消息，在其上原地更新。
+        """
+        guild_id = voice_channel.guild.id
+        total = len(tracks)
+        tracks = tracks[:PLAYLIST_MAX_TRACKS]
+
+        embed = discord.Embed(title=title, description=f"共 {total} 首，正在依次加入播放队列")
+        if thumbnail:
+            embed.set_thumbnail(url=thumbnail)
+        if total > len(tracks):
+            embed.set_footer(text=f"单次最多加入 {PLAYLIST_MAX_TRACKS} 首")
+        otto_respond = f"接下来播放：{title}"
+        if response is None:
+            response = await _acknowledge(ctx, otto_respond, embed=embed)
+        else:
+            await _edit_response(response, content=otto_respond, embed=embed)
+        await self.join_and_speak(voice_channel, otto_respond, str(os.getenv("SPEAK_API_URL")), ctx)
+
+        added = failed = 0
+        full = False
+        started = time.monotonic()
+        async for track, info in self.musix.resolve_tracks(tracks):
+            audio_url = info.get(SIGNED_URL_FIELDS[track[0]]) if isinstance(info, dict) else None
+            if audio_url is None:
+                failed += 1
+                self.log(guild_id, f"⚠️ 无法解析曲目，已跳过：{info}", track=f"{track[0]} {track[1]} {track[2]}")
+                continue
             try:
-                if speak_api_url:  # TTS 播放
-                    await self._play_once(voice_channel, content, speak_api_url, ctx)
-                elif content.startswith("stream:"):  # 流式播放 URL
-                    await self._stream_url(voice_channel, content.replace("stream:", "", 1), ctx)
-                else:  # 默认行为：先下载再播放
-                    await self._play_url(voice_channel, content, ctx)
-
-            except Exception as e:
-                self.log(guild_id, f"❌ 播放失败：{e}")
-                await _send_error_to_voice_channel(f"❌ 播放时发生错误: {str(e)}", ctx)
-
-    async def _play_once(self, voice_channel: discord.VoiceChannel, message: str, speak_api_url: str, ctx: discord.ApplicationContext):
+                if track[0] == "bilibili":
+                    await self.join_and_stream_url(voice_channel, audio_url, ctx, track=track)
+                else:
+                    await self.join_and_play_url(voice_channel, audio_url, ctx, track=track)
+            except QueueFullError:
+                full = True
+                self.log(guild_id, f"⚠️ 播放队列已满，停止批量加入：已加入 {added} 首")
+                break
+            added += 1
+
+        self.log(guild_id, f"📚 批量加入完成：{added} 首，失败 {failed} 首", latency=round(time.monotonic() - started, 3))
+        embed.description = f"已加入 {added} 首" + (f"，{failed} 首无法解析" if failed else "")
+        if full:
+            embed.description += f"，队列已满（最多 {MAX_QUEUE_PER_GUILD} 项），其余未加入"
+        try:
+            await _edit_response(response, embed=embed)
+        except Exception:
+            pass
+
+    async def _player_worker(self, player: GuildPlayer):
+        guild_id = player.guild_id
+        queue = self.queues[guild_id]
+
+        try:
+            while True:
+                player.state = PlayerState.IDLE
+                item = await self._next_item(player, queue)
+                if item is None:
+                    break
+
+                player.current = item
+                merged = 0
+                self._persist(guild_id)
+                if item.speak_api_url and self.guild_settings[guild_id].tts_coalesce_window > 0:
+                    merged = await self._coalesce_tts(guild_id, queue, item)
+                ffmpeg = self.governor.resources["ffmpeg"]
+                if ffmpeg.busy():
+                    player.state = PlayerState.WAITING
+                    self.log(guild_id, f"⏳ 全局播放数已满，排在第 {ffmpeg.position(guild_id)} 位")
+                try:
+                    # 每个正在播放的服务器占用一个 ffmpeg 名额，直到本项播放结束
+                    async with self.governor.slot("ffmpeg", guild_id):
+                        player.state = PlayerState.BUFFERING
+                        # 当前曲目播放期间，提前准备后面几项
+                        self._schedule_prefetch(guild_id)
+                        await self._play_item(item)
+                except Exception as e:
+                    command = getattr(item.ctx, "command", None)
+                    self.log(guild_id, f"❌ 播放失败：{e}", command=command.name if command else None, track=item.content)
+                    await _send_error_to_voice_channel(f"❌ 播放时发生错误: {str(e)}", item.ctx)
+                finally:
+                    player.current = None
+                    player.source = None
+                    # 合并进来的朗读随本项一起完成
+                    for _ in range(1 + merged):
+                        queue.task_done()
+                    self._persist(guild_id)
+        finally:
+            if self.players.get(guild_id) is player:
+                del self.players[guild_id]
+
+        # 空闲等待超时的同时可能恰好有曲目加入：当时本播放器仍在登记中，没有为它启动新的播放器
+        if not queue.empty():
+            self._ensure_player(guild_id)
+        await self._disconnect_idle(player)
+
+    async def _coalesce_tts(self, guild_id: int, queue: PlayQueue, item: QueueItem) -> int:
+        """把紧随其后、在合并窗口内到达的朗读并入 item，返回并入的项数"""
+        window = self.guild_settings[guild_id].tts_coalesce_window
+        messages = [item.content]
+        last_at = item.enqueued_at
+        while True:
+            head = queue.peek(1)
+            if not head:
+                # 队列已空：等到最后一条消息之后的窗口结束，看是否还有后续
+                remaining = last_at + window - time.monotonic()
+                if remaining <= 0:
+                    break
+                await asyncio.sleep(remaining)
+                if not queue.peek(1):
+                    break
+                continue
+            nxt = head[0]
+            if (nxt.speak_api_url != item.speak_api_url or nxt.voice_channel != item.voice_channel
+                    or nxt.enqueued_at - last_at > window
+                    or sum(map(len, messages)) + len(nxt.content) > TTS_COALESCE_MAX_CHARS):
+                break
+            queue.get_nowait()
+            nxt.discard_prefetch()
+            messages.append(nxt.content)
+            last_at = nxt.enqueued_at
+            self.log(guild_id, f"🧩 合并朗读：{nxt.content}")
+
+        merged = len(messages) - 1
+        if merged:
+            # 句末已有标点的直接相连，否则补一个句号作停顿
+            item.content = "".join(m if m.endswith(_SENTENCE_ENDINGS) else m + "。" for m in messages[:-1]) + messages[-1]
+            item.discard_prefetch()
+            metrics.TTS_COALESCED.inc(merged)
+            self.log(guild_id, f"🧩 {len(messages)} 条朗读合并为一次合成")
+            self._persist(guild_id)
+        return merged
+
+    async def _next_item(self, player: GuildPlayer, queue: PlayQueue) -> QueueItem | None:
+        """取出下一项；队列为空时最多等待 VOICE_IDLE_LINGER 秒，超时返回 None"""
+        if not queue.empty():
+            return queue.get_nowait()
+        if VOICE_IDLE_LINGER <= 0:
+            return None
+
+        vc = player.voice_client
+        if vc is not None and vc.is_connected():
+            self.log(player.guild_id, f"💤 队列播放完毕，语音连接保留 {VOICE_IDLE_LINGER:g} 秒")
+        try:
+            return await asyncio.wait_for(queue.get(), timeout=VOICE_IDLE_LINGER)
+        except asyncio.TimeoutError:
+            return None
+
+    async def _disconnect_idle(self, player: GuildPlayer):
+        # 播放器已从 players 中移除，之后加入的曲目会启动新的播放器，并在连接锁上等待这里断开完成
+        vc = player.voice_client
+        if vc is None:
+            return
+        async with self.connect_locks[player.guild_id]:
+            # 新的播放器已接管该服务器（可能正在缓冲），连接留给它继续使用
+            if self.players.get(player.guild_id) not in (None, player):
+                return
+            if vc.is_connected() and not vc.is_playing():
+                self.log(player.guild_id, "🔇 队列播放完毕，断开语音连接" if VOICE_IDLE_LINGER <= 0 else "🔇 空闲超时，断开语音连接")
+                await vc.disconnect(force=True)
+
+    async def _play_item(self, item: QueueItem):
+        if item.speak_api_url:  # TTS 播放
+            await self._play_once(item.voice_channel, item.content, item.speak_api_url, item.ctx, item.prefetch)  # type: ignore
+        elif item.is_stream:  # 流式播放 URL
+            await self._stream_url(item.voice_channel, item.content.replace("stream:", "", 1), item.ctx, item.prefetch, item.track)  # type: ignore
+        else:  # 默认行为：先下载再播放
+            await self._play_url(item.voice_channel, item.content, item.ctx, item.prefetch, item.track)  # type: ignore
+
+    def _current_item(self, guild_id: int) -> QueueItem | None:
+        player = self.players.get(guild_id)
+        return player.current if player else None
+
+    def _start_offset(self, guild_id: int) -> float:
+        item = self._current_item(guild_id)
+        return item.offset if item is not None and item.seekable else 0.0
+
+    def _loudness_gain(self, item: QueueItem | None, source: bytes | str | None, headers: str | None = None) -> float | None:
+        """返回按缓存的响度测量应调整的增益（dB）；未测量过时安排后台测量，本次原样播放
+
+        source 为测量用的音频：内存中的字节、本地文件或地址，None 时从曲目地址重新读取。
+        """
+        if self.loudness is None or item is None:
+            return None
+        key = _loudness_key(item)
+        if key is None:
+            return None
+        gain = self.loudness.gain(key)
+        if gain is None:
+            if source is None:
+                if item.speak_api_url:
+                    return None
+                source = item.content
+            self.loudness.analyze(key, source, headers)
+        return gain
+
+    def _metered(self, guild_id: int, audio_source: discord.AudioSource) -> discord.AudioSource:
+        player = self.players.get(guild_id)
+        item = player.current if player else None
+        if item is None:
+            return audio_source
+
+        def on_first_frame():
+            metrics.FIRST_AUDIO_SECONDS.observe(time.monotonic() - item.enqueued_at, kind=item.kind)
+
+        return _MeteredSource(audio_source, on_first_frame)
+
+    def _schedule_prefetch(self, guild_id: int):
+        settings = self.guild_settings[guild_id]
+        upcoming = self.queues[guild_id].peek(settings.prefetch_depth)
+        used = sum(item.prefetch_size for item in upcoming)
+
+        # 全局播放名额已满时不提前启动流式播放的 ffmpeg 进程
+        ffmpeg_busy = self.governor.resources["ffmpeg"].busy()
+        for item in upcoming:
+            if used >= settings.prefetch_memory_bytes:
+                break
+            # 开启合并时朗读可能并入前一项，单独合成的结果会被丢弃
+            if item.speak_api_url and settings.tts_coalesce_window > 0:
+                continue
+            if item.prefetch is None and not (item.is_stream and ffmpeg_busy):
+                item.prefetch = asyncio.create_task(self._prefetch_item(guild_id, item))
+
+    async def _prefetch_item(self, guild_id: int, item: QueueItem):
+        if item.is_stream:
+            audio_url = item.content.replace("stream:", "", 1)
+            audio_source = await self._open_stream(guild_id, audio_url, item.track, _channel_bitrate(item.voice_channel), item.offset if item.seekable else 0.0, item)
+            if isinstance(audio_source, _IngestSource):
+                item.prefetch_size = audio_source.buffer.capacity
+            return audio_source
+
+        cached = await self._cached_track(guild_id, item.track, item.content)
+        if cached is not None:
+            return cached
+
+        if item.speak_api_url:
+            chunks = _split_tts_text(item.content)
+            if len(chunks) > 1:
+                # 长朗读分段播放，只需预热第一段的缓存
+                await self._fetch_tts_audio(guild_id, item.speak_api_url, chunks[0])
+                return None
+            data = await self._fetch_tts_audio(guild_id, item.speak_api_url, item.content)
+        elif DOWNLOAD_MODE == "stream":
+            # 只填满预缓冲区，其余部分在播放时继续下载
+            buffer = self._start_progressive_download(guild_id, item.content)
+            item.prefetch_size = buffer.capacity
+            self.log(guild_id, f"📦 预取已开始缓冲：{item.content}")
+            return buffer
+        else:
+            data = await self._download_audio(guild_id, item.content)
+
+        # 超出本服务器的预取内存预算则丢弃，播放时再现取
+        settings = self.guild_settings[guild_id]
+        upcoming = self.queues[guild_id].peek(settings.prefetch_depth)
+        used = sum(other.prefetch_size for other in upcoming if other is not item)
+        if used + len(data) > settings.prefetch_memory_bytes:
+            self.log(guild_id, f"⚠️ 预取超出内存预算，放弃缓存：{item.content}")
+            return None
+
+        item.prefetch_size = len(data)
+        self.log(guild_id, f"📦 预取完成：{item.content}")
+        return data
+
+    async def _take_prefetched(self, guild_id: int, prefetch: asyncio.Task | None):
+        if prefetch is None:
+            return None
+        try:
+            return await prefetch
+        except asyncio.CancelledError:
+            return None
+        except Exception as e:
+            self.log(guild_id, f"⚠️ 预取失败，改为现取：{e}")
+            return None
+
+    def set_prefetch(self, guild_id: int, depth: int, memory_mb: int):
+        settings = self.guild_settings[guild_id]
+        settings.prefetch_depth = depth
+        settings.prefetch_memory_bytes = memory_mb * 1024 * 1024
+        # 超出新深度的预取结果直接丢弃
+        for item in list(self.queues[guild_id]._queue)[depth:]:  # type: ignore
+            item.discard_prefetch()
+        self.log(guild_id, f"⚙️ 预取设置：深度 {depth}，内存预算 {memory_mb} MB")
+
+    def set_tts_coalesce(self, guild_id: int, window_ms: int):
+        self.guild_settings[guild_id].tts_coalesce_window = window_ms / 1000
+        if window_ms > 0:
+            # 已排队的朗读可能被合并，单独预取的结果作废
+            for item in list(self.queues[guild_id]._queue):  # type: ignore
+                if item.speak_api_url:
+                    item.discard_prefetch()
+        self.log(guild_id, f"⚙️ 朗读合并窗口：{window_ms} 毫秒" if window_ms > 0 else "⚙️ 已关闭朗读合并")
+
+    async def remove(self, guild_id: int, position: int) -> QueueItem:
+        queue = self.queues[guild_id]
+        if position < 1 or position > queue.qsize():
+            raise Exception(f"队列中没有第 {position} 项")
+        item = queue.remove(position - 1)
+        item.discard_prefetch()
+        self.log(guild_id, f"🗑️ 已移出队列：{item.content}")
+        self._schedule_prefetch(guild_id)
+        self._persist(guild_id)
+        return item
+
+    async def _play_once(self, voice_channel: discord.VoiceChannel, message: str, speak_api_url: str, ctx: discord.ApplicationContext, prefetch: asyncio.Task | None = None):
         guild_id = voice_channel.guild.id
-        self.log(guild_id, "🌐 请求语音合成")
+        chunks = _split_tts_text(message)
+        if len(chunks) > 1:
+            # 预取只预热了第一段的缓存
+            await self._take_prefetched(guild_id, prefetch)
+            await self._play_chunked(voice_channel, chunks, speak_api_url, ctx)
+            return
 
-        audio_data = await self._fetch_tts_audio(speak_api_url, message)
+        audio_data = await self._take_prefetched(guild_id, prefetch)
+        if audio_data is None:
+            self.log(guild_id, "🌐 请求语音合成")
+            audio_data = await self._fetch_tts_audio(guild_id, speak_api_url, message)
         if audio_data is None:
             self.log(guild_id, "❌ 获取语音数据失败，跳过播放")
             raise Exception("❌ 获取语音数据失败，跳过播放")
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".wav") as tmp_file:
-            tmp_file.write(audio_data)
-            temp_path = tmp_file.name
-
-        self.log(guild_id, f"📁 写入临时文件完成：{temp_path}")
-
         vc = await self._prepare_voice_client(voice_channel, guild_id)
         if vc is None:
-            os.remove(temp_path)
             return
 
-        await self._play_audio_file(guild_id, vc, temp_path, message, ctx)  # type: ignore
+        await self._play_audio(guild_id, vc, audio_data, ".wav", message, ctx)  # type: ignore
 
-    async def _play_url(self, voice_channel: discord.VoiceChannel, audio_url: str, ctx: discord.ApplicationContext):
+    async def _play_chunked(self, voice_channel: discord.VoiceChannel, chunks: list[str], speak_api_url: str, ctx: discord.ApplicationContext):
+        """分段合成长朗读：最多 TTS_CHUNK_CONCURRENCY 段同时合成，按顺序接在同一次播放中"""
+        guild_id = voice_channel.guild.id
+        self.log(guild_id, f"✂️ 长朗读切分为 {len(chunks)} 段合成")
+        semaphore = asyncio.Semaphore(TTS_CHUNK_CONCURRENCY)
+
+        async def synthesize(chunk: str):
+            async with semaphore:
+                # 每段单独缓存，重复的句子无需再次合成
+                return await self._fetch_tts_audio(guild_id, speak_api_url, chunk)
+
+        tasks = [asyncio.create_task(synthesize(chunk)) for chunk in chunks]
+        feeder = chained = None
+        temp_paths = []
+        try:
+            first = await tasks[0]
+            if first is None:
+                self.log(guild_id, "❌ 获取语音数据失败，跳过播放")
+                raise Exception("❌ 获取语音数据失败，跳过播放")
+
+            vc = await self._prepare_voice_client(voice_channel, guild_id)
+            if vc is None:
+                return
+
+            bitrate = _channel_bitrate(vc.channel)
+            gain = self._loudness_gain(self._current_item(guild_id), first)
+
+            def open_chunk(audio_data: bytes) -> discord.AudioSource:
+                audio_source, temp_path = self._open_buffer_source(guild_id, audio_data, ".wav", bitrate, 0.0, gain)
+                if temp_path:
+                    temp_paths.append(temp_path)
+                return audio_source
+
+            chained = _ChainedSource(open_chunk(first))
+
+            async def feed():
+                try:
+                    for index, task in enumerate(tasks[1:], start=2):
+                        try:
+                            audio_data = await task
+                        except Exception as e:
+                            audio_data = None
+                            self.log(guild_id, f"⚠️ 第 {index} 段合成失败：{e}")
+                        if audio_data is None:
+                            self.log(guild_id, f"⚠️ 第 {index} 段语音数据获取失败，跳过")
+                        else:
+                            # 下一段的 ffmpeg 提前启动，切换时无需等待
+                            chained.append(open_chunk(audio_data))
+                finally:
+                    chained.finish()
+
+            feeder = asyncio.create_task(feed())
+            self.log(guild_id, f"🎧 准备播放：{chunks[0]}")
+            error = await self.players[guild_id].play(vc, self._metered(guild_id, chained))
+            if error:
+                self.log(guild_id, f"❌ 播放回调报错：{type(error).__name__}: {str(error)}")
+            else:
+                self.log(guild_id, "🎵 播放完成")
+        finally:
+            for task in tasks:
+                task.cancel()
+            if feeder is not None:
+                feeder.cancel()
+                await asyncio.gather(feeder, return_exceptions=True)
+            if chained is not None:
+                chained.cleanup()
+            for temp_path in temp_paths:
+                if os.path.exists(temp_path):
+                    os.remove(temp_path)
+
+    async def _play_url(self, voice_channel: discord.VoiceChannel, audio_url: str, ctx: discord.ApplicationContext, prefetch: asyncio.Task | None = None, track: tuple | None = None):
         guild_id = voice_channel.guild.id
+
+        prefetched = await self._take_prefetched(guild_id, prefetch)
+        if prefetched is None:
+            prefetched = await self._cached_track(guild_id, track, audio_url)
+        try:
+            audio_data = await self._fetch_url_audio(guild_id, audio_url, prefetched)
+        except DownloadError as e:
+            # 缓存的签名地址已失效：透明地重新获取一次
+            if e.status != 403 or track is None:
+                raise
+            self.log(guild_id, "🔄 播放地址已失效，重新获取")
+            audio_url = await self.musix.refresh_audio_url(*track)
+            if audio_url is None:
+                raise Exception("无法解析该音频")
+            audio_data = await self._fetch_url_audio(guild_id, audio_url)
+
+        try:
+            vc = await self._prepare_voice_client(voice_channel, guild_id)
+            if vc is None:
+                return
+
+            await self._play_audio(guild_id, vc, audio_data, ".mp3", f"URL: {audio_url}", ctx)  # type: ignore
+        finally:
+            if isinstance(audio_data, StreamBuffer):
+                audio_data.close()
+
+    async def _fetch_url_audio(self, guild_id: int, audio_url: str, prefetched=None):
+        """返回可播放的音频：完整的字节、本地缓存文件路径，或已完成预缓冲的 StreamBuffer"""
+        audio_data = prefetched
+        if audio_data is None:
+            if DOWNLOAD_MODE != "stream":
+                return await self._download_audio(guild_id, audio_url)
+            audio_data = self._start_progressive_download(guild_id, audio_url)
+
+        if isinstance(audio_data, StreamBuffer):
+            started = time.monotonic()
+            try:
+                await audio_data.wait_ready(STREAM_PREBUFFER_BYTES)
+            except BaseException:
+                audio_data.close()
+                raise
+            latency = time.monotonic() - started
+            metrics.DOWNLOAD_SECONDS.observe(latency, mode="stream")
+            self.log(guild_id, f"📶 预缓冲完成（{audio_data.bytes_in} 字节），开始播放", track=audio_url, latency=round(latency, 3))
+        return audio_data
+
+    def _start_progressive_download(self, guild_id: int, audio_url: str) -> StreamBuffer:
+        buffer = StreamBuffer(STREAM_BUFFER_BYTES)
+        buffer.feeder = asyncio.create_task(self._download_into(guild_id, audio_url, buffer))
+        return buffer
+
+    async def _download_into(self, guild_id: int, audio_url: str, buffer: StreamBuffer):
+        self.log(guild_id, f"🌐 开始边下边播：{audio_url}")
+        # 超时按下载进度计算：两次读取之间超过 DOWNLOAD_STALL_TIMEOUT 秒才算失败；
+        # connect 同时限制等待空闲连接的时间，连接池占满时尽快失败而不是一直等到别的曲目播完
+        timeout = aiohttp.ClientTimeout(total=None, connect=STREAM_CONNECT_TIMEOUT, sock_connect=10, sock_read=DOWNLOAD_STALL_TIMEOUT)
+        # 下载随播放进度进行、整首曲目期间占用连接，不与元数据探测等短请求共用 cdn 连接池
+        session = self.http_pool.session("stream")
+        try:
+            # 边下边播的下载只在传输时占用名额：缓冲区满、等待播放消耗时交还，名额留给正在传输的下载
+            async with self.governor.slot("download", guild_id) as slot:
+                async with session.get(audio_url, timeout=timeout) as resp:
+                    if resp.status != 200:
+                        self.log(guild_id, f"❌ 下载失败：HTTP {resp.status}")
+                        raise DownloadError(resp.status)
+                    async for chunk in resp.content.iter_chunked(64 * 1024):
+                        if buffer.full:
+                            async with slot.paused():
+                                await buffer.wait_space()
+                        await buffer.write(chunk)
+                        if buffer.closed:
+                            return
+            self.log(guild_id, f"📥 下载完成：共 {buffer.bytes_in} 字节")
+        except Exception as e:
+            self.log(guild_id, f"❌ 下载音频时发生错误: {str(e)}")
+            raise
+        finally:
+            buffer.finish()
+
+    async def _download_audio(self, guild_id: int, audio_url: str) -> bytes:
         self.log(guild_id, f"🌐 请求音频下载：{audio_url}")
 
+        started = time.monotonic()
         try:
             timeout = aiohttp.ClientTimeout(total=10)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.get(audio_url) as resp:
+            session = self.http_pool.session("cdn")
+            async with self.governor.slot("download", guild_id):
+                async with session.get(audio_url, timeout=timeout) as resp:
                     if resp.status != 200:
                         error_message = f"❌ 下载失败：HTTP {resp.status}"
                         self.log(guild_id, error_message)
-                        raise Exception(f"HTTP {resp.status}")
+                        raise DownloadError(resp.status)
                     audio_data = await resp.read()
         except Exception as e:
             error_message = f"❌ 下载音频时发生错误: {str(e)}"
             self.log(guild_id, error_message)
             raise e
 
-        with tempfile.NamedTemporaryFile(delete=False, suffix=".mp3") as tmp_file:
-            tmp_file.write(audio_data)
-            temp_path = tmp_file.name
-
-        self.log(guild_id, f"📁 写入临时文件完成：{temp_path}")
-
-        vc = await self._prepare_voice_client(voice_channel, guild_id)
-        if vc is None:
-            os.remove(temp_path)
+        metrics.DOWNLOAD_SECONDS.observe(time.monotonic() - started, mode="full")
+        return audio_data
+
+    async def _cached_track(self, guild_id: int, track: tuple | None, audio_url: str, headers: dict | None = None) -> str | None:
+        """返回曲目在本地缓存中的文件路径；未命中但请求足够频繁时在后台下载入缓存，本次仍从上游播放"""
+        path = self._cache_lookup(guild_id, track)
+        if path is None:
+            self._cache_fill(guild_id, track, audio_url, headers)
+        return path
+
+    def _cache_lookup(self, guild_id: int, track: tuple | None) -> str | None:
+        if self.audio_cache is None or track is None:
+            return None
+        path = self.audio_cache.lookup(make_key(*track))
+        if path is not None:
+            self.log(guild_id, f"💽 命中本地音频缓存：{track[0]} {track[1]}")
+        return path
+
+    def _cache_fill(self, guild_id: int, track: tuple | None, audio_url: str, headers: dict | None = None):
+        # 写入缓存在后台进行，播放不等待下载完成；不随预取或播放一起取消
+        cache = self.audio_cache
+        if cache is None or track is None:
             return
+        key = make_key(*track)
+        if not cache.wants(key):
+            return
+        task = asyncio.create_task(self._fill_cache(guild_id, key, track, audio_url, headers))
+        self._cache_fills.add(task)
+        task.add_done_callback(self._cache_fills.discard)
+
+    async def _fill_cache(self, guild_id: int, key: str, track: tuple, audio_url: str, headers: dict | None):
+        self.log(guild_id, f"💽 后台下载曲目到本地缓存：{track[0]} {track[1]}")
+        started = time.monotonic()
+        path = await self.audio_cache.fill(key, lambda tmp_path, limit: self._download_to_file(guild_id, audio_url, tmp_path, limit, headers))  # type: ignore
+        if path is not None:
+            metrics.DOWNLOAD_SECONDS.observe(time.monotonic() - started, mode="cache_fill")
+
+    async def _download_to_file(self, guild_id: int, audio_url: str, path: str, limit: int, headers: dict | None = None):
+        timeout = aiohttp.ClientTimeout(total=None, sock_connect=10, sock_read=DOWNLOAD_STALL_TIMEOUT)
+        session = self.http_pool.session("cdn")
+        try:
+            async with self.governor.slot("download", guild_id):
+                async with session.get(audio_url, headers=headers, timeout=timeout) as resp:
+                    if resp.status != 200:
+                        raise DownloadError(resp.status)
+                    if (resp.content_length or 0) > limit:
+                        raise EntryTooLarge(f"{resp.content_length} 字节")
+                    written = 0
+                    with open(path, "wb") as f:
+                        async for chunk in resp.content.iter_chunked(256 * 1024):
+                            written += len(chunk)
+                            if written > limit:
+                                raise EntryTooLarge(f"超过 {limit} 字节")
+                            # 文件写入放到线程中，不阻塞事件循环
+                            await asyncio.to_thread(f.write, chunk)
+        except Exception as e:
+            self.log(guild_id, f"⚠️ 写入本地音频缓存失败：{e}")
+            raise
+
+    async def _open_stream(self, guild_id: int, audio_url: str, track: tuple | None, bitrate: int, offset: float = 0.0, item: QueueItem | None = None) -> discord.AudioSource:
+        if track:
+            # 命中缓存时无需探测签名地址是否失效
+            cached = self._cache_lookup(guild_id, track)
+            if cached is None:
+                audio_url = await self._refresh_stale_stream_url(guild_id, audio_url, track)
+                self._cache_fill(guild_id, track, audio_url, _stream_headers(audio_url, track))
+            if cached is not None:
+                return self._make_source(cached, bitrate, None, offset, gain=self._loudness_gain(item, cached))
+        headers = _stream_headers(audio_url, track)
+        codec = await self._stream_codec(guild_id, audio_url, track)
+        gain = self._loudness_gain(item, audio_url, _header_lines(headers))
+        # 续播时由 ffmpeg 按时间直接跳转，不经过缓冲区
+        if STREAM_INGEST_MODE == "buffered" and offset <= 0:
+            return await self._open_ingest_source(guild_id, audio_url, headers, bitrate, codec, gain, live=track is None)
+        return self._open_stream_source(audio_url, headers, bitrate, codec, offset, gain)
+
+    async def _refresh_stale_stream_url(self, guild_id: int, audio_url: str, track: tuple) -> str:
+        # 刚从 musix 取到的地址直接使用；缓存较久或已不在缓存中（如重启前保存的）的地址先探测，403 时重新获取
+        age = self.musix.url_age(*track)
+        if age is not None and age < MUSIX_URL_PROBE_AFTER:
+            return audio_url
+
+        session = self.http_pool.session("cdn")
+        headers = {**_stream_headers(audio_url, track), "Range": "bytes=0-0"}
+        try:
+            async with session.get(audio_url, headers=headers, timeout=aiohttp.ClientTimeout(total=5)) as resp:
+                status = resp.status
+        except Exception as e:
+            self.log(guild_id, f"⚠️ 探测播放地址失败：{e}")
+            return audio_url
+
+        if status != 403:
+            return audio_url
+        self.log(guild_id, "🔄 播放地址已失效，重新获取")
+        return await self.musix.refresh_audio_url(*track) or audio_url
+
+    def _make_source(self, source, bitrate: int, codec: str | None = None, offset: float = 0.0, gain: float | None = None, **kwargs) -> discord.AudioSource:
+        started = time.perf_counter()
+        if offset > 0:
+            # 地址和文件在输入端直接跳转；管道无法跳转，由 ffmpeg 解码后丢弃开头部分
+            key = "options" if kwargs.get("pipe") else "before_options"
+            kwargs[key] = f"-ss {offset:.2f} {kwargs.get(key, '')}".strip()
+        if gain:
+            # 加滤镜后不能再透传 Opus，由 ffmpeg 重新编码
+            codec = None
+            kwargs["options"] = f"{kwargs.get('options', '')} -af volume={gain:.2f}dB".strip()
+        if AUDIO_ENCODER == "opus":
+            # 由 ffmpeg 按频道码率编码 Opus（codec 为 opus 时直接透传），省去进程内逐帧编码
+            audio_source = discord.FFmpegOpusAudio(source, bitrate=bitrate, codec=codec, executable=self.ffmpeg_path, **kwargs)
+        else:
+            audio_source = discord.FFmpegPCMAudio(source, executable=self.ffmpeg_path, **kwargs)
+        metrics.FFMPEG_SPAWN_SECONDS.observe(time.perf_counter() - started)
+        self._ffmpeg_sources.add(audio_source)
+        return audio_source
+
+    async def _stream_codec(self, guild_id: int, audio_url: str, track: tuple | None) -> str | None:
+        # bilibili 等解析出的曲目编码已知，不是 Opus；只探测用户直接给出的流地址
+        if AUDIO_ENCODER != "opus" or not OPUS_PROBE_STREAMS or track is not None:
+            return None
+        try:
+            codec, _ = await discord.FFmpegOpusAudio.probe(audio_url, executable=self.ffmpeg_path)
+        except Exception as e:
+            self.log(guild_id, f"⚠️ 探测流编码失败：{e}")
+            return None
+        if codec == "opus":
+            self.log(guild_id, "🎼 源为 Opus 编码，直接透传")
+        return codec
+
+    def _open_stream_source(self, audio_url: str, headers: dict, bitrate: int, codec: str | None = None, offset: float = 0.0, gain: float | None = None) -> discord.AudioSource:
+        return self._make_source(audio_url, bitrate, codec, offset, gain, before_options=f"-headers {shlex.quote(_header_lines(headers))}")
+
+    async def _open_ingest_source(self, guild_id: int, audio_url: str, headers: dict, bitrate: int, codec: str | None = None, gain: float | None = None, live: bool = True) -> discord.AudioSource:
+        buffer = StreamBuffer(STREAM_JITTER_BUFFER_BYTES, refill=STREAM_JITTER_PREBUFFER_BYTES)
+        buffer.on_stall = lambda: metrics.STREAM_STALLS.inc(reason="underrun")
+        buffer.feeder = asyncio.create_task(self._ingest_stream(guild_id, audio_url, headers, buffer, live))
+        started = time.monotonic()
+        try:
+            await buffer.wait_ready(STREAM_JITTER_PREBUFFER_BYTES)
+            audio_source = self._make_source(buffer, bitrate, codec, gain=gain, pipe=True)
+        except BaseException:
+            buffer.close()
+            raise
+        latency = time.monotonic() - started
+        metrics.DOWNLOAD_SECONDS.observe(latency, mode="ingest")
+        self.log(guild_id, f"📶 拉流预缓冲完成（{buffer.bytes_in} 字节），开始播放", track=audio_url, latency=round(latency, 3))
+        return _IngestSource(audio_source, buffer)
+
+    async def _ingest_stream(self, guild_id: int, audio_url: str, headers: dict, buffer: StreamBuffer, live: bool = True):
+        """把流写入抖动缓冲区；连接出错、卡住或提前关闭时重连，源支持 Range 时从已收到的位置续传，直播流从最新位置接上
+
+        长度未知的连接被正常关闭时，只有确实是直播的源（live 为 True 即用户给出的 /stream_url，且响应带 ICY 头或支持 Range）
+        才视为中断（如 CDN 轮换连接）并重连，这类重连单独计数、收到数据也不清零；其余情况连接关闭即视为读完，
+        以免把分块传输的定长文件当成直播反复重放。
+        """
+        self.log(guild_id, f"🌐 开始拉流：{audio_url}")
+        # 与边下边播相同：connect 限制等待空闲连接的时间，长时间占用连接的拉流使用单独的 stream 连接池
+        timeout = aiohttp.ClientTimeout(total=None, connect=STREAM_CONNECT_TIMEOUT, sock_connect=10, sock_read=STREAM_STALL_TIMEOUT)
+        session = self.http_pool.session("stream")
+        received = 0
+        # 有固定长度的源（如解析出的视频音频）的总字节数；直播流为 None
+        length = None
+        ranges = False
+        # 响应带 ICY 头（icy-metaint、icy-name 等）的网络电台
+        icy = False
+        failures = reconnects = clean_eofs = 0
+        try:
+            # 与边下边播相同，等待缓冲区腾出空间或重连退避时交还名额
+            async with self.governor.slot("download", guild_id) as slot:
+                while not buffer.closed:
+                    request_headers = dict(headers)
+                    if received and ranges:
+                        request_headers["Range"] = f"bytes={received}-"
+                    try:
+                        async with session.get(audio_url, headers=request_headers, timeout=timeout) as resp:
+                            if resp.status not in (200, 206):
+                                raise DownloadError(resp.status)
+                            if resp.status == 206:
+                                ranges = True
+                                length = _content_total(resp.headers.get("Content-Range")) or length
+                                skip = 0
+                            else:
+                                ranges = resp.headers.get("Accept-Ranges", "").lower() == "bytes"
+                                icy = any(name.lower().startswith("icy-") for name in resp.headers)
+                                length = resp.content_length
+                                # 不支持续传的定长源只能从头再下一遍，跳过已收到的部分；直播流直接接上
+                                skip = received if length is not None else 0
+                            if received:
+                                mode = "range" if resp.status == 206 else ("skip" if skip else "live")
+                                metrics.STREAM_RECONNECTS.inc(mode=mode)
+                                reconnects += 1
+                                self.log(guild_id, f"🔄 拉流已重连（{mode}），已接收 {received} 字节")
+
+                            async for chunk in resp.content.iter_chunked(64 * 1024):
+                                if skip:
+                                    if len(chunk) <= skip:
+                                        skip -= len(chunk)
+                                        continue
+                                    chunk, skip = chunk[skip:], 0
+                                if buffer.full:
+                                    async with slot.paused():
+                                        await buffer.wait_space()
+                                await buffer.write(chunk)
+                                if buffer.closed:
+                                    return
+                                received += len(chunk)
+                                failures = 0
+                        # 已知长度且已读完才算结束；定长源未读完按中断重连
+                        if length is not None and received >= length:
+                            break
+                        if length is None:
+                            if not (live and (icy or ranges)):
+                                break
+                            clean_eofs += 1
+                            if clean_eofs > STREAM_RECONNECT_ATTEMPTS:
+                                self.log(guild_id, f"⚠️ 直播流已被关闭 {clean_eofs} 次，停止重连")
+                                break
+                        reason = "连接被关闭" if length is None else "短读"
+                    except (aiohttp.ClientError, asyncio.TimeoutError, DownloadError) as e:
+                        # 还没收到过数据时直接报错，由命令回复用户
+                        if not received:
+                            raise
+                        reason = str(e) or type(e).__name__
+
+                    failures += 1
+                    metrics.STREAM_STALLS.inc(reason="disconnect")
+                    if failures > STREAM_RECONNECT_ATTEMPTS:
+                        self.log(guild_id, f"❌ 拉流重连 {STREAM_RECONNECT_ATTEMPTS} 次仍失败，停止播放")
+                        break
+                    delay = _backoff_delay(failures, STREAM_RECONNECT_BACKOFF, STREAM_RECONNECT_BACKOFF_MAX)
+                    self.log(guild_id, f"⚠️ 拉流中断（{reason}），{delay:.1f} 秒后第 {failures} 次重连")
+                    async with slot.paused():
+                        await asyncio.sleep(delay)
+            self.log(guild_id, f"📥 拉流结束：共 {received} 字节，重连 {reconnects} 次，缓冲区读空 {buffer.stalls} 次")
+        except Exception as e:
+            self.log(guild_id, f"❌ 拉流时发生错误: {str(e)}")
+            raise
+        finally:
+            buffer.finish()
 
-        await self._play_audio_file(guild_id, vc, temp_path, f"URL: {audio_url}", ctx)  # type: ignore
-
-    async def _stream_url(self, voice_channel: discord.VoiceChannel, audio_url: str, ctx: discord.ApplicationContext):
+    async def _stream_url(self, voice_channel: discord.VoiceChannel, audio_url: str, ctx: discord.ApplicationContext, prefetch: asyncio.Task | None = None, track: tuple | None = None):
         guild_id = voice_channel.guild.id
         self.log(guild_id, f"📡 正在流式播放：{audio_url}")
 
         vc = await self._prepare_voice_client(voice_channel, guild_id)
         if vc is None:
+            audio_source = await self._take_prefetched(guild_id, prefetch)
+            if audio_source is not None:
+                audio_source.cleanup()
             await _send_error_to_voice_channel("❌ 无法连接语音频道", ctx)
             return
 
-        finished = asyncio.Event()
-
-        def after_play(error):
+        try:
+            audio_source = await self._take_prefetched(guild_id, prefetch)
+            if audio_source is None:
+                audio_source = await self._open_stream(guild_id, audio_url, track, _channel_bitrate(voice_channel), self._start_offset(guild_id), self._current_item(guild_id))
+            if isinstance(audio_source, _IngestSource):
+                self.stream_buffers[guild_id] = audio_source.buffer
+            error = await self.players[guild_id].play(vc, self._metered(guild_id, audio_source))
             if error:
                 self.log(guild_id, f"❌ 流式播放回调错误：{error}")
             else:
                 self.log(guild_id, "🎵 流式播放完成")
-            self.bot.loop.call_soon_threadsafe(finished.set)
-
-        try:
-            self.current_voice_clients[guild_id] = vc  # type: ignore
-
-            if vc.is_playing():  # type: ignore
-                self.log(guild_id, "⏳ 等待当前播放完成")
-                wait_event = asyncio.Event()
-                def temp_after(error=None): wait_event.set()  # type: ignore
-                vc._player.after = temp_after  # type: ignore
-                await wait_event.wait()
-
-            audio_source = discord.FFmpegPCMAudio(audio_url, executable=self.ffmpeg_path, before_options="-headers 'Referer: https://www.bilibili.com\r\nUser-Agent: Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/91.0.4472.124 Safari/537.36'")
-            vc.play(audio_source, after=after_play)
-            await finished.wait()
 
         except Exception as e:
             error_msg = f"{type(e).__name__}: {str(e)}"
@@ -262,72 +1546,94 @@ class TTSPlayerService:
             self.log(guild_id, f"❌ 异常详情：{traceback.format_exc()}")
             await _send_error_to_voice_channel(f"❌ 流式播放异常：{error_msg}", ctx)
         finally:
-            self.current_voice_clients.pop(guild_id, None)
+            # 正常结束时播放线程已经关闭；未能开始播放时在这里停止拉流
+            buffer = self.stream_buffers.pop(guild_id, None)
+            if buffer is not None:
+                buffer.close()
+
+    def _open_buffer_source(self, guild_id: int, audio_data: bytes | StreamBuffer | str, suffix: str, bitrate: int, offset: float = 0.0, gain: float | None = None):
+        """为内存中的音频创建音频源，返回 (音频源, 临时文件路径或 None)"""
+        started = time.perf_counter()
+        temp_path = None
+        disk_bytes = 0
+
+        if isinstance(audio_data, str):
+            # 本地缓存文件由 ffmpeg 直接读取
+            audio_source = self._make_source(audio_data, bitrate, None, offset, gain)
+            self.playback_stats["tracks"] += 1
+            return audio_source, None
+
+        head = audio_data.peek(64) if isinstance(audio_data, StreamBuffer) else audio_data[:64]
+        codec = "opus" if _is_ogg_opus(head) else None
+
+        if isinstance(audio_data, StreamBuffer):
+            audio_source = self._make_source(audio_data, bitrate, codec, offset, gain, pipe=True)
+        elif AUDIO_PLAYBACK_MODE == "tempfile":
+            with tempfile.NamedTemporaryFile(delete=False, suffix=suffix) as tmp_file:
+                tmp_file.write(audio_data)
+                temp_path = tmp_file.name
+            disk_bytes = len(audio_data)
+            metrics.TEMPFILE_WRITE_SECONDS.observe(time.perf_counter() - started)
+            self.log(guild_id, f"📁 写入临时文件完成：{temp_path}")
+            audio_source = self._make_source(temp_path, bitrate, codec, offset, gain)
+        else:
+            # 由 ffmpeg 的 stdin 写线程读取，事件循环上不做任何磁盘 I/O
+            audio_source = self._make_source(io.BytesIO(audio_data), bitrate, codec, offset, gain, pipe=True)
 
-        if self.queues[guild_id].empty() and vc.is_connected():
-            self.log(guild_id, "🔇 队列播放完毕，断开语音连接")
-            await vc.disconnect(force=True)
+        stall = time.perf_counter() - started
+        self.playback_stats["tracks"] += 1
+        self.playback_stats["disk_bytes_written"] += disk_bytes
+        self.playback_stats["loop_stall_seconds"] += stall
+        self.log(guild_id, f"📊 磁盘写入 {disk_bytes} 字节，事件循环阻塞 {stall * 1000:.1f} ms（{AUDIO_PLAYBACK_MODE}）")
+        return audio_source, temp_path
 
-    async def _play_audio_file(self, guild_id: int, vc: discord.VoiceClient, temp_path: str, description: str, ctx: discord.ApplicationContext):
+    async def _play_audio(self, guild_id: int, vc: discord.VoiceClient, audio_data: bytes | StreamBuffer | str, suffix: str, description: str, ctx: discord.ApplicationContext):
         self.log(guild_id, f"🎧 准备播放：{description}")
-        finished = asyncio.Event()
+        temp_path = None
 
-        def after_play(error):
+        try:
+            gain = self._loudness_gain(self._current_item(guild_id), None if isinstance(audio_data, StreamBuffer) else audio_data)
+            audio_source, temp_path = self._open_buffer_source(guild_id, audio_data, suffix, _channel_bitrate(vc.channel), self._start_offset(guild_id), gain)
+            error = await self.players[guild_id].play(vc, self._metered(guild_id, audio_source))
             if error:
-                error_msg = f"{type(error).__name__}: {str(error)}" if error else "Unknown error"
-                self.log(guild_id, f"❌ 播放回调报错：{error_msg}")
+                self.log(guild_id, f"❌ 播放回调报错：{type(error).__name__}: {str(error)}")
             else:
                 self.log(guild_id, "🎵 播放完成")
 
-            # 线程安全地设置事件
-            self.bot.loop.call_soon_threadsafe(finished.set)
-
-        try:
-            self.current_voice_clients[guild_id] = vc  # type: ignore
-
-            # 如果正在播放，等待其完成
-            if vc.is_playing():  # type: ignore
-                self.log(guild_id, f"⏳ 正在等待当前音频播放结束...")
-                wait_event = asyncio.Event()
-
-                def temp_after(error=None):  # type: ignore
-                    wait_event.set()
-
-                vc._player.after = temp_after  # type: ignore
-                await wait_event.wait()
-
-            audio_source = discord.FFmpegPCMAudio(temp_path, executable=self.ffmpeg_path)
-            vc.play(audio_source, after=after_play)  # type: ignore
-            await finished.wait()
-
         except Exception as e:
             error_msg = f"{type(e).__name__}: {str(e)}"
             self.log(guild_id, f"❌ 播放异常：{error_msg}")
             self.log(guild_id, f"❌ 异常详情：{traceback.format_exc()}")
             await _send_error_to_voice_channel(f"❌ 播放异常：{error_msg}", ctx)
         finally:
-            if os.path.exists(temp_path):
+            if temp_path and os.path.exists(temp_path):
                 os.remove(temp_path)
-            self.current_voice_clients.pop(guild_id, None)
-
-        if self.queues[guild_id].empty() and vc.is_connected():
-            self.log(guild_id, "🔇 队列播放完毕，断开语音连接")
-            await vc.disconnect(force=True)
 
     async def _prepare_voice_client(self, voice_channel: discord.VoiceChannel, guild_id: int):
-        vc = discord.utils.get(self.bot.voice_clients, guild=voice_channel.guild)  # type: ignore
-
-        if vc and vc.is_connected():
-            if vc.channel.id == voice_channel.id:
-                self.log(guild_id, f"🔗 已在目标语音频道，直接播放")
-                return vc
-            else:
-                self.log(guild_id, f"🔁 已连接到其他语音频道（{vc.channel}），准备切换")
-                await vc.disconnect(force=True)
-
-        return await self._safe_connect(voice_channel, guild_id)
-
-    async def _safe_connect(self, voice_channel: discord.VoiceChannel, guild_id: int, retries: int = 3, delay: float = 2.0):
+        player = self.players.get(guild_id)
+        if player is not None:
+            player.state = PlayerState.CONNECTING
+        async with self.connect_locks[guild_id]:
+            vc = discord.utils.get(self.bot.voice_clients, guild=voice_channel.guild)  # type: ignore
+
+            if vc and vc.is_connected():
+                if vc.channel.id == voice_channel.id:
+                    self.log(guild_id, f"🔗 已在目标语音频道，直接播放")
+                else:
+                    self.log(guild_id, f"🔁 已连接到其他语音频道（{vc.channel}），准备切换")
+                    await vc.disconnect(force=True)
+                    vc = None
+
+            if vc is None or not vc.is_connected():
+                vc = await self._safe_connect(voice_channel, guild_id)
+
+        if player is not None:
+            # 记录连接以便空闲超时后断开；音频源准备好之前仍处于缓冲状态
+            player.voice_client = vc
+            player.state = PlayerState.BUFFERING
+        return vc
+
+    async def _safe_connect(self, voice_channel: discord.VoiceChannel, guild_id: int, retries: int = VOICE_CONNECT_RETRIES):
         existing_vc = discord.utils.get(self.bot.voice_clients, guild=voice_channel.guild)  # type: ignore
 
         # ✅ 如果已连接到目标频道，直接复用
@@ -343,14 +1649,18 @@ class TTSPlayerService:
         for attempt in range(1, retries + 1):
             try:
                 self.log(guild_id, f"🔌 第 {attempt} 次尝试连接语音频道...")
+                metrics.VOICE_CONNECT_ATTEMPTS.inc()
+                started = time.monotonic()
                 vc = await asyncio.wait_for(voice_channel.connect(), timeout=10)
-                self.log(guild_id, "✅ 成功连接语音频道")
+                self.log(guild_id, "✅ 成功连接语音频道", latency=round(time.monotonic() - started, 3))
                 return vc
 
             except asyncio.TimeoutError:
+                metrics.VOICE_CONNECT_FAILURES.inc(reason="timeout")
                 self.log(guild_id, f"⏰ 第 {attempt} 次连接超时")
 
             except discord.ClientException as e:
+                metrics.VOICE_CONNECT_FAILURES.inc(reason="client_error")
                 msg = str(e)
                 self.log(guild_id, f"⚠️ 第 {attempt} 次连接失败：{msg}")
                 existing_vc = discord.utils.get(self.bot.voice_clients, guild=voice_channel.guild)  # type: ignore
@@ -361,29 +1671,48 @@ class TTSPlayerService:
                     except Exception as disconnect_err:
                         self.log(guild_id, f"⚠️ 强制断开失败：{disconnect_err}")
 
-            await asyncio.sleep(delay)
+            if attempt < retries:
+                delay = _backoff_delay(attempt)
+                self.log(guild_id, f"⏳ {delay:.1f} 秒后重试连接")
+                await asyncio.sleep(delay)
 
         self.log(guild_id, "❌ 多次尝试仍无法连接语音频道，跳过播放")
         raise Exception("❌ 多次尝试仍无法连接语音频道，跳过播放")
 
-    async def _fetch_tts_audio(self, url: str, message: str):
+    async def _fetch_tts_audio(self, guild_id: int, url: str, message: str):
+        key = make_key(url, message)
+        return await self.tts_cache.get_or_fetch(key, lambda: self._governed_tts_request(guild_id, url, message))
+
+    async def _governed_tts_request(self, guild_id: int, url: str, message: str):
+        # 只有缓存未命中、真正请求 TTS 接口时才占用名额
+        async with self.governor.slot("tts", guild_id):
+            return await self._request_tts_audio(url, message)
+
+    async def _request_tts_audio(self, url: str, message: str):
+        started = time.monotonic()
         try:
             timeout = aiohttp.ClientTimeout(total=10)
-            async with aiohttp.ClientSession(timeout=timeout) as session:
-                async with session.post(url, json={"message": message}) as resp:
-                    if resp.status == 200:
-                        return await resp.read()
-                    else:
-                        self.log(0, f"❌ TTS 接口响应错误: {resp.status}")
-                        raise Exception(f"❌ TTS 接口响应错误: {resp.status}")
+            session = self.http_pool.session("tts")
+            async with session.post(url, json={"message": message}, timeout=timeout) as resp:
+                if resp.status == 200:
+                    audio_data = await resp.read()
+                    latency = time.monotonic() - started
+                    metrics.TTS_SECONDS.observe(latency)
+                    self.log(0, "🗣️ 语音合成完成", level=logging.DEBUG, latency=round(latency, 3))
+                    return audio_data
+                else:
+                    self.log(0, f"❌ TTS 接口响应错误: {resp.status}")
+                    raise Exception(f"❌ TTS 接口响应错误: {resp.status}")
         except Exception as e:
             self.log(0, f"❌ TTS 请求异常：{e}")
             raise e
 
     async def skip(self, guild_id: int):
-        vc = self.current_voice_clients.get(guild_id)
+        player = self.players.get(guild_id)
+        vc = player.voice_client if player and player.state == PlayerState.PLAYING else None
         if vc and vc.is_playing():
             vc.stop()
+            metrics.SKIPS.inc()
             self.log(guild_id, "⏭️ 手动跳过当前播放")
         else:
             self.log(guild_id, "⚠️ 当前没有播放中的音频")